@@ -0,0 +1,179 @@
+"""
+This module provides the compression codecs that can be used for the body
+of gc files.
+
+The bz2 and zlib codecs are always available, lz4 and zstd are available if
+the lz4 or zstandard package is installed.
+"""
+
+from __future__ import unicode_literals, division, print_function
+
+import bz2
+import logging
+import zlib
+
+logger = logging.getLogger(__name__)
+
+NO_COMPRESSION = 'none'
+
+CHUNK_SIZE = 1024 ** 2
+
+
+def _to_bytes(data):
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return data
+
+
+class _NullCompressor(object):
+    def compress(self, data):
+        return _to_bytes(data)
+
+    def flush(self):
+        return b''
+
+
+class _NullDecompressor(object):
+    def decompress(self, data):
+        return _to_bytes(data)
+
+
+class _LZ4Compressor(object):
+    def __init__(self, lz4_frame):
+        self._compressor = lz4_frame.LZ4FrameCompressor()
+        self._header = self._compressor.begin()
+
+    def compress(self, data):
+        header, self._header = self._header, b''
+        return header + self._compressor.compress(_to_bytes(data))
+
+    def flush(self):
+        header, self._header = self._header, b''
+        return header + self._compressor.flush()
+
+
+class Codec(object):
+    """
+    Named pair of factories for streaming compressor and decompressor
+    objects. Compressors provide compress(data) and flush(), decompressors
+    provide decompress(data), like the objects of the zlib module.
+    """
+
+    def __init__(self, name, make_compressor, make_decompressor):
+        self.name = name
+        self.make_compressor = make_compressor
+        self.make_decompressor = make_decompressor
+
+
+def _create_codecs():
+    codecs = {
+        NO_COMPRESSION: Codec(NO_COMPRESSION,
+                              _NullCompressor,
+                              _NullDecompressor),
+        'bz2': Codec('bz2',
+                     bz2.BZ2Compressor,
+                     bz2.BZ2Decompressor),
+        'zlib': Codec('zlib',
+                      zlib.compressobj,
+                      zlib.decompressobj),
+    }
+
+    try:
+        import lz4.frame
+        codecs['lz4'] = Codec('lz4',
+                              lambda: _LZ4Compressor(lz4.frame),
+                              lz4.frame.LZ4FrameDecompressor)
+    except ImportError:
+        logger.debug('lz4 not available.')
+
+    try:
+        import zstandard
+        codecs['zstd'] = Codec(
+            'zstd',
+            lambda: zstandard.ZstdCompressor().compressobj(),
+            lambda: zstandard.ZstdDecompressor().decompressobj())
+    except ImportError:
+        logger.debug('zstandard not available.')
+
+    return codecs
+
+
+CODECS = _create_codecs()
+
+
+def available_compressions():
+    """
+    Return the names of the available compression codecs.
+    """
+    return sorted(CODECS.keys())
+
+
+def get_codec(name):
+    """
+    Return the codec with the given name.
+
+    Raises
+    ------
+    ValueError
+        If the codec is unknown or not available.
+    """
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ValueError('Compression {} not available'.format(name))
+    return codec
+
+
+def iter_chunks(data, chunk_size=CHUNK_SIZE):
+    """
+    Split bytes like data into chunks without copying it as a whole.
+    """
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield view[start:start + chunk_size]
+
+
+def compress_chunks(chunks, name):
+    """
+    Compress a sequence of chunks with a streaming compressor.
+
+    Parameters
+    ----------
+    chunks : iterable of bytes
+        Data to compress.
+    name : str
+        Name of the codec to use.
+
+    Returns
+    -------
+    generator of bytes
+        Compressed data, produced while the input is consumed.
+    """
+    compressor = get_codec(name).make_compressor()
+    for chunk in chunks:
+        compressed = compressor.compress(_to_bytes(chunk))
+        if compressed:
+            yield compressed
+    compressed = compressor.flush()
+    if compressed:
+        yield compressed
+
+
+def compress(data, name):
+    """
+    Compress bytes like data in one go.
+    """
+    return b''.join(compress_chunks(iter_chunks(data), name))
+
+
+def decompress(data, name):
+    """
+    Decompress data that was compressed with the given codec.
+    """
+    if name == NO_COMPRESSION:
+        return data
+    decompressor = get_codec(name).make_decompressor()
+    parts = [decompressor.decompress(_to_bytes(chunk))
+             for chunk in iter_chunks(data)]
+    if hasattr(decompressor, 'flush'):
+        parts.append(decompressor.flush() or b'')
+    return b''.join(parts)
@@ -0,0 +1,233 @@
+"""
+This module provides the version 2 container layout of the gc file format.
+
+In contrast to the version 0.1 layout, which is a single BSON document that
+needs to be read and decoded as a whole, the version 2 layout stores every
+entry (lookup table, frames) as a separate blob and keeps an index of their
+offsets. This allows reading single entries by seeking.
+
+Layout of a version 2 file::
+
+    MAGIC | major version (uint16) | minor version (uint16)
+    entry blobs
+    index (BSON document)
+    index offset (uint64) | index length (uint64) | MAGIC
+
+All integers are little endian and all offsets are relative to the start of
+the container.
+"""
+
+from __future__ import unicode_literals, division, print_function
+
+import logging
+import struct
+
+from bson import BSON
+
+from gazer.compression import NO_COMPRESSION, compress_chunks, decompress, \
+    get_codec, iter_chunks
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'\x89GZC\r\n\x1a\n'
+VERSION = (2, 0)
+
+_HEADER_STRUCT = struct.Struct('<HH')
+_TRAILER_STRUCT = struct.Struct('<QQ')
+
+HEADER_SIZE = len(MAGIC) + _HEADER_STRUCT.size
+TRAILER_SIZE = _TRAILER_STRUCT.size + len(MAGIC)
+
+
+class ContainerFormatError(ValueError):
+    pass
+
+
+def version_string(version=VERSION):
+    return '{}.{}'.format(*version)
+
+
+def is_container(in_file):
+    """
+    Check whether the given file uses the version 2 container layout.
+    The file position is restored afterwards.
+
+    Parameters
+    ----------
+    in_file : file like object
+        Seekable binary stream positioned at the start of the gc data.
+
+    Returns
+    -------
+    bool
+        True if the stream starts with the container magic bytes.
+    """
+    position = in_file.tell()
+    try:
+        return in_file.read(len(MAGIC)) == MAGIC
+    finally:
+        in_file.seek(position)
+
+
+class ContainerWriter(object):
+    """
+    Writes entries sequentially to a binary stream and appends the index
+    when closed. The stream does not need to be seekable.
+    """
+
+    def __init__(self, out_file, scene_type, meta=None,
+                 compression=NO_COMPRESSION):
+        """
+        Parameters
+        ----------
+        out_file : file like object
+            Binary stream the container is written to.
+        scene_type : str
+            Type of the decoder needed to read the scene.
+        meta : dict
+            Additional data stored in the index.
+        compression : str
+            Name of the codec used to compress every entry, see
+            gazer.compression.
+        """
+        get_codec(compression)
+        self.out_file = out_file
+        self.scene_type = scene_type
+        self.compression = compression
+        self.meta = dict(meta) if meta is not None else {}
+        self._entries = {}
+        self._position = 0
+        self._closed = False
+        self._write(MAGIC + _HEADER_STRUCT.pack(*VERSION))
+
+    def _write(self, data):
+        self.out_file.write(data)
+        self._position += len(data)
+
+    def add_entry(self, name, data):
+        """
+        Append a blob to the container.
+
+        Parameters
+        ----------
+        name : str
+            Unique name of the entry.
+        data : bytes
+            Content of the entry.
+        """
+        if self._closed:
+            raise ValueError('Container already closed.')
+        if name in self._entries:
+            raise ValueError('Duplicate entry {}'.format(name))
+        offset = self._position
+        if self.compression == NO_COMPRESSION:
+            self._write(data)
+        else:
+            # Compressed chunks are written as they are produced, so no
+            # compressed copy of the whole entry is kept.
+            for chunk in compress_chunks(iter_chunks(data), self.compression):
+                self._write(chunk)
+        self._entries[name] = [offset, self._position - offset]
+
+    def close(self):
+        """
+        Write the index and trailer. Does not close the underlying stream.
+        """
+        if self._closed:
+            return
+        index = {'encoder': 'gazer',
+                 'version': version_string(),
+                 'compression': self.compression,
+                 'type': self.scene_type,
+                 'meta': self.meta,
+                 'entries': self._entries,
+                 }
+        encoded_index = BSON.encode(index)
+        index_offset = self._position
+        self._write(encoded_index)
+        self._write(_TRAILER_STRUCT.pack(index_offset, len(encoded_index)))
+        self._write(MAGIC)
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ex_type, value, traceback):
+        if ex_type is None:
+            self.close()
+
+
+class ContainerReader(object):
+    """
+    Provides random access to the entries of a version 2 container.
+    Only the header, trailer and index are read on construction.
+    """
+
+    def __init__(self, in_file):
+        self.in_file = in_file
+        self._start = in_file.tell()
+
+        header = in_file.read(HEADER_SIZE)
+        if len(header) != HEADER_SIZE or not header.startswith(MAGIC):
+            raise ContainerFormatError('Not a gc container.')
+        self.version = _HEADER_STRUCT.unpack(header[len(MAGIC):])
+        if self.version[0] != VERSION[0]:
+            msg = 'Unsupported container version {}'.format(
+                version_string(self.version))
+            raise ContainerFormatError(msg)
+
+        in_file.seek(-TRAILER_SIZE, 2)
+        trailer = in_file.read(TRAILER_SIZE)
+        if len(trailer) != TRAILER_SIZE or not trailer.endswith(MAGIC):
+            raise ContainerFormatError('Container trailer missing.')
+        index_offset, index_length = _TRAILER_STRUCT.unpack(
+            trailer[:_TRAILER_STRUCT.size])
+
+        self._index = BSON(self._read(index_offset, index_length)).decode()
+        self._entries = self._index['entries']
+
+    def _read(self, offset, length):
+        self.in_file.seek(self._start + offset)
+        data = self.in_file.read(length)
+        if len(data) != length:
+            raise ContainerFormatError('Unexpected end of file.')
+        return data
+
+    @property
+    def scene_type(self):
+        return self._index['type']
+
+    @property
+    def compression(self):
+        return self._index['compression']
+
+    @property
+    def meta(self):
+        return self._index['meta']
+
+    @property
+    def entry_names(self):
+        return list(self._entries.keys())
+
+    def has_entry(self, name):
+        return name in self._entries
+
+    def read_entry(self, name):
+        """
+        Read a single entry by seeking to its offset.
+
+        Parameters
+        ----------
+        name : str
+            Name of the entry.
+
+        Returns
+        -------
+        bytes
+            Decompressed content of the entry.
+        """
+        try:
+            offset, length = self._entries[name]
+        except KeyError:
+            raise KeyError('Entry {} not found'.format(name))
+        return decompress(self._read(offset, length), self.compression)
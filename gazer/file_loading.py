@@ -1,14 +1,19 @@
-import bz2
+import hashlib
+import json
 import logging
+import os
 
 import numpy as np
 import skimage
 from bson import BSON
 
+from gazer.compression import decompress
+from gazer.container import ContainerReader, is_container
+
 logger = logging.getLogger(__name__)
 
 
-def read_gcfile(path):
+def read_gcfile(path, frame_cache=False, cache_dir=None):
     """
     Read a gc in_file and decode the encoded scene object.
     Uses the decoder object specified in the gazer.settings.
@@ -17,6 +22,13 @@ def read_gcfile(path):
     ----------
     path : in_file like stream
         File that contains an encoded scene.
+    frame_cache : bool
+        If True, decoded frames are stored in a memory mapped frame cache
+        file, which is used instead of decoding the frames when the file is
+        read again.
+    cache_dir : str
+        Directory of the frame cache files, defaults to
+        gazer.preferences.FRAME_CACHE_PATH.
 
     Returns
     -------
@@ -26,23 +38,174 @@ def read_gcfile(path):
     """
     logger.debug('Reading file as gcfile {}'.format(path))
 
+    image_manager = None
+    if frame_cache:
+        # Taken before reading, so a cache written from a file that changes
+        # while it is read is not considered valid.
+        fingerprint = file_fingerprint(path)
+        image_manager = load_frame_cache(path, cache_dir)
+
     with open(path, 'rb') as in_file:
         try:
-            contents = in_file.read()
-            bson_obj = BSON(contents)
-            wrapper = bson_obj.decode()
-            from gazer.settings import DECODERS
-            wrapper_type = wrapper['type']
-            decoder = DECODERS.get(wrapper_type)
-            if decoder is None:
-                raise ValueError('Decoder {} not found'.format(wrapper_type))
-            body = wrapper['data']
-            if wrapper['compression'] == 'bz2':
-                body = bz2.decompress(body)
-            scene = decoder.scene_from_data(body)
-            return scene
+            if is_container(in_file):
+                scene = read_container(in_file, image_manager)
+            else:
+                contents = in_file.read()
+                bson_obj = BSON(contents)
+                wrapper = bson_obj.decode()
+                from gazer.settings import DECODERS
+                wrapper_type = wrapper['type']
+                decoder = DECODERS.get(wrapper_type)
+                if decoder is None:
+                    msg = 'Decoder {} not found'.format(wrapper_type)
+                    raise ValueError(msg)
+                body = decompress(wrapper['data'], wrapper['compression'])
+                scene = decoder.scene_from_data(body, image_manager)
         except RuntimeError:
             logger.exception('Failed to read file.')
+            return None
+
+    if frame_cache and image_manager is None and scene is not None:
+        write_frame_cache(path, scene, fingerprint, cache_dir)
+    return scene
+
+
+def read_container(in_file, image_manager=None):
+    """
+    Decode the scene stored in a version 2 gc container.
+    Entries are read by seeking, so the file is never read as a whole.
+
+    Parameters
+    ----------
+    in_file : in_file like stream
+        Seekable stream positioned at the start of the container.
+    image_manager : ImageManager
+        Optional manager providing the frames, in which case only the
+        lookup table is read from the container.
+
+    Returns
+    -------
+    gazer.scene.Scene
+        Scene object encoded in the container.
+    """
+    reader = ContainerReader(in_file)
+    logger.debug('Reading gc container version {}'.format(reader.version))
+    from gazer.settings import DECODERS
+    decoder = DECODERS.get(reader.scene_type)
+    if decoder is None:
+        raise ValueError('Decoder {} not found'.format(reader.scene_type))
+    return decoder.scene_from_container(reader, image_manager)
+
+
+def frame_cache_path(path, cache_dir=None):
+    """
+    Return the path of the frame cache file for a gc file. Cache files are
+    kept in a per user cache directory and named after the absolute path
+    of the gc file.
+
+    Parameters
+    ----------
+    path : str
+        Path of the gc file.
+    cache_dir : str
+        Directory of the frame cache files, defaults to
+        gazer.preferences.FRAME_CACHE_PATH.
+    """
+    if cache_dir is None:
+        from gazer.preferences import FRAME_CACHE_PATH
+        cache_dir = FRAME_CACHE_PATH
+    abs_path = os.path.abspath(path)
+    if not isinstance(abs_path, bytes):
+        abs_path = abs_path.encode('utf-8')
+    name = hashlib.sha1(abs_path).hexdigest()
+    return os.path.join(cache_dir, '{}.npy'.format(name))
+
+
+def frame_cache_fingerprint_path(path, cache_dir=None):
+    """
+    Return the path of the file recording which version of the gc file the
+    frame cache was written for.
+    """
+    return '{}.json'.format(os.path.splitext(
+        frame_cache_path(path, cache_dir))[0])
+
+
+def file_fingerprint(path):
+    """
+    Return path, size and modification time of a file. Size and time
+    change whenever the file is rewritten.
+    """
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime]
+
+
+def load_frame_cache(path, cache_dir=None):
+    """
+    Return a memory mapped image manager for the frame cache of the given
+    gc file, or None if there is no cache or it was written for a different
+    version of the file.
+    """
+    from gazer.modules.dof.image_manager import MemmapImageManager
+    cache_path = frame_cache_path(path, cache_dir)
+    fingerprint_path = frame_cache_fingerprint_path(path, cache_dir)
+    if not (os.path.exists(cache_path) and os.path.exists(fingerprint_path)):
+        return None
+    try:
+        with open(fingerprint_path, 'r') as fingerprint_file:
+            fingerprint = json.load(fingerprint_file)
+        if fingerprint != file_fingerprint(path):
+            logger.debug('Frame cache {} is outdated.'.format(cache_path))
+            return None
+        return MemmapImageManager.from_cache_file(cache_path)
+    except (IOError, ValueError):
+        logger.exception('Failed to read frame cache.')
+        return None
+
+
+def write_frame_cache(path, scene, fingerprint=None, cache_dir=None):
+    """
+    Store the frames of the scene in the frame cache of the given gc file
+    and switch the scene to the memory mapped frames.
+
+    Frames are written one at a time into the preallocated cache file, so
+    frames that are decoded lazily are never all held in memory.
+
+    Parameters
+    ----------
+    path : str
+        Path of the gc file the scene was read from.
+    scene : gazer.scene.Scene
+        Scene decoded from the file.
+    fingerprint : list
+        Fingerprint of the gc file at the time it was read, see
+        file_fingerprint. Defaults to the current fingerprint.
+    cache_dir : str
+        Directory of the frame cache files, defaults to
+        gazer.preferences.FRAME_CACHE_PATH.
+    """
+    from gazer.modules.dof.image_manager import MemmapImageManager
+    if fingerprint is None:
+        fingerprint = file_fingerprint(path)
+    cache_path = frame_cache_path(path, cache_dir)
+    fingerprint_path = frame_cache_fingerprint_path(path, cache_dir)
+    try:
+        directory = os.path.dirname(cache_path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        # Remove the old fingerprint first, so a cache that is only
+        # partially replaced is never considered valid.
+        if os.path.exists(fingerprint_path):
+            os.remove(fingerprint_path)
+        image_manager = MemmapImageManager.from_frames(
+            scene.iter_images, len(scene.image_manager.keys), cache_path)
+        with open(fingerprint_path, 'w') as fingerprint_file:
+            json.dump(fingerprint, fingerprint_file)
+    except (IOError, OSError, ValueError):
+        logger.exception('Failed to write frame cache.')
+        return
+    scene.image_manager = image_manager
+    # Memory mapped frames need no decoding ahead of time.
+    scene.prefetcher = None
 
 
 def read_image(path):
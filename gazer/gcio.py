@@ -3,19 +3,38 @@ from __future__ import unicode_literals, division, print_function
 import io
 import logging
 import os
+import shutil
+import stat
+import struct
+import tempfile
+from functools import partial
 
 import numpy as np
 import skimage
 import skimage.io
 from bson import BSON
 
+from gazer import container
+from gazer.compression import NO_COMPRESSION, compress_chunks, get_codec, \
+    iter_chunks
 from gazer.file_loading import read_gcfile, read_image, read_fits
 
 logger = logging.getLogger(__name__)
 
+_INT32 = struct.Struct('<i')
+_BINARY_SUBTYPE_GENERIC = b'\x00'
 
-def create_default_file_format_loaders():
-    file_format_loaders = {'gc': read_gcfile,
+# Container entry holding the whole data body of scenes whose encoder has no
+# container layout of its own.
+DATA_ENTRY = 'data'
+
+
+def create_default_file_format_loaders(frame_cache=False):
+    # With the frame cache, gc files keep their decoded frames in a memory
+    # mapped file in the user cache directory, so they are only decoded the
+    # first time a file is opened.
+    file_format_loaders = {'gc': partial(read_gcfile,
+                                         frame_cache=frame_cache),
                            'fits': read_fits,
                            }
     for ext in ['jpg', 'bmp', 'png']:
@@ -37,19 +56,40 @@ class DataDecoder(object):
     """
     Class responsible for deserializing gazer.scene.Scene objects.
     """
+    # Type identifier of the data this decoder reads.
+    scene_type = None
 
-    def scene_from_data(self, data):
+    def scene_from_data(self, data, image_manager=None):
         pass
 
+    def scene_from_container(self, reader, image_manager=None):
+        """
+        Create a scene from a version 2 container. By default the data body
+        written by DataEncoder.write_to_container is passed to
+        scene_from_data.
+        """
+        data = reader.read_entry(DATA_ENTRY)
+        return self.scene_from_data(data, image_manager)
+
 
 class DataEncoder(object):
     """
     Class responsible for serialising gazer.scene.Scene objects.
     """
+    # Type identifier of the data this encoder writes. Defaults to the
+    # scene type of the encoded scene if not set.
+    scene_type = None
 
     def data_from_scene(self, scene):
         pass
 
+    def write_to_container(self, scene, writer):
+        """
+        Write the scene to a version 2 container. By default the data body
+        from data_from_scene is written as a single entry.
+        """
+        writer.add_entry(DATA_ENTRY, bytes(self.data_from_scene(scene)))
+
 
 def array_to_bytes(array):
     """
@@ -83,9 +123,15 @@ def bytes_to_array(string):
     -------
     ndarray
         Decoded array.
+
+    Raises
+    ------
+    ValueError
+        If the data holds an object array. Those are stored pickled and
+        unpickling data from a file could run arbitrary code.
     """
     stream = io.BytesIO(string)
-    array = np.load(stream)
+    array = np.load(stream, allow_pickle=False)
     array = np.require(array, requirements=['C'])
     array.flags.writeable = False
     return array
@@ -119,29 +165,188 @@ def load_scene(path, file_format_loaders=DEFAULT_FILE_FORMAT_LOADERS):
     logging.warning('Unknown file extension: {}'.format(file_extension))
 
 
-def write_file(out_file, scene):
+def write_file(out_file, scene, version='0.1',
+               compression=NO_COMPRESSION, encoder=None):
     """
     Write a scene to a out_file.
     Uses the Encoder object specified in the gcviwer.settings.
 
+    Version 2.0 containers are written entry by entry, so encoders with a
+    container layout never hold more than one encoded frame. Version 0.1
+    files are a single BSON document: the whole uncompressed body is built
+    in memory first and only the compression of it is streamed.
+
     Parameters
     ----------
     out_file : out_file like stream
         File that contains an encoded scene.
     scene : gcviewer.scene.Scene
         Scene object to be saved.
+    version : str
+        Version of the file layout to write. Either '0.1' for a single BSON
+        document or '2.0' for a container with random access entries.
+    compression : str
+        Name of the codec used to compress the scene data, see
+        gazer.compression.available_compressions.
+    encoder : DataEncoder
+        Encoder to use instead of the one specified in the gazer.settings.
     """
 
-    from settings import ENCODERS
-    encoder = ENCODERS.get(scene.scene_type)
+    get_codec(compression)
+    if encoder is None:
+        from gazer.settings import ENCODERS
+        encoder = ENCODERS.get(scene.scene_type)
+    scene_type = encoder.scene_type or scene.scene_type
+    if version == container.version_string():
+        with container.ContainerWriter(out_file, scene_type,
+                                       compression=compression) as writer:
+            encoder.write_to_container(scene, writer)
+        return
+    if version != '0.1':
+        raise ValueError('Unknown file version {}'.format(version))
     wrapper = {'encoder': 'gazer',
                'version': '0.1',
-               'compression': 'none',
-               'type': scene.scene_type,
-               'data': encoder.data_from_scene(scene)
+               'compression': compression,
+               'type': scene_type,
                }
-    enoded_bson = BSON.encode(wrapper)
-    out_file.write(enoded_bson)
+    body = encoder.data_from_scene(scene)
+    _write_wrapper(out_file, wrapper, body, compression)
+
+
+def _write_wrapper(out_file, wrapper, body, compression):
+    """
+    Write the version 0.1 BSON wrapper with the body as binary 'data' field.
+
+    The body is compressed while it is written and the BSON length fields
+    are patched afterwards, so no compressed copy of the body is kept in
+    memory. The uncompressed body itself is passed in as a whole. Streams
+    that are not seekable get the compressed body buffered.
+    """
+    # Encoded wrapper without the terminating null byte, 'data' is appended.
+    head = BSON.encode(wrapper)[:-1]
+    data_element = b'\x05data\x00'
+    chunks = compress_chunks(iter_chunks(body), compression)
+
+    try:
+        start = out_file.tell()
+    except (AttributeError, IOError, OSError, ValueError):
+        start = None
+
+    if start is None:
+        compressed = b''.join(chunks)
+        out_file.write(_INT32.pack(len(head) + len(data_element) +
+                                   _INT32.size + len(compressed) + 2))
+        out_file.write(head[_INT32.size:])
+        out_file.write(data_element)
+        out_file.write(_INT32.pack(len(compressed)))
+        out_file.write(_BINARY_SUBTYPE_GENERIC)
+        out_file.write(compressed)
+        out_file.write(b'\x00')
+        return
+
+    out_file.write(head)
+    out_file.write(data_element)
+    length_position = out_file.tell()
+    out_file.write(_INT32.pack(0))
+    out_file.write(_BINARY_SUBTYPE_GENERIC)
+    data_length = 0
+    for chunk in chunks:
+        out_file.write(chunk)
+        data_length += len(chunk)
+    out_file.write(b'\x00')
+    end = out_file.tell()
+
+    out_file.seek(start)
+    out_file.write(_INT32.pack(end - start))
+    out_file.seek(length_position)
+    out_file.write(_INT32.pack(data_length))
+    out_file.seek(end)
+
+
+def save_scene(path, scene, version=container.version_string(),
+               compression=NO_COMPRESSION, encoder=None):
+    """
+    Save a scene to the file at the given path.
+
+    By default the version 2 layout is written, for which frames are encoded
+    and written one at a time, so memory use does not grow with the size of
+    the scene. The data is written to a temporary file next to the target
+    that only replaces the target once it is complete.
+
+    Parameters
+    ----------
+    path : str
+        Path of the output file.
+    scene : gazer.scene.Scene
+        Scene object to be saved.
+    version : str
+        Version of the file layout, see write_file.
+    compression : str
+        Name of the compression codec, see write_file.
+    encoder : DataEncoder
+        Encoder to use instead of the one specified in the gazer.settings.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    prefix = '.{}.'.format(os.path.basename(path))
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', prefix=prefix,
+                                    dir=directory)
+    completed = False
+    try:
+        with os.fdopen(fd, 'wb') as out_file:
+            write_file(out_file, scene, version, compression, encoder)
+        _apply_file_mode(tmp_path, path)
+        _replace_file(tmp_path, path)
+        completed = True
+    finally:
+        if not completed and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _apply_file_mode(tmp_path, path):
+    """
+    Give the temporary file the permissions of the file it replaces, or the
+    ones a newly created file would get. mkstemp creates files readable by
+    the owner only.
+
+    The mode of a new file is taken from a probe file created next to the
+    temporary file, because reading the umask means setting it, which would
+    affect files created by other threads in the meantime.
+    """
+    if os.path.exists(path):
+        shutil.copymode(path, tmp_path)
+        return
+    probe_path = '{}.mode'.format(tmp_path)
+    fd = os.open(probe_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        os.close(fd)
+        mode = stat.S_IMODE(os.stat(probe_path).st_mode)
+    finally:
+        os.remove(probe_path)
+    os.chmod(tmp_path, mode)
+
+
+def _replace_file(src, dst):
+    """
+    Move src to dst, replacing dst if it exists. Either the old or the new
+    file is at dst at any time, even if the process is interrupted.
+    """
+    replace = getattr(os, 'replace', None)
+    if replace is not None:
+        replace(src, dst)
+    elif os.name != 'nt' or not os.path.exists(dst):
+        # Renaming replaces an existing file atomically on POSIX.
+        os.rename(src, dst)
+    else:
+        # Windows does not rename onto an existing file, so the old file is
+        # moved aside and only removed once the new one is in place.
+        backup_path = '{}.old'.format(src)
+        os.rename(dst, backup_path)
+        try:
+            os.rename(src, dst)
+        except OSError:
+            os.rename(backup_path, dst)
+            raise
+        os.remove(backup_path)
 
 
 def extract_file_to_stack(in_file, out_folder):
@@ -0,0 +1,110 @@
+"""
+This module provides the least recently used cache bounded by a byte budget
+that is shared by the decoded frames of lazily loaded scenes and the frames
+rendered by the gui.
+"""
+
+from __future__ import unicode_literals, division, print_function
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Least recently used cache, bounded by a byte budget. The most recently
+    added entry and the pinned key are always kept.
+
+    Not thread safe; callers sharing a cache between threads need to lock.
+    """
+
+    def __init__(self, budget, on_evict=None):
+        """
+        Parameters
+        ----------
+        budget : int
+            Maximum number of bytes of cached values.
+        on_evict : callable
+            Called with key and value of every entry that is evicted,
+            replaced or cleared, e.g. to free resources held by the value.
+        """
+        self.budget = budget
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+        self._size = 0
+        self._pinned = None
+
+    @property
+    def size(self):
+        """
+        Number of bytes currently held by the cached values.
+        """
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """
+        Return the cached value or None, marking it as recently used.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        self._entries[key] = entry
+        return entry[0]
+
+    def put(self, key, value, size):
+        """
+        Add a value to the cache and evict the least recently used values
+        that exceed the budget.
+
+        Parameters
+        ----------
+        key : hashable
+            Key of the value.
+        value : object
+            Value to cache, e.g. a decoded frame or a QPixmap.
+        size : int
+            Size of the value in bytes.
+        """
+        old_entry = self._entries.pop(key, None)
+        if old_entry is not None:
+            self._size -= old_entry[1]
+            if old_entry[0] is not value:
+                self._notify_evicted(key, old_entry[0])
+        self._entries[key] = (value, size)
+        self._size += size
+        self._evict()
+
+    def pin(self, key):
+        """
+        Keep the value for the given key when evicting, e.g. because it is
+        on display. Only one key is pinned at a time, None unpins.
+        """
+        self._pinned = key
+
+    def clear(self):
+        entries = list(self._entries.items())
+        self._entries.clear()
+        self._size = 0
+        for key, (value, __) in entries:
+            self._notify_evicted(key, value)
+
+    def _evict(self):
+        if self._size <= self.budget:
+            return
+        kept = {self._pinned, next(reversed(self._entries))}
+        for key in list(self._entries):
+            if self._size <= self.budget:
+                break
+            if key not in kept:
+                value, size = self._entries.pop(key)
+                self._size -= size
+                self._notify_evicted(key, value)
+
+    def _notify_evicted(self, key, value):
+        if self.on_evict is not None:
+            self.on_evict(key, value)
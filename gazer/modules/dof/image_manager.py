@@ -1,11 +1,20 @@
 from __future__ import unicode_literals, division, print_function
 
 import logging
+import os
+import threading
 
 from abc import ABCMeta, abstractmethod, abstractproperty
 
+import numpy as np
+
+from gazer.lru_cache import LRUCache
+from gazer.parallel import parallel_iter
+
 logger = logging.getLogger(__name__)
 
+DEFAULT_CACHE_BUDGET = 512 * 1024 ** 2
+
 
 class ImageManager(object):
     """
@@ -15,6 +24,18 @@ class ImageManager(object):
     __metaclass__ = ABCMeta
 
     def preload(self, keys):
+        """
+        Hint that the images for the given keys will be requested soon.
+        Implementations may use this to prepare the images in advance.
+        """
+        pass
+
+    def pin(self, key):
+        """
+        Hint that the image for the given key is on display and should not
+        be dropped to make room for preloaded images. Only the most
+        recently pinned key is kept.
+        """
         pass
 
     @abstractmethod
@@ -66,3 +87,253 @@ class ArrayStackImageManager(ImageManager):
     @property
     def iter_images(self):
         return iter(self._arrays)
+
+
+class MemmapImageManager(ImageManager):
+    """
+    Image manager that keeps all frames in one contiguous
+    (n_frames, height, width, channels) buffer.
+
+    The buffer can be a memory mapped .npy file. Frames are then paged in by
+    the operating system on access and pages are shared between processes
+    that view the same file. Returned frames are read-only views into the
+    buffer, no copies are made.
+    """
+
+    def __init__(self, buffer):
+        super(MemmapImageManager, self).__init__()
+        self._buffer = buffer.view()
+        self._buffer.flags.writeable = False
+
+    @classmethod
+    def from_arrays(cls, arrays, cache_path=None):
+        """
+        Create a manager from a list of equally shaped frames.
+
+        Parameters
+        ----------
+        arrays : list of ndarray
+            Frames to be stored.
+        cache_path : str
+            If given, the frames are written to a .npy file at this path
+            and the manager is backed by a memory map of that file.
+
+        Returns
+        -------
+        MemmapImageManager
+        """
+        if not arrays:
+            raise ValueError('At least one frame is required.')
+        if cache_path is not None:
+            return cls.from_frames(arrays, len(arrays), cache_path)
+        frame_shape = arrays[0].shape
+        if any(array.shape != frame_shape for array in arrays):
+            raise ValueError('All frames need to have the same shape.')
+        buffer = np.empty((len(arrays),) + frame_shape, arrays[0].dtype)
+        for index, array in enumerate(arrays):
+            buffer[index] = array
+        return cls(buffer)
+
+    @classmethod
+    def from_frames(cls, frames, frame_count, cache_path):
+        """
+        Write frames to a .npy file and create a manager backed by a memory
+        map of it. The file is preallocated from the first frame and filled
+        one frame at a time, so the frames can come from an iterator that
+        decodes them on demand.
+
+        Parameters
+        ----------
+        frames : iterable of ndarray
+            Equally shaped frames in key order.
+        frame_count : int
+            Number of frames the iterable yields.
+        cache_path : str
+            Path of the .npy file.
+
+        Returns
+        -------
+        MemmapImageManager
+        """
+        if frame_count < 1:
+            raise ValueError('At least one frame is required.')
+        # Write to a temporary file first, so other processes never map a
+        # partially written cache.
+        tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+        try:
+            cls._write_frames(frames, frame_count, tmp_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        os.rename(tmp_path, cache_path)
+        return cls.from_cache_file(cache_path)
+
+    @staticmethod
+    def _write_frames(frames, frame_count, path):
+        buffer = None
+        try:
+            count = 0
+            for array in frames:
+                if buffer is None:
+                    buffer = np.lib.format.open_memmap(
+                        path, mode='w+', dtype=array.dtype,
+                        shape=(frame_count,) + array.shape)
+                if count == frame_count or array.shape != buffer.shape[1:]:
+                    raise ValueError('All frames need to have the same '
+                                     'shape and their number needs to '
+                                     'match the frame count.')
+                buffer[count] = array
+                count += 1
+            if count != frame_count:
+                raise ValueError('Expected {} frames, got {}.'.format(
+                    frame_count, count))
+            buffer.flush()
+        finally:
+            # Unmap the file, so it can be renamed or removed.
+            del buffer
+
+    @classmethod
+    def from_cache_file(cls, cache_path):
+        """
+        Create a manager backed by a read-only memory map of a .npy file.
+        """
+        return cls(np.load(cache_path, mmap_mode='r'))
+
+    def _get_array(self, key):
+        try:
+            return self._buffer[int(key)]
+        except IndexError:
+            logger.warn('Image {} not found'.format(key))
+            return None
+        except TypeError:
+            logger.warn('{} not a valid key'.format(key))
+            return None
+
+    def load_image(self, key):
+        return self.load_array(key)
+
+    def load_array(self, key):
+        return self._get_array(key)
+
+    @property
+    def keys(self):
+        return range(len(self._buffer))
+
+    @property
+    def iter_images(self):
+        return iter(self._buffer)
+
+
+class LazyImageManager(ImageManager):
+    """
+    Image manager that keeps the encoded frames and only decodes a frame
+    when it is first requested.
+
+    Decoded frames are kept in a least recently used cache that is bounded
+    by a byte budget. Frames can be decoded ahead of time with preload.
+    The manager is thread safe, so preloading can happen on worker threads.
+    Iterating over all frames, e.g. when saving the scene, decodes them on
+    a pool of worker threads.
+    """
+
+    def __init__(self, encoded_frames, decode,
+                 cache_budget=DEFAULT_CACHE_BUDGET, workers=None):
+        """
+        Parameters
+        ----------
+        encoded_frames : list of bytes
+            Encoded frames in key order.
+        decode : callable
+            Function that decodes a single encoded frame to an ndarray.
+        cache_budget : int
+            Maximum number of bytes of decoded frames kept in memory. The
+            most recently used and the pinned frame are always kept.
+        workers : int
+            Number of threads decoding frames when iterating over all
+            frames. Defaults to the number of cores, 1 decodes serially.
+        """
+        super(LazyImageManager, self).__init__()
+        self._encoded_frames = list(encoded_frames)
+        self._decode = decode
+        self.workers = workers
+        self._cache = LRUCache(cache_budget)
+        self._lock = threading.Lock()
+
+    @property
+    def cache_budget(self):
+        return self._cache.budget
+
+    @cache_budget.setter
+    def cache_budget(self, budget):
+        self._cache.budget = budget
+
+    @property
+    def cache_size(self):
+        """
+        Number of bytes currently held by decoded frames.
+        """
+        return self._cache.size
+
+    def is_cached(self, key):
+        index = self._normalise_key(key)
+        with self._lock:
+            return index in self._cache
+
+    def preload(self, keys):
+        for key in keys:
+            self._get_array(key)
+
+    def pin(self, key):
+        index = self._normalise_key(key)
+        with self._lock:
+            self._cache.pin(index)
+
+    def _normalise_key(self, key):
+        try:
+            index = int(key)
+        except (TypeError, ValueError):
+            return None
+        if index < 0:
+            index += len(self._encoded_frames)
+        if not 0 <= index < len(self._encoded_frames):
+            return None
+        return index
+
+    def _get_array(self, key):
+        index = self._normalise_key(key)
+        if index is None:
+            logger.warn('Image {} not found'.format(key))
+            return None
+
+        with self._lock:
+            array = self._cache.get(index)
+        if array is not None:
+            return array
+
+        # Decode outside of the lock so multiple frames can be decoded
+        # concurrently.
+        array = self._decode(self._encoded_frames[index])
+
+        with self._lock:
+            cached = self._cache.get(index)
+            if cached is not None:
+                return cached
+            self._cache.put(index, array, array.nbytes)
+            return array
+
+    def load_image(self, key):
+        return self.load_array(key)
+
+    def load_array(self, key):
+        return self._get_array(key)
+
+    @property
+    def keys(self):
+        return range(len(self._encoded_frames))
+
+    @property
+    def iter_images(self):
+        return parallel_iter(self._get_array, self.keys, self.workers)
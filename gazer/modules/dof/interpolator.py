@@ -1,5 +1,14 @@
 from __future__ import unicode_literals, division, print_function
 
+import math
+
+# Longest time span advance catches up on, so a stalled render loop does
+# not cause a burst of steps.
+MAX_ADVANCE_TIME = 0.25
+
+# Distance and speed below which a SpringInterpolator snaps to its target.
+SPRING_REST_THRESHOLD = 1e-3
+
 
 class Interpolator(object):
     """
@@ -7,9 +16,13 @@ class Interpolator(object):
     target value.
     """
 
+    # Number of steps done per second of time passed to advance.
+    steps_per_second = 60
+
     def __init__(self, start=0, target=0):
         self.current_value = start
         self.target = target
+        self._pending_time = 0
 
     def make_step(self):
         """
@@ -17,22 +30,41 @@ class Interpolator(object):
         """
         pass
 
+    def advance(self, delta_time):
+        """
+        Advance the interpolation by the given time, doing one step every
+        1 / steps_per_second seconds.
 
-class SplineInterpolator(Interpolator):
-    def __init__(self, start, target, steps_to_target, start_speed=0):
-        Interpolator.__init__(self, start, target)
-        self.steps_to_target = steps_to_target
-        self.current_speed = start_speed
-        # TODO Implement
-        raise NotImplementedError
+        Parameters
+        ----------
+        delta_time : float
+            Time passed in seconds.
 
-    def make_step(self):
-        pass
+        Returns
+        -------
+        Current value after advancing.
+        """
+        self._pending_time = min(self._pending_time + delta_time,
+                                 MAX_ADVANCE_TIME)
+        step_time = 1 / self.steps_per_second
+        # Tolerate rounding errors of the accumulated time.
+        while self._pending_time >= step_time - 1e-9:
+            self.make_step()
+            self._pending_time -= step_time
+        return self.current_value
+
+    @property
+    def index(self):
+        """
+        Frame index of the current value.
+        """
+        return self.current_value
 
 
 class InstantInterpolator(Interpolator):
     def make_step(self):
-        return self.target
+        self.current_value = self.target
+        return self.current_value
 
 
 class LinearInterpolator(Interpolator):
@@ -60,3 +92,195 @@ class ExponentialInterpolator(Interpolator):
         diff = self.target - self.current_value
         self.current_value += diff // 2
         return self.current_value
+
+
+class TimeInterpolator(Interpolator):
+    """
+    Base class for interpolators whose value moves continuously in time
+    instead of in fixed steps. advance moves the value by exactly the time
+    passed, so the transition does not depend on the tick rate; make_step
+    advances by 1 / steps_per_second.
+
+    The current value is a float; index and the return values of make_step
+    and advance round it to the nearest frame index. Subclasses implement
+    _advance and only use float arithmetic in it, so stepping does not
+    allocate arrays.
+    """
+
+    def make_step(self):
+        return self.advance(1 / self.steps_per_second)
+
+    def advance(self, delta_time):
+        self._advance(min(delta_time, MAX_ADVANCE_TIME))
+        return self.index
+
+    def _advance(self, delta_time):
+        """
+        Move the current value by the given time in seconds.
+        """
+        pass
+
+    @property
+    def index(self):
+        return int(round(self.current_value))
+
+
+class LinearTimeInterpolator(TimeInterpolator):
+    """
+    Moves towards the target with a constant speed.
+    """
+
+    def __init__(self, start=0, target=0, speed=30):
+        """
+        Parameters
+        ----------
+        start : numeric
+        target : numeric
+        speed : float
+            Distance moved per second.
+        """
+        TimeInterpolator.__init__(self, start, target)
+        self.speed = speed
+
+    def _advance(self, delta_time):
+        diff = self.target - self.current_value
+        distance = self.speed * delta_time
+        if abs(diff) <= distance:
+            self.current_value = self.target
+        elif diff > 0:
+            self.current_value += distance
+        else:
+            self.current_value -= distance
+
+
+class SpringInterpolator(TimeInterpolator):
+    """
+    Follows the target like a critically damped spring: starting from rest,
+    the value accelerates towards the target and comes to rest on it without
+    overshooting. A new target is picked up smoothly, keeping the current
+    velocity, so a value that moves towards a new target faster than
+    angular_frequency times the remaining distance overshoots it once
+    before coming back to rest on it.
+
+    The spring equation is solved exactly for every advance, so the result
+    is the same however the time is split into ticks.
+    """
+
+    def __init__(self, start=0, target=0, angular_frequency=20):
+        """
+        Parameters
+        ----------
+        start : numeric
+        target : numeric
+        angular_frequency : float
+            Stiffness of the spring in radians per second. The remaining
+            distance has shrunk to about 5% after 4.7 / angular_frequency
+            seconds.
+        """
+        TimeInterpolator.__init__(self, start, target)
+        self.angular_frequency = angular_frequency
+        self.velocity = 0
+
+    def _advance(self, delta_time):
+        omega = self.angular_frequency
+        offset = self.current_value - self.target
+        decay = math.exp(-omega * delta_time)
+        tmp = (self.velocity + omega * offset) * delta_time
+        self.velocity = (self.velocity - omega * tmp) * decay
+        offset = (offset + tmp) * decay
+        if (abs(offset) < SPRING_REST_THRESHOLD and
+                abs(self.velocity) < SPRING_REST_THRESHOLD):
+            self.current_value = self.target
+            self.velocity = 0
+        else:
+            self.current_value = self.target + offset
+
+
+class SplineInterpolator(TimeInterpolator):
+    """
+    Moves to the target along a cubic Hermite spline, starting with the
+    current speed and arriving with zero speed after a fixed duration.
+
+    When the target changes, a new spline starts from the current value and
+    speed, so the motion stays smooth.
+    """
+
+    def __init__(self, start=0, target=0, duration=0.25, start_speed=0):
+        """
+        Parameters
+        ----------
+        start : numeric
+        target : numeric
+        duration : float
+            Time in seconds to reach a target.
+        start_speed : float
+            Speed at the start, in units per second.
+        """
+        TimeInterpolator.__init__(self, start, target)
+        self.duration = duration
+        self.current_speed = start_speed
+        self._start_segment()
+
+    def _start_segment(self):
+        self._segment_start = self.current_value
+        self._segment_target = self.target
+        self._segment_speed = self.current_speed
+        self._elapsed = 0
+
+    def _advance(self, delta_time):
+        if self.target != self._segment_target:
+            self._start_segment()
+        if self._elapsed >= self.duration:
+            self.current_value = self.target
+            self.current_speed = 0
+            return
+
+        self._elapsed = min(self._elapsed + delta_time, self.duration)
+        duration = self.duration
+        t = self._elapsed / duration
+        t2 = t * t
+        t3 = t2 * t
+        start = self._segment_start
+        target = self._segment_target
+        tangent = self._segment_speed * duration
+        self.current_value = ((2 * t3 - 3 * t2 + 1) * start +
+                              (t3 - 2 * t2 + t) * tangent +
+                              (-2 * t3 + 3 * t2) * target)
+        self.current_speed = ((6 * t2 - 6 * t) * (start - target) +
+                              (3 * t2 - 4 * t + 1) * tangent) / duration
+
+
+# Interpolators that can be selected by name, e.g. in the preferences.
+INTERPOLATORS = {
+    'instant': InstantInterpolator,
+    'linear': LinearInterpolator,
+    'exponential': ExponentialInterpolator,
+    'linear_time': LinearTimeInterpolator,
+    'spring': SpringInterpolator,
+    'spline': SplineInterpolator,
+}
+
+# Moves by the time passed, so transitions do not depend on the tick rate.
+DEFAULT_INTERPOLATOR = 'spring'
+
+
+def make_interpolator(name=None):
+    """
+    Return a new interpolator of the given name.
+
+    Parameters
+    ----------
+    name : str
+        Key of INTERPOLATORS, defaults to DEFAULT_INTERPOLATOR.
+
+    Raises
+    ------
+    ValueError
+        If the name is unknown.
+    """
+    if name is None:
+        name = DEFAULT_INTERPOLATOR
+    interpolator_class = INTERPOLATORS.get(name)
+    if interpolator_class is None:
+        raise ValueError('Unknown interpolator {}'.format(name))
+    return interpolator_class()
@@ -1,6 +1,9 @@
 from __future__ import unicode_literals, division, print_function
 
 from abc import ABCMeta
+import math
+import os
+
 import numpy as np
 
 import logging
@@ -25,49 +28,455 @@ class LookupTable(object):
         """
         pass
 
+    def sample_positions(self, positions):
+        """
+        Return the keys for a sequence of positions.
+
+        Subclasses override this with a vectorised implementation; the
+        default calls sample_position for every position.
+
+        Parameters
+        ----------
+        positions: array_like
+            Positions of shape (N, 2), in the same coordinates as accepted
+            by sample_position.
+
+        Returns
+        -------
+        numpy.ma.MaskedArray
+            Values at the positions. Positions for which sample_position
+            returns None are masked.
+        """
+        values = [self.sample_position(pos) for pos in positions]
+        valid = np.array([value is not None for value in values], bool)
+        filled = np.array([value if value is not None else 0
+                           for value in values])
+        return np.ma.masked_array(filled, mask=~valid)
+
+
+def _index_positions(coordinates, size):
+    """
+    Convert scaled coordinates to integer indices like int() does and
+    return them together with a mask of the indices within [0, size[.
+    """
+    valid = np.isfinite(coordinates)
+    valid[valid] = (coordinates[valid] > -1) & (coordinates[valid] < size)
+    indices = np.zeros(coordinates.shape, np.intp)
+    indices[valid] = coordinates[valid]
+    return indices, valid
+
+
+def _sample_grid(grid, rows, columns):
+    """
+    Read the grid at the given scaled coordinates, masking the values
+    outside of it.
+    """
+    row_indices, valid_rows = _index_positions(rows, grid.shape[0])
+    column_indices, valid_columns = _index_positions(columns, grid.shape[1])
+    valid = valid_rows & valid_columns
+    values = np.zeros(len(valid), grid.dtype)
+    values[valid] = grid[row_indices[valid], column_indices[valid]]
+    return np.ma.masked_array(values, mask=~valid)
+
+
+def make_index_grid(array):
+    """
+    Return the values of a lookup table array as a compact 2D grid.
+
+    RGB values are averaged into a single value. If all values are
+    integral, the smallest integer dtype that can hold them is used.
+    """
+    grid = np.asarray(array)
+    if grid.ndim == 3:
+        grid = grid.mean(axis=2)
+    if grid.size == 0:
+        return grid
+    if np.issubdtype(grid.dtype, np.floating):
+        if not np.all(np.isfinite(grid)) or np.any(grid != np.round(grid)):
+            return grid
+    min_value, max_value = int(grid.min()), int(grid.max())
+    if min_value < 0:
+        # The negative counterpart of the maximum selects a signed type.
+        dtype = np.result_type(np.min_scalar_type(min_value),
+                               np.min_scalar_type(-max_value - 1))
+    else:
+        dtype = np.min_scalar_type(max_value)
+    return grid.astype(dtype)
+
 
 class ArrayLookupTable(LookupTable):
     def __init__(self, array):
         super(ArrayLookupTable, self).__init__()
         self.array = array
 
+    @property
+    def array(self):
+        return self._array
+
+    @array.setter
+    def array(self, array):
+        self._array = array
+        shape = np.shape(array)
+        # Tables with a single row or column are not sampled.
+        self._valid = len(shape) >= 2 and shape[0] > 1 and shape[1] > 1
+        self._grid = make_index_grid(array) if self._valid else None
+        self._rows = shape[0] if self._valid else 0
+        self._columns = shape[1] if self._valid else 0
+
     def sample_position(self, pos):
-        try:
-            x = self.array.shape[0]
-            y = self.array.shape[1]
-            if x == 1 or y == 1:
-                return None
-            color = self.array[int(x * pos[1]), int(y * pos[0])]
-            # Avoid issues with RGB images
-            result = np.average(color)
-            return result
-        except IndexError:
-            msg = "Index Error with position x:{}, y:{} in ArrayLookupTable."
+        if not self._valid:
+            return None
+        row = int(self._rows * pos[1])
+        column = int(self._columns * pos[0])
+        if 0 <= row < self._rows and 0 <= column < self._columns:
+            return self._grid.item(row, column)
+        msg = "Index Error with position x:{}, y:{} in ArrayLookupTable."
+        logger.warning(msg.format(pos[0], pos[1]))
+        return None
+
+    def sample_positions(self, positions):
+        positions = np.asarray(positions, np.float64).reshape(-1, 2)
+        if not self._valid:
+            return np.ma.masked_all(len(positions), np.float64)
+        return _sample_grid(self._grid,
+                            self._rows * positions[:, 1],
+                            self._columns * positions[:, 0])
+
+
+FOVEA_DOMINANT = 'dominant'
+FOVEA_AVERAGE = 'average'
+
+
+def integral_image(array, dtype):
+    """
+    Return the summed-area table of a 2D array, padded with a leading row
+    and column of zeros, so the sum of array[r0:r1, c0:c1] is
+    table[r1, c1] - table[r0, c1] - table[r1, c0] + table[r0, c0].
+    """
+    table = np.zeros((array.shape[0] + 1, array.shape[1] + 1), dtype)
+    np.cumsum(array, axis=0, dtype=dtype, out=table[1:, 1:])
+    np.cumsum(table[1:, 1:], axis=1, dtype=dtype, out=table[1:, 1:])
+    return table
+
+
+def _window_sums(tables, row0, row1, column0, column1):
+    # Grouped so that no intermediate result is negative, which keeps
+    # unsigned counts exact.
+    return ((tables[..., row1, column1] - tables[..., row0, column1]) -
+            (tables[..., row1, column0] - tables[..., row0, column0]))
+
+
+class FovealLookupTable(ArrayLookupTable):
+    """
+    Lookup table that samples the neighbourhood covered by the fovea
+    instead of a single pixel, which keeps the chosen frame stable when the
+    gaze jitters across depth edges.
+
+    The neighbourhood is the square enclosing the foveal disc. In the
+    'dominant' mode the most frequent value in it is returned, preferring
+    the value at the gaze position on ties; in the 'average' mode the mean
+    value, rounded for integral tables.
+
+    Window sums come from summed-area tables, so the cost of a sample does
+    not depend on the radius. The average mode keeps a single table of
+    (H + 1) x (W + 1) 8 byte sums for an H x W lookup table and samples in
+    constant time. The dominant mode keeps one table of counts per distinct
+    value, K x (H + 1) x (W + 1) counts of the smallest integer type holding
+    H x W (4 bytes from 65536 cells on). Every sample does O(K) work to
+    compare the counts of all K values. Use a coarse lookup table, e.g. a
+    PyramidLookupTable array, to keep both small.
+    """
+
+    def __init__(self, array, radius=0.02, mode=FOVEA_DOMINANT):
+        """
+        Parameters
+        ----------
+        array : ndarray
+            Lookup table array, as for ArrayLookupTable.
+        radius : float
+            Radius of the fovea as a fraction of the table width.
+        mode : str
+            FOVEA_DOMINANT or FOVEA_AVERAGE.
+        """
+        if mode not in (FOVEA_DOMINANT, FOVEA_AVERAGE):
+            raise ValueError('Unknown foveal sampling mode {}'.format(mode))
+        self.radius = radius
+        self.mode = mode
+        super(FovealLookupTable, self).__init__(array)
+
+    @ArrayLookupTable.array.setter
+    def array(self, array):
+        ArrayLookupTable.array.fset(self, array)
+        self._keys = None
+        self._tables = None
+        if not self._valid:
+            return
+        if self.mode == FOVEA_AVERAGE:
+            self._integral = np.issubdtype(self._grid.dtype, np.integer)
+            dtype = np.int64 if self._integral else np.float64
+            self._tables = integral_image(self._grid, dtype)
+        else:
+            self._keys = np.unique(self._grid)
+            dtype = np.min_scalar_type(self._grid.size)
+            self._tables = np.empty((len(self._keys),
+                                     self._rows + 1,
+                                     self._columns + 1), dtype)
+            for num, key in enumerate(self._keys):
+                self._tables[num] = integral_image(self._grid == key, dtype)
+
+    @property
+    def window_radius(self):
+        """
+        Half the edge length of the sampled square in table pixels.
+        """
+        return max(0, int(round(self.radius * self._columns)))
+
+    def sample_position(self, pos):
+        if not self._valid:
+            return None
+        row = int(self._rows * pos[1])
+        column = int(self._columns * pos[0])
+        if not (0 <= row < self._rows and 0 <= column < self._columns):
+            msg = "Index Error with position x:{}, y:{} in FovealLookupTable."
             logger.warning(msg.format(pos[0], pos[1]))
             return None
 
+        radius = self.window_radius
+        row0, row1 = max(row - radius, 0), min(row + radius + 1, self._rows)
+        column0 = max(column - radius, 0)
+        column1 = min(column + radius + 1, self._columns)
+        sums = _window_sums(self._tables, row0, row1, column0, column1)
+
+        if self.mode == FOVEA_AVERAGE:
+            mean = sums / ((row1 - row0) * (column1 - column0))
+            return int(np.round(mean)) if self._integral else float(mean)
+
+        centre = self._grid.item(row, column)
+        centre_count = sums[np.searchsorted(self._keys, centre)]
+        best = sums.argmax()
+        if centre_count == sums[best]:
+            return centre
+        return self._keys.item(best)
+
+    def sample_positions(self, positions):
+        positions = np.asarray(positions, np.float64).reshape(-1, 2)
+        if not self._valid:
+            return np.ma.masked_all(len(positions), np.float64)
+        rows, valid_rows = _index_positions(self._rows * positions[:, 1],
+                                            self._rows)
+        columns, valid_columns = _index_positions(
+            self._columns * positions[:, 0], self._columns)
+        valid = valid_rows & valid_columns
+        rows, columns = rows[valid], columns[valid]
+
+        radius = self.window_radius
+        row0 = np.maximum(rows - radius, 0)
+        row1 = np.minimum(rows + radius + 1, self._rows)
+        column0 = np.maximum(columns - radius, 0)
+        column1 = np.minimum(columns + radius + 1, self._columns)
+        sums = _window_sums(self._tables, row0, row1, column0, column1)
+
+        if self.mode == FOVEA_AVERAGE:
+            means = sums / ((row1 - row0) * (column1 - column0))
+            if self._integral:
+                sampled = np.round(means).astype(self._grid.dtype)
+            else:
+                sampled = means
+        else:
+            centres = self._grid[rows, columns]
+            centre_rows = np.searchsorted(self._keys, centres)
+            samples = np.arange(len(centres))
+            best = sums.argmax(axis=0)
+            keep_centre = sums[centre_rows, samples] == sums[best, samples]
+            sampled = np.where(keep_centre, centres, self._keys[best])
+
+        values = np.zeros(len(valid), sampled.dtype)
+        values[valid] = sampled
+        return np.ma.masked_array(values, mask=~valid)
+
+
+def mode_pool(grid, factor):
+    """
+    Downsample a 2D grid by replacing every factor x factor block with its
+    most frequent value. Blocks at the lower and right border may be
+    smaller. On ties the smallest value is used.
+    """
+    rows, columns = grid.shape
+    pooled_rows, pooled_columns = -(-rows // factor), -(-columns // factor)
+    pooled = np.empty((pooled_rows, pooled_columns), grid.dtype)
+    best_counts = np.full((pooled_rows, pooled_columns), -1, np.int64)
+    mask = np.zeros((pooled_rows * factor, pooled_columns * factor), bool)
+    for key in np.unique(grid):
+        np.equal(grid, key, out=mask[:rows, :columns])
+        counts = mask.reshape(pooled_rows, factor,
+                              pooled_columns, factor).sum(axis=(1, 3))
+        better = counts > best_counts
+        pooled[better] = key
+        best_counts[better] = counts[better]
+    return pooled
+
+
+def resolution_for_tracker(display_size, pixels_per_degree, accuracy=1.0):
+    """
+    Return a lookup table resolution matched to the eye tracker accuracy.
+
+    Finer resolutions can not be resolved by the tracker; the returned
+    resolution uses two cells per accuracy radius.
+
+    Parameters
+    ----------
+    display_size : tuple
+        Width and height of the displayed scene in pixels.
+    pixels_per_degree : float
+        Display pixels per degree of visual angle at the viewing distance.
+    accuracy : float
+        Tracker accuracy in degrees of visual angle.
+
+    Returns
+    -------
+    tuple
+        Number of columns and rows.
+    """
+    cell_size = max(accuracy * pixels_per_degree / 2, 1)
+    return tuple(int(math.ceil(size / cell_size)) for size in display_size)
+
+
+class PyramidLookupTable(ArrayLookupTable):
+    """
+    Lookup table that samples a version of the array reduced by repeated
+    2x2 mode pooling until it fits a maximum resolution, e.g. one matched to
+    the tracker accuracy with resolution_for_tracker.
+
+    Only the reduced grid is kept for sampling. The array property still
+    returns the full resolution array, which is needed for saving and the
+    depth map view.
+    """
+
+    def __init__(self, array, max_resolution=(256, 256)):
+        """
+        Parameters
+        ----------
+        array : ndarray
+            Lookup table array, as for ArrayLookupTable.
+        max_resolution : tuple
+            Maximum number of columns and rows of the sampled grid.
+        """
+        self.max_resolution = max_resolution
+        super(PyramidLookupTable, self).__init__(array)
+
+    @ArrayLookupTable.array.setter
+    def array(self, array):
+        ArrayLookupTable.array.fset(self, array)
+        self.factor = 1
+        if not self._valid:
+            return
+
+        grid = self._grid
+        max_columns, max_rows = self.max_resolution
+        while grid.shape[0] > max(max_rows, 1) or \
+                grid.shape[1] > max(max_columns, 1):
+            grid = mode_pool(grid, 2)
+            self.factor *= 2
+        self._grid = grid
+
+    def sample_position(self, pos):
+        if not self._valid:
+            return None
+        row = int(self._rows * pos[1])
+        column = int(self._columns * pos[0])
+        if 0 <= row < self._rows and 0 <= column < self._columns:
+            return self._grid.item(row // self.factor, column // self.factor)
+        msg = "Index Error with position x:{}, y:{} in PyramidLookupTable."
+        logger.warning(msg.format(pos[0], pos[1]))
+        return None
+
+    def sample_positions(self, positions):
+        positions = np.asarray(positions, np.float64).reshape(-1, 2)
+        if not self._valid:
+            return np.ma.masked_all(len(positions), np.float64)
+        rows, valid_rows = _index_positions(self._rows * positions[:, 1],
+                                            self._rows)
+        columns, valid_columns = _index_positions(
+            self._columns * positions[:, 0], self._columns)
+        valid = valid_rows & valid_columns
+        values = np.zeros(len(valid), self._grid.dtype)
+        values[valid] = self._grid[rows[valid] // self.factor,
+                                   columns[valid] // self.factor]
+        return np.ma.masked_array(values, mask=~valid)
+
+
+def depth_cache_path(depth_txt):
+    """
+    Return the path of the binary cache file for a Lytro depth text file.
+    """
+    return '{}.npy'.format(depth_txt)
+
+
+def read_depth_txt(depth_txt, use_cache=True):
+    """
+    Read the values of a Lytro depth text file, one number per line.
+
+    The file is parsed in a single pass. If use_cache is set, the values are
+    stored in a .npy file next to the text file, which is used instead of
+    the text file as long as it is not older than it.
+
+    Returns
+    -------
+    ndarray
+        Flat array of the depth values.
+    """
+    cache_path = depth_cache_path(depth_txt)
+    if use_cache and os.path.exists(cache_path) and \
+            os.path.getmtime(cache_path) >= os.path.getmtime(depth_txt):
+        try:
+            return np.load(cache_path)
+        except (IOError, ValueError):
+            logger.exception('Failed to read depth cache.')
+
+    values = np.fromfile(depth_txt, dtype=np.float64, sep=' ')
+
+    if use_cache:
+        tmp_path = cache_path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as cache_file:
+                np.save(cache_file, values)
+            if os.path.exists(cache_path):
+                os.remove(cache_path)
+            os.rename(tmp_path, cache_path)
+        except (IOError, OSError):
+            logger.exception('Failed to write depth cache.')
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return values
+
 
 class LytroLookupTable(LookupTable):
-    def __init__(self, lut_dimensions, image_dimensions, depth_txt):
+    def __init__(self, lut_dimensions, image_dimensions, depth_txt,
+                 use_cache=True):
         super(LytroLookupTable, self).__init__()
         self._dimensions = lut_dimensions
         self._image_dimensions = image_dimensions
-        values = []
-        with open(depth_txt) as depth_file:
-            for line in depth_file:
-                value = float(line.strip())
-                values.append(value)
-        self._depth_data = np.array(values)
+        self._depth_data = read_depth_txt(depth_txt, use_cache)
         self._depth_data = self._depth_data.reshape(self._dimensions).T
 
     def sample_position(self, pos):
         x = pos[0] / self._image_dimensions[0]
         y = pos[1] / self._image_dimensions[1]
 
+        index_x = int(x * (self._dimensions[0] - 1))
+        index_y = int(y * (self._dimensions[1] - 1))
+        if index_x < 0 or index_y < 0:
+            return None
         try:
-            index_x = int(x * (self._dimensions[0] - 1))
-            index_y = int(y * (self._dimensions[1] - 1))
             depth = self._depth_data[(index_x, index_y)]
             return depth
         except IndexError:
             return None
+
+    def sample_positions(self, positions):
+        positions = np.asarray(positions, np.float64).reshape(-1, 2)
+        x = positions[:, 0] / self._image_dimensions[0]
+        y = positions[:, 1] / self._image_dimensions[1]
+        return _sample_grid(self._depth_data,
+                            x * (self._dimensions[0] - 1),
+                            y * (self._dimensions[1] - 1))
@@ -0,0 +1,260 @@
+"""
+This module provides headless batch conversion of Lytro raw files to gc
+files.
+
+Files are converted concurrently while the total number of Tnt processes
+stays within a global CPU budget. Finished files are recorded in a journal
+in the output directory, so an interrupted batch resumes with the files
+that are not done yet.
+"""
+
+from __future__ import unicode_literals, division, print_function
+
+import argparse
+import glob
+import json
+import logging
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+from gazer import gcio
+from gazer.parallel import default_worker_count
+from gazer.modules.dof.lytro_import import DEFAULT_MAX_FOCAL_PLANES, \
+    lpt_available, read_ifp
+
+logger = logging.getLogger(__name__)
+
+LIGHT_FIELD_EXTENSIONS = ('.lfp', '.lfx')
+JOURNAL_FILE_NAME = '.gazer_batch_journal.json'
+
+STATUS_DONE = 'done'
+STATUS_SKIPPED = 'skipped'
+STATUS_FAILED = 'failed'
+
+
+def find_light_field_files(sources):
+    """
+    Collect the Lytro raw files from a list of directories, files and glob
+    patterns.
+
+    Parameters
+    ----------
+    sources : list of str
+        Directories are searched (not recursively) for .lfp and .lfx
+        files, everything else is expanded as glob pattern.
+
+    Returns
+    -------
+    list of str
+        Absolute paths without duplicates, in a stable order.
+    """
+    files = []
+    for source in sources:
+        if os.path.isdir(source):
+            candidates = sorted(os.path.join(source, name)
+                                for name in os.listdir(source))
+            candidates = [path for path in candidates
+                          if path.lower().endswith(LIGHT_FIELD_EXTENSIONS)]
+        else:
+            candidates = sorted(glob.glob(source))
+        for path in candidates:
+            path = os.path.abspath(path)
+            if os.path.isfile(path) and path not in files:
+                files.append(path)
+    return files
+
+
+def output_path_for(in_path, out_dir):
+    name = os.path.splitext(os.path.basename(in_path))[0]
+    return os.path.join(out_dir, name + '.gc')
+
+
+def find_output_collisions(files, out_dir):
+    """
+    Return the input files that share their output path with another input
+    file, e.g. a.lfp and a.lfx, or a.lfp in two directories.
+    """
+    inputs = {}
+    for in_path in files:
+        out_path = os.path.normcase(output_path_for(in_path, out_dir))
+        inputs.setdefault(out_path, []).append(in_path)
+    return set(in_path for in_paths in inputs.values()
+               if len(in_paths) > 1 for in_path in in_paths)
+
+
+class BatchJournal(object):
+    """
+    Record of the files a batch has converted, persisted as JSON after
+    every change. Safe to use from multiple threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.exists(path):
+            with open(path, 'r') as journal_file:
+                self._entries = json.load(journal_file).get('files', {})
+
+    @staticmethod
+    def _fingerprint(in_path):
+        stat = os.stat(in_path)
+        return [stat.st_size, stat.st_mtime]
+
+    def is_done(self, in_path, out_path):
+        """
+        Check whether the file was converted and neither the input has
+        changed nor the output has been removed since.
+        """
+        with self._lock:
+            entry = self._entries.get(in_path)
+        return (entry is not None and
+                entry['status'] == STATUS_DONE and
+                entry['output'] == out_path and
+                entry['fingerprint'] == self._fingerprint(in_path) and
+                os.path.exists(out_path))
+
+    def mark(self, in_path, out_path, status):
+        with self._lock:
+            self._entries[in_path] = {
+                'status': status,
+                'output': out_path,
+                'fingerprint': self._fingerprint(in_path),
+            }
+            self._save()
+
+    def _save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as journal_file:
+            json.dump({'files': self._entries}, journal_file, indent=2,
+                      sort_keys=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(tmp_path, self.path)
+
+
+def run_batch(files, out_dir, config, jobs=None, cpu_budget=None,
+              journal=None, import_func=read_ifp):
+    """
+    Convert Lytro raw files to gc files.
+
+    Parameters
+    ----------
+    files : list of str
+        Lytro raw files to convert.
+    out_dir : str
+        Directory the gc files are written to.
+    config : dict
+        Preferences passed to the import, see read_ifp.
+    jobs : int
+        Number of files converted concurrently. Defaults to two, or one if
+        the CPU budget is one.
+    cpu_budget : int
+        Total number of Tnt processes run at the same time. Defaults to the
+        number of cores.
+    journal : BatchJournal
+        Journal of converted files. Defaults to a journal in out_dir.
+    import_func : callable
+        Function importing a single file, with the signature of read_ifp.
+
+    Returns
+    -------
+    dict
+        Maps every input file to its status, 'done', 'skipped' or 'failed'.
+        Input files that would be written to the same gc file, because
+        their names only differ in the extension or directory, fail.
+    """
+    if cpu_budget is None:
+        cpu_budget = default_worker_count()
+    cpu_budget = max(1, cpu_budget)
+    if jobs is None:
+        jobs = min(2, cpu_budget)
+    jobs = max(1, min(jobs, cpu_budget, len(files) or 1))
+    render_workers = max(1, cpu_budget // jobs)
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    if journal is None:
+        journal = BatchJournal(os.path.join(out_dir, JOURNAL_FILE_NAME))
+    collisions = find_output_collisions(files, out_dir)
+
+    def convert(in_path):
+        out_path = output_path_for(in_path, out_dir)
+        if in_path in collisions:
+            logger.error('Not converting {}, another input file is also '
+                         'written to {}.'.format(in_path, out_path))
+            journal.mark(in_path, out_path, STATUS_FAILED)
+            return STATUS_FAILED
+        if journal.is_done(in_path, out_path):
+            logger.info('Skipping {}, already converted.'.format(in_path))
+            return STATUS_SKIPPED
+
+        logger.info('Converting {}'.format(in_path))
+        try:
+            scene = import_func(in_path, config, workers=render_workers)
+            if scene is None:
+                raise RuntimeError('Import returned no scene.')
+            gcio.save_scene(out_path, scene)
+        except Exception:
+            # Any failure only affects this file, the batch continues.
+            logger.exception('Could not convert {}'.format(in_path))
+            journal.mark(in_path, out_path, STATUS_FAILED)
+            return STATUS_FAILED
+        journal.mark(in_path, out_path, STATUS_DONE)
+        logger.info('Wrote {}'.format(out_path))
+        return STATUS_DONE
+
+    pool = ThreadPool(jobs)
+    try:
+        results = pool.map(convert, files)
+    finally:
+        pool.terminate()
+        pool.join()
+    return dict(zip(files, results))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Convert Lytro raw files to gc files.')
+    parser.add_argument('sources', nargs='+',
+                        help='directories, files or glob patterns of .lfp '
+                             'and .lfx files')
+    parser.add_argument('-o', '--output-dir', required=True,
+                        help='directory the gc files are written to')
+    parser.add_argument('-c', '--calibration',
+                        help='path to the camera calibration data, defaults '
+                             'to the path from the preferences')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of files converted concurrently')
+    parser.add_argument('--cpu-budget', type=int,
+                        help='total number of concurrent render processes')
+    parser.add_argument('--max-planes', type=int,
+                        default=DEFAULT_MAX_FOCAL_PLANES,
+                        help='maximum number of focal planes per file')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+
+    calibration = args.calibration
+    if calibration is None:
+        import gazer.preferences
+        calibration = gazer.preferences.get_calibration_path()
+    config = {'calibration_path': calibration,
+              'max_focal_planes': args.max_planes}
+
+    if not lpt_available():
+        logger.error('Lytro Power Tools are not installed.')
+        return 1
+
+    files = find_light_field_files(args.sources)
+    if not files:
+        logger.error('No light field files found.')
+        return 1
+    results = run_batch(files, args.output_dir, config, args.jobs,
+                        args.cpu_budget)
+    failed = [path for path, status in results.items()
+              if status == STATUS_FAILED]
+    for path in sorted(failed):
+        logger.error('Failed: {}'.format(path))
+    return 1 if failed else 0
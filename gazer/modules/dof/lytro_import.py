@@ -1,23 +1,50 @@
 from __future__ import division, print_function, unicode_literals
 
-from collections import Counter
 import json
 import os
 from functools import wraps
 import logging
+import threading
+from multiprocessing.pool import ThreadPool
 from scipy import misc
 import numpy as np
 
-from lpt.lfp.tnt import Tnt
+try:
+    from lpt.lfp.tnt import Tnt
+except ImportError:
+    # The Lytro Power Tools are optional, they are only needed to render.
+    Tnt = None
 
 from gazer.modules.temp_folder_manager import TempFolderManager
+from gazer.parallel import default_worker_count
 from gazer.modules.dof.dof_data import DOFData
+from gazer.modules.dof.render_cache import DEPTH_EXTENSION, RenderCache, \
+    file_hash
 from gazer.modules.dof.scenes import ImageStackScene
 
 
+# Number of distinct values resolved at once in value_map_to_index_map.
+_VALUE_CHUNK_SIZE = 4096
+
+# Default maximum number of focus images rendered per light field file.
+DEFAULT_MAX_FOCAL_PLANES = 32
+
+_KMEANS_MAX_ITERATIONS = 100
+
+
+def lpt_available():
+    """
+    Return whether the Lytro Power Tools needed to import light field files
+    are installed.
+    """
+    return Tnt is not None
+
+
 def tnt_command_sequence(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
+        if Tnt is None:
+            raise RuntimeError('Lytro Power Tools are not installed.')
         tnt = Tnt(verbose=True)
         result = f(tnt, *args, **kwargs)
         tnt.execute()
@@ -56,6 +83,35 @@ def get_depth_data(lfp_in):
         return read_depth_data(tmp_dir, depth_out_file_fame)
 
 
+def get_cached_depth_data(lfp_in, render_cache, lfp_hash):
+    """
+    Return the depth map and its metadata for the light field file, only
+    rendering them if they are not in the render cache.
+
+    Parameters
+    ----------
+    lfp_in : str
+        Path to the Lytro raw file.
+    render_cache : RenderCache
+        Cache the depth data is stored in.
+    lfp_hash : str
+        Hash of the light field file, see file_hash.
+    """
+    def render(path):
+        depth_map, depth_meta = get_depth_data(lfp_in)
+        with open(path, 'wb') as out_file:
+            np.savez(out_file, depth_map=depth_map,
+                     meta=json.dumps(depth_meta))
+
+    path = render_cache.get_or_render(render_cache.depth_key(lfp_hash),
+                                      render, DEPTH_EXTENSION)
+    depth_data = np.load(path, allow_pickle=False)
+    try:
+        return depth_data['depth_map'], json.loads(depth_data['meta'].item())
+    finally:
+        depth_data.close()
+
+
 @tnt_command_sequence
 def make_focus_image(tnt, lfp_in, image_out, focus, calibration,
                      image_size=None):
@@ -69,13 +125,63 @@ def make_focus_image(tnt, lfp_in, image_out, focus, calibration,
 
 
 def get_main_depth_planes(depth_map, threshold=0.02):
-    overall_count = depth_map.size
-    counts = Counter(depth_map.flat)
-    main_depth_planes = []
-    for depth, depth_count in counts.iteritems():
-        if depth_count > threshold * overall_count:
-            main_depth_planes.append(depth)
-    return main_depth_planes
+    """
+    Return the depth values that cover more than the threshold fraction of
+    the depth map.
+    """
+    values, counts = np.unique(depth_map, return_counts=True)
+    return list(values[counts > threshold * depth_map.size])
+
+
+def plan_focal_planes(depth_map, max_planes=DEFAULT_MAX_FOCAL_PLANES):
+    """
+    Choose at most max_planes representative depth values for the depth map.
+
+    The depth values are clustered by a 1-D k-means on their histogram, so
+    the planes are placed where most of the pixels are. If the depth map
+    has no more than max_planes distinct values, these are returned
+    unchanged.
+
+    Parameters
+    ----------
+    depth_map : ndarray
+        Depth map as read from the Lytro api.
+    max_planes : int
+        Maximum number of planes. None for one plane per depth value.
+
+    Returns
+    -------
+    ndarray
+        Sorted depth values of the planes.
+    """
+    values, counts = np.unique(depth_map, return_counts=True)
+    if max_planes is None or len(values) <= max_planes:
+        return values
+    if max_planes < 1:
+        raise ValueError('At least one focal plane is required.')
+
+    values = values.astype(np.float64)
+    weights = counts.astype(np.float64)
+    # Start with centres at evenly spaced quantiles of the pixel
+    # distribution.
+    cumulative = np.cumsum(weights) / weights.sum()
+    quantiles = (np.arange(max_planes) + 0.5) / max_planes
+    centres = values[np.searchsorted(cumulative, quantiles)]
+    centres = np.unique(centres)
+
+    for __ in range(_KMEANS_MAX_ITERATIONS):
+        labels = value_map_to_index_map(values, centres)
+        weight_sums = np.bincount(labels, weights, len(centres))
+        value_sums = np.bincount(labels, weights * values, len(centres))
+        used = weight_sums > 0
+        new_centres = value_sums[used] / weight_sums[used]
+        if len(new_centres) == len(centres) and \
+                np.allclose(new_centres, centres):
+            break
+        centres = new_centres
+
+    planes = np.unique(np.round(centres))
+    return planes.astype(depth_map.dtype)
 
 
 def remap(value, from_range, to_range):
@@ -95,22 +201,27 @@ def value_map_to_index_map(value_map, index_list):
     """
     Return every value in the value_map with the index of
     the closest value from the index_list.
+    If two values are equally close, the one listed first is used.
 
     Parameters
     ----------
     value_map : ndarray
     index_list : list
     """
-    index_array = np.array(index_list)
+    value_map = np.asarray(value_map)
+    index_array = np.asarray(index_list, dtype=np.float64)
 
-    def indexify(val):
-        dist = index_array - val
-        abs_dist = np.abs(dist)
-        return abs_dist.argmin()
+    # Every distinct value only needs to be resolved once, which for
+    # uint8 depth maps means at most 256 lookups.
+    values, inverse = np.unique(value_map, return_inverse=True)
+    values = values.astype(np.float64)
+    nearest = np.empty(len(values), dtype=np.intp)
+    for start in range(0, len(values), _VALUE_CHUNK_SIZE):
+        chunk = values[start:start + _VALUE_CHUNK_SIZE]
+        abs_dist = np.abs(chunk[:, np.newaxis] - index_array[np.newaxis, :])
+        nearest[start:start + _VALUE_CHUNK_SIZE] = abs_dist.argmin(axis=1)
 
-    result = [indexify(x) for x in value_map.flat]
-    result = np.array(result).reshape(value_map.shape)
-    return result
+    return nearest[inverse].reshape(value_map.shape)
 
 
 def lambda_from_depth(value, depth_meta):
@@ -140,37 +251,139 @@ def lambda_from_depth(value, depth_meta):
     return lambda_value
 
 
-def ifp_to_dof_data(lfp_in, calibration, out_path, status_callback=None):
-    depth_map, depth_meta = get_depth_data(lfp_in)
+def render_focus_images(jobs, render, workers=None, status_callback=None):
+    """
+    Run render for every job on a bounded pool of threads.
+
+    Progress is reported in job order through the status callback. After
+    the first failure no further jobs are started; jobs that are already
+    running are allowed to finish before the exception is re-raised.
+
+    Parameters
+    ----------
+    jobs : list
+        Arguments for render.
+    render : callable
+        Function rendering a single job, e.g. by running Tnt.
+    workers : int
+        Maximum number of concurrent renders. Defaults to the number of
+        cores.
+    status_callback : callable
+        Called with a progress string after each job in order.
+
+    Returns
+    -------
+    list
+        Results of render in job order.
+    """
+    if workers is None:
+        workers = default_worker_count()
+    workers = max(1, min(workers, len(jobs)))
+    failed = threading.Event()
+
+    def run(job):
+        if failed.is_set():
+            return None
+        try:
+            return render(job)
+        except Exception:
+            failed.set()
+            raise
+
+    pool = ThreadPool(workers)
+    try:
+        results = []
+        for num, result in enumerate(pool.imap(run, jobs)):
+            results.append(result)
+            if status_callback:
+                status_callback('{}/{}'.format(num + 1, len(jobs)))
+        return results
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def ifp_to_dof_data(lfp_in, calibration, out_path, status_callback=None,
+                    workers=None, max_planes=DEFAULT_MAX_FOCAL_PLANES,
+                    render_cache=None):
+    """
+    Render focus images for the main depth planes of the light field file.
+
+    The depth map is remapped so every pixel refers to the closest of the
+    planes chosen by plan_focal_planes.
+
+    Parameters
+    ----------
+    lfp_in : str
+        Path to the Lytro raw file.
+    calibration : str
+        Path to the camera calibration data.
+    out_path : str
+        Folder the focus images are rendered to if no render cache is
+        used. Existing images are reused.
+    status_callback : callable
+        Called with a progress string after each rendered image.
+    workers : int
+        Number of Tnt processes run concurrently. Defaults to the number of
+        cores.
+    max_planes : int
+        Maximum number of focus images. None for one image per depth value.
+    render_cache : RenderCache
+        Cache the depth map and focus images are taken from and rendered
+        to. Focus images are then not written to out_path.
+
+    Returns
+    -------
+    DOFData
+    """
+    if render_cache is not None:
+        lfp_hash = file_hash(lfp_in)
+        depth_map, depth_meta = get_cached_depth_data(lfp_in, render_cache,
+                                                      lfp_hash)
+    else:
+        depth_map, depth_meta = get_depth_data(lfp_in)
+
+    planes = plan_focal_planes(depth_map, max_planes)
+    depth_map = planes[value_map_to_index_map(depth_map, planes)]
 
-    frame_mapping = {}
     file_basename = os.path.basename(str(lfp_in)).split('.')[0]
     file_name_template = file_basename + '_f_{}.jpg'
-    unique_depth_values = np.unique(depth_map)
-    for num, depth in enumerate(unique_depth_values):
+    jobs = []
+    for depth in planes:
         lambda_value = lambda_from_depth(depth, depth_meta)
         out_image = os.path.join(out_path,
                                  file_name_template.format(lambda_value))
-
-        debug_msg = "Processing image {} - {}/{}"
-        logging.debug(debug_msg.format(out_image,
-                                       num + 1,
-                                       len(unique_depth_values)))
-        if status_callback:
-            status_callback('{}/{}'.format(num + 1, len(unique_depth_values)))
-        if not os.path.exists(out_image):
+        jobs.append((lambda_value, out_image))
+
+    def render(job):
+        lambda_value, out_image = job
+        logging.debug("Processing image {}".format(out_image))
+        if render_cache is not None:
+            key = render_cache.key(lfp_hash, calibration, lambda_value)
+            out_image = render_cache.get_or_render(
+                key,
+                lambda path: make_focus_image(lfp_in, path, lambda_value,
+                                              calibration))
+        elif not os.path.exists(out_image):
             make_focus_image(lfp_in, out_image, lambda_value, calibration)
-        if depth not in frame_mapping:
-            image = misc.imread(out_image)
-            frame_mapping[depth] = image
+        return misc.imread(out_image)
+
+    images = render_focus_images(jobs, render, workers, status_callback)
+    if render_cache is not None:
+        render_cache.evict()
+    frame_mapping = dict(zip(planes, images))
 
     return DOFData(depth_map, frame_mapping)
 
 
-def read_ifp(file_name, config, status_callback=None):
+def read_ifp(file_name, config, status_callback=None, workers=None,
+             render_cache=None):
     logging.debug('Loading IFP or IFR file: ' + file_name)
 
     calibration = config['calibration_path']
+    max_planes = config.get('max_focal_planes', DEFAULT_MAX_FOCAL_PLANES)
+    if render_cache is None and config.get('use_render_cache', True):
+        render_cache = RenderCache()
     scene = None
 
     with TempFolderManager() as tmp_dir:
@@ -178,7 +391,10 @@ def read_ifp(file_name, config, status_callback=None):
             dof_data = ifp_to_dof_data(file_name,
                                        calibration,
                                        tmp_dir,
-                                       status_callback)
+                                       status_callback,
+                                       workers,
+                                       max_planes,
+                                       render_cache)
             scene = ImageStackScene.from_dof_data(dof_data)
 
         except RuntimeError:
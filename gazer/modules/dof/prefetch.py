@@ -0,0 +1,194 @@
+"""
+This module provides background prefetching of the frames an
+ImageStackScene is about to show.
+"""
+
+from __future__ import unicode_literals, division, print_function
+
+import collections
+import logging
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_shared_pool():
+    """
+    Return the thread pool shared by all prefetchers, creating it on first
+    use.
+    """
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = ThreadPool(DEFAULT_WORKERS)
+        return _shared_pool
+
+
+class FramePrefetcher(object):
+    """
+    Predicts which frames will be needed over the next ticks and preloads
+    them on a thread pool through ImageManager.preload.
+
+    The prediction uses the frames the interpolator passes on its way from
+    the current value to the target, and the target at the gaze position
+    extrapolated from the recent gaze motion. The frame at the current
+    value is pinned, so preloading never drops the frame on display. Works
+    with any ImageManager; for managers without lazy loading preloading is
+    a no-op.
+    """
+
+    def __init__(self, image_manager, lookup_table, pool=None,
+                 history_length=4, lookahead=3, spread=1):
+        """
+        Parameters
+        ----------
+        image_manager : ImageManager
+            Manager whose frames are preloaded.
+        lookup_table : LookupTable
+            Lookup table used to predict the target at the extrapolated
+            gaze position.
+        pool : multiprocessing.pool.ThreadPool
+            Pool used for preloading. Defaults to a pool shared by all
+            prefetchers.
+        history_length : int
+            Number of recent gaze samples used to estimate the gaze motion.
+        lookahead : int
+            Number of gaze samples to extrapolate the gaze motion ahead.
+        spread : int
+            Number of neighbouring frames to preload around each target.
+        """
+        self.image_manager = image_manager
+        self.lookup_table = lookup_table
+        self._keys = sorted(image_manager.keys)
+        self._valid_keys = frozenset(self._keys)
+        self._pool = pool
+        self.lookahead = lookahead
+        self.spread = spread
+        self._gaze_history = collections.deque(maxlen=history_length)
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._last_keys = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = get_shared_pool()
+        return self._pool
+
+    def update_gaze(self, pos):
+        """
+        Record a gaze sample for motion estimation.
+        """
+        if pos is not None:
+            self._gaze_history.append(pos)
+
+    def predict_gaze(self):
+        """
+        Extrapolate the gaze position from the recent gaze motion.
+
+        Returns
+        -------
+        tuple
+            Predicted normalised gaze position or None if there is no gaze
+            history.
+        """
+        if not self._gaze_history:
+            return None
+        last = self._gaze_history[-1]
+        if len(self._gaze_history) < 2:
+            return last
+        first = self._gaze_history[0]
+        steps = len(self._gaze_history) - 1
+        predicted = []
+        for first_coord, last_coord in zip(first, last):
+            velocity = (last_coord - first_coord) / steps
+            predicted.append(last_coord + velocity * self.lookahead)
+        return tuple(np.clip(predicted, 0, 1 - 1e-6))
+
+    def predict_keys(self, current_value, target):
+        """
+        Return the keys of the frames expected to be shown next, ordered by
+        the time they are expected to be needed.
+        """
+        targets = [target]
+        predicted_pos = self.predict_gaze()
+        if predicted_pos is not None:
+            predicted_target = self.lookup_table.sample_position(
+                predicted_pos)
+            if predicted_target is not None:
+                targets.append(predicted_target)
+
+        keys = []
+        start = int(current_value)
+        for end in targets:
+            end = int(end)
+            step = 1 if end >= start else -1
+            keys.extend(range(start, end + step, step))
+            keys.extend(range(end + step, end + step * (self.spread + 1),
+                              step))
+            keys.extend(range(end - step, end - step * (self.spread + 1),
+                              -step))
+            start = end
+
+        ordered_keys = []
+        seen = set()
+        for key in keys:
+            if key in self._valid_keys and key not in seen:
+                seen.add(key)
+                ordered_keys.append(key)
+        return ordered_keys
+
+    def prefetch(self, current_value, target):
+        """
+        Start preloading the frames expected between the current interpolator
+        value and the target. Frames that are already being preloaded are not
+        requested again.
+
+        Parameters
+        ----------
+        current_value : numeric
+            Current value of the interpolator.
+        target : numeric
+            Current target of the interpolator.
+        """
+        if current_value is None or target is None:
+            return
+        self.image_manager.pin(int(current_value))
+        keys = self.predict_keys(current_value, target)
+        if keys == self._last_keys:
+            return
+        self._last_keys = keys
+        for key in keys:
+            with self._pending_lock:
+                if key in self._pending:
+                    continue
+                self._pending.add(key)
+            self.pool.apply_async(self._preload, (key,))
+
+    def _preload(self, key):
+        try:
+            self.image_manager.preload([key])
+        except Exception:
+            logger.exception('Failed to preload frame {}'.format(key))
+        finally:
+            with self._pending_lock:
+                self._pending.discard(key)
+
+    def wait(self):
+        """
+        Block until all requested frames have been preloaded.
+        """
+        while True:
+            with self._pending_lock:
+                if not self._pending:
+                    return
+            time.sleep(0.001)
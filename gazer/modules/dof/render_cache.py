@@ -0,0 +1,204 @@
+"""
+This module provides a persistent on-disk cache for focus images and depth
+maps rendered from Lytro light field files.
+
+Entries are addressed by a hash of the content of the light field file and
+the render settings: the calibration path, the lambda value and the image
+size for focus images. Re-importing a capture therefore reuses everything
+that was rendered before. The cache is
+limited in size; the least recently used files are evicted first, using
+the modification time of the files as the time of last use.
+"""
+
+from __future__ import unicode_literals, division, print_function
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+from gazer.preferences import DATA_PATH
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(DATA_PATH, 'render_cache')
+DEFAULT_MAX_SIZE = 2 * 1024 ** 3
+
+IMAGE_EXTENSION = '.jpg'
+DEPTH_EXTENSION = '.npz'
+CACHE_EXTENSIONS = (IMAGE_EXTENSION, DEPTH_EXTENSION)
+
+_HASH_CHUNK_SIZE = 1024 ** 2
+
+
+def file_hash(path):
+    """
+    Return the hex digest of the SHA-1 hash of the content of a file.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as in_file:
+        for chunk in iter(lambda: in_file.read(_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RenderCache(object):
+    """
+    Directory of rendered focus images and depth maps with a size limit and
+    least recently used eviction. Safe to use from multiple threads.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE):
+        """
+        Parameters
+        ----------
+        cache_dir : str
+            Directory the files are stored in. Created if it does not
+            exist.
+        max_size : int
+            Maximum total size of the cached files in bytes.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    @staticmethod
+    def key(lfp_hash, calibration, lambda_value, image_size=None):
+        """
+        Return the cache key of a focus image.
+
+        Parameters
+        ----------
+        lfp_hash : str
+            Hash of the light field file, see file_hash.
+        calibration : str
+            Path to the camera calibration data.
+        lambda_value : numeric
+            Focus the image is rendered at.
+        image_size : tuple
+            Width and height of the image or None for the default size.
+        """
+        description = '{}|{}|{!r}|{}'.format(lfp_hash,
+                                             os.path.abspath(calibration),
+                                             float(lambda_value),
+                                             image_size)
+        return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def depth_key(lfp_hash):
+        """
+        Return the cache key of the depth map of a light field file, which
+        does not depend on any render settings.
+
+        Parameters
+        ----------
+        lfp_hash : str
+            Hash of the light field file, see file_hash.
+        """
+        description = '{}|depth'.format(lfp_hash)
+        return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+    def path_for(self, key, extension=IMAGE_EXTENSION):
+        return os.path.join(self.cache_dir, key + extension)
+
+    def lookup(self, key, extension=IMAGE_EXTENSION):
+        """
+        Return the path of the cached file or None if it is not cached.
+        Marks the file as recently used.
+        """
+        path = self.path_for(key, extension)
+        try:
+            os.utime(path, None)
+        except OSError:
+            return None
+        return path
+
+    def get_or_render(self, key, render, extension=IMAGE_EXTENSION):
+        """
+        Return the path of the cached file, rendering it first if needed.
+
+        Parameters
+        ----------
+        key : str
+            Cache key, see RenderCache.key and RenderCache.depth_key.
+        render : callable
+            Called with the path the file has to be written to.
+        extension : str
+            Extension of the file, one of CACHE_EXTENSIONS.
+
+        Returns
+        -------
+        str
+            Path of the cached file.
+        """
+        path = self.lookup(key, extension)
+        if path is not None:
+            logger.debug('Render cache hit for {}'.format(key))
+            return path
+
+        # Render to a temporary name, so an interrupted render never leaves
+        # a broken file under the final name.
+        handle, tmp_path = tempfile.mkstemp(prefix='.' + key,
+                                            suffix=extension,
+                                            dir=self.cache_dir)
+        os.close(handle)
+        os.remove(tmp_path)
+        try:
+            render(tmp_path)
+            path = self.path_for(key, extension)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return path
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.startswith('.') or not name.endswith(CACHE_EXTENSIONS):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    @property
+    def size(self):
+        """
+        Total size of the cached files in bytes.
+        """
+        return sum(size for __, size, __ in self._entries())
+
+    def evict(self):
+        """
+        Remove the least recently used files until the cache fits its size
+        limit.
+        """
+        with self._lock:
+            entries = sorted(self._entries())
+            total_size = sum(size for __, size, __ in entries)
+            for __, size, path in entries:
+                if total_size <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    logger.exception('Could not evict {}'.format(path))
+                    continue
+                total_size -= size
+
+    def clear(self):
+        """
+        Remove all cached files.
+        """
+        with self._lock:
+            for __, __, path in self._entries():
+                os.remove(path)
@@ -1,8 +1,10 @@
 from __future__ import unicode_literals, division, print_function
 
-import StringIO
 import base64
+import copy
 import io
+import zlib
+from functools import partial
 
 import bson
 from bson import BSON
@@ -10,12 +12,50 @@ from bson import BSON
 import numpy as np
 from scipy import misc
 
-from gazer.gcio import DataDecoder, DataEncoder
-from gazer.modules.dof.image_manager import ArrayStackImageManager
-from gazer.modules.dof.interpolator import LinearInterpolator
+from gazer.gcio import DataDecoder, DataEncoder, array_to_bytes, \
+    bytes_to_array
+from gazer.modules.dof.image_manager import ArrayStackImageManager, \
+    LazyImageManager, DEFAULT_CACHE_BUDGET
+from gazer.modules.dof.interpolator import make_interpolator
 from gazer.modules.dof.lookup_table import ArrayLookupTable
+from gazer.modules.dof.prefetch import FramePrefetcher
+from gazer.parallel import parallel_map
 from gazer.scene import Scene
 
+LOOKUP_TABLE_ENTRY = 'lookup_table'
+
+# Codecs for the frames of an ImageStackScene. 'jpeg' is lossy, 'raw' and
+# 'zlib' store the numpy buffer as is, uncompressed or zlib compressed.
+FRAME_CODECS = ('jpeg', 'raw', 'zlib')
+DEFAULT_FRAME_CODEC = 'jpeg'
+
+
+def _make_depth_colour_map():
+    # Piecewise linear ramp from dark blue (near) over cyan, green and
+    # yellow to dark red (far).
+    steps = [0, 64, 128, 192, 255]
+    colours = np.array([[0, 0, 128],
+                        [0, 128, 255],
+                        [128, 255, 128],
+                        [255, 128, 0],
+                        [128, 0, 0]])
+    values = np.arange(256)
+    colour_map = [np.interp(values, steps, channel) for channel in colours.T]
+    return np.round(np.column_stack(colour_map)).astype(np.uint8)
+
+
+# RGB colours used for the coloured depth map view, indexed by the
+# normalised depth value.
+DEPTH_COLOUR_MAP = _make_depth_colour_map()
+
+
+def frame_entry_name(key):
+    """
+    Return the name of the container entry holding the frame with the given
+    key.
+    """
+    return 'frames/{}'.format(key)
+
 
 class ImageStackScene(Scene):
     """
@@ -30,7 +70,7 @@ class ImageStackScene(Scene):
     scene_type = 'simple_array_stack'
 
     @classmethod
-    def from_dof_data(cls, dof_data, interpolator=LinearInterpolator()):
+    def from_dof_data(cls, dof_data, interpolator=None):
         depth_values, indices = np.unique(dof_data.depth_array,
                                           return_inverse=True)
         image_array = [dof_data.frame_mapping.get(val) for val in depth_values]
@@ -39,35 +79,96 @@ class ImageStackScene(Scene):
         lookup_table = ArrayLookupTable(indices)
         return cls(image_manager, lookup_table, interpolator)
 
-    def __init__(self, image_manager, lookup_table,
-                 interpolator=LinearInterpolator()):
+    def __init__(self, image_manager, lookup_table, interpolator=None):
+        """
+        Parameters
+        ----------
+        image_manager : ImageManager
+            Manager providing the frames.
+        lookup_table : LookupTable
+            Maps gaze positions to frame indices.
+        interpolator : Interpolator
+            Moves the displayed frame towards the frame at the gaze
+            position. Defaults to a new interpolator of the default type,
+            see make_interpolator.
+        """
         super(ImageStackScene, self).__init__()
         self.image_manager = image_manager
         self.lookup_table = lookup_table
+        if interpolator is None:
+            interpolator = make_interpolator()
         self.interpolator = interpolator
 
         self._current_index = 0
         self.target_index = 0
         self.gaze_pos = None
+        self.prefetcher = None
+        # If True, every read of current_index advances the interpolator
+        # by one step. Set to False when tick is called regularly instead.
+        self.step_on_read = True
+        self._indices_images = {}
+        self._indices_images_source = None
 
         self.p = False
 
+    def enable_prefetch(self, pool=None):
+        """
+        Preload the frames that will be needed over the next ticks in the
+        background, see FramePrefetcher.
+
+        Parameters
+        ----------
+        pool : multiprocessing.pool.ThreadPool
+            Pool used for preloading, defaults to a shared pool.
+        """
+        self.prefetcher = FramePrefetcher(self.image_manager,
+                                          self.lookup_table,
+                                          pool)
+
+    def update_gaze(self, pos):
+        super(ImageStackScene, self).update_gaze(pos)
+        if self.prefetcher is not None:
+            self.prefetcher.update_gaze(pos)
+
     def set_index(self, depth):
         self.target_index = depth
 
+    def _update_target(self):
+        sampled_index = self.lookup_table.sample_position(self.gaze_pos)
+        if sampled_index is not None:
+            self.interpolator.target = sampled_index
+
+    def _prefetch(self):
+        if self.prefetcher is not None:
+            self.prefetcher.prefetch(self._current_index,
+                                     self.interpolator.target)
+
     @property
     def current_index(self):
         if not self.gaze_pos:
             return
-        sampled_index = self.lookup_table.sample_position(self.gaze_pos)
-        if sampled_index is not None:
-            self.interpolator.target = sampled_index
+        self._update_target()
 
-        # TODO: remove side-effect
-        self._current_index = self.interpolator.make_step()
+        if self.step_on_read:
+            self._current_index = self.interpolator.make_step()
+        else:
+            self._current_index = self.interpolator.index
+        self._prefetch()
 
         return self._current_index
 
+    def tick(self, delta_time):
+        """
+        Advance the interpolator towards the frame at the gaze position by
+        the given time. Disable step_on_read when using this, so the
+        transition speed does not depend on how often frames are read.
+        """
+        if not self.gaze_pos:
+            return
+        self._update_target()
+        self._current_index = self.interpolator.advance(delta_time)
+        self._prefetch()
+
     def render(self):
         self.image_manager.draw_image(self.current_index)
 
@@ -77,13 +178,66 @@ class ImageStackScene(Scene):
             index = self.current_index
         return self.image_manager.load_image(index)
 
-    def get_indices_image(self):
-        array = self.lookup_table.array
-        max_elem = array.max()
-        min_elem = array.min()
-        array_normalised = 255 * ((array - min_elem) / (max_elem - min_elem))
+    def current_frame(self):
+        index = self.current_index
+        return index, self.image_manager.load_image(index)
+
+    def peek_frame_key(self):
+        """
+        Return the index the next read of current_index will return. When
+        stepping on read, the step is done on a copy of the interpolator, so
+        the scene state is not changed.
+        """
+        if not self.gaze_pos:
+            return None
+        if not self.step_on_read:
+            return self.interpolator.index
+        interpolator = copy.copy(self.interpolator)
+        sampled_index = self.lookup_table.sample_position(self.gaze_pos)
+        if sampled_index is not None:
+            interpolator.target = sampled_index
+        return interpolator.make_step()
 
-        return np.asarray(array_normalised, np.uint8)
+    def get_indices_image(self, coloured=False):
+        """
+        Return the lookup table normalised to an 8 bit image.
+
+        The image is computed on first use and cached until the lookup table
+        or its array is replaced; in place changes of the array are not
+        detected. The returned array is read only.
+
+        Parameters
+        ----------
+        coloured : bool
+            If True, return an RGB image coloured with DEPTH_COLOUR_MAP
+            instead of grey values.
+        """
+        array = self.lookup_table.array
+        if self._indices_images_source is not array:
+            self._indices_images = {}
+            self._indices_images_source = array
+
+        image = self._indices_images.get(coloured)
+        if image is not None:
+            return image
+
+        if coloured:
+            grey = self.get_indices_image()
+            if grey.ndim == 3:
+                grey = np.asarray(grey.mean(axis=2), np.uint8)
+            image = DEPTH_COLOUR_MAP[grey]
+        else:
+            max_elem = array.max()
+            min_elem = array.min()
+            if max_elem == min_elem:
+                image = np.zeros(array.shape, np.uint8)
+            else:
+                array_normalised = 255 * ((array - min_elem) /
+                                          (max_elem - min_elem))
+                image = np.asarray(array_normalised, np.uint8)
+        image.flags.writeable = False
+        self._indices_images[coloured] = image
+        return image
 
     @property
     def iter_images(self):
@@ -97,22 +251,119 @@ class SimpleArrayStackDecoder(DataDecoder):
     """
     Naive implementation of a decoder for an ImageStackScene object.
     """
+    scene_type = 'simple_array_stack'
 
-    def scene_from_data(self, data):
+    def __init__(self, lazy=False, cache_budget=DEFAULT_CACHE_BUDGET,
+                 workers=None):
+        """
+        Parameters
+        ----------
+        lazy : bool
+            If True, frames are kept encoded and only decoded on first
+            access, see LazyImageManager.
+        cache_budget : int
+            Byte budget for decoded frames when decoding lazily.
+        workers : int
+            Number of threads used to decode frames, on load when not
+            decoding lazily, otherwise when iterating over all frames.
+            Defaults to the number of cores, 1 decodes serially.
+        """
+        self.lazy = lazy
+        self.cache_budget = cache_budget
+        self.workers = workers
+
+    def scene_from_data(self, data, image_manager=None):
+        """
+        Create a scene from a version 0.1 data body.
+
+        Parameters
+        ----------
+        data : bytes
+            BSON encoded scene data.
+        image_manager : ImageManager
+            If given, frames are taken from this manager instead of being
+            decoded from the data and are not prefetched.
+
+        Returns
+        -------
+        ImageStackScene
+        """
         bson_data = BSON(data)
         data_dict = bson_data.decode()
         decoded_array = self._decode_array(data_dict[u'lookup_table'])
         lut = ArrayLookupTable(decoded_array)
-        frames = [self._decode_array(value) for key, value
-                  in
-                  sorted(data_dict['frames'].items(), key=lambda x: int(x[0]))]
-        image_manager = ArrayStackImageManager(frames)
-        scene = ImageStackScene(image_manager, lut)
+        if image_manager is not None:
+            return ImageStackScene(image_manager, lut)
+        encoded_frames = [self._unwrap(value) for key, value
+                          in
+                          sorted(data_dict['frames'].items(),
+                                 key=lambda x: int(x[0]))]
+        frame_codec = data_dict.get('frame_codec', DEFAULT_FRAME_CODEC)
+        image_manager = self._make_image_manager(encoded_frames, frame_codec)
+        return self._make_scene(image_manager, lut)
+
+    def scene_from_container(self, reader, image_manager=None):
+        """
+        Create a scene from a version 2 container.
+
+        Parameters
+        ----------
+        reader : gazer.container.ContainerReader
+            Reader of the container holding the scene entries.
+        image_manager : ImageManager
+            If given, frames are taken from this manager and only the lookup
+            table is read from the container. The frames are not prefetched.
+
+        Returns
+        -------
+        ImageStackScene
+        """
+        lut_data = reader.read_entry(LOOKUP_TABLE_ENTRY)
+        lut = ArrayLookupTable(self._decode_image(lut_data))
+        if image_manager is not None:
+            return ImageStackScene(image_manager, lut)
+        frame_count = reader.meta['frame_count']
+        encoded_frames = [reader.read_entry(frame_entry_name(key))
+                          for key in range(frame_count)]
+        frame_codec = reader.meta.get('frame_codec', DEFAULT_FRAME_CODEC)
+        image_manager = self._make_image_manager(encoded_frames, frame_codec)
+        return self._make_scene(image_manager, lut)
+
+    def _make_scene(self, image_manager, lookup_table):
+        # Only frames decoded by this decoder are prefetched; a given image
+        # manager, e.g. a memory mapped frame cache, needs no decoding.
+        scene = ImageStackScene(image_manager, lookup_table)
+        if self.lazy:
+            scene.enable_prefetch()
         return scene
 
+    def _make_image_manager(self, encoded_frames, frame_codec):
+        if frame_codec not in FRAME_CODECS:
+            raise ValueError('Unknown frame codec {}'.format(frame_codec))
+        decode = partial(self._decode_frame, frame_codec=frame_codec)
+        if self.lazy:
+            return LazyImageManager(encoded_frames,
+                                    decode,
+                                    self.cache_budget,
+                                    self.workers)
+        frames = parallel_map(decode, encoded_frames, self.workers)
+        return ArrayStackImageManager(frames)
+
+    def _decode_frame(self, data, frame_codec):
+        if frame_codec == 'raw':
+            return bytes_to_array(data)
+        if frame_codec == 'zlib':
+            return bytes_to_array(zlib.decompress(data))
+        return self._decode_image(data)
+
     def _decode_array(self, data):
-        decoded = base64.b64decode(data)
-        array = misc.imread(StringIO.StringIO(decoded))
+        return self._decode_image(self._unwrap(data))
+
+    def _unwrap(self, data):
+        return base64.b64decode(data)
+
+    def _decode_image(self, data):
+        array = misc.imread(io.BytesIO(data))
         array.flags.writeable = False
         return array
 
@@ -121,6 +372,19 @@ class SimpleArrayStackEncoder(DataEncoder):
     """
     Naive implementation of a encoder for an ImageStackScene object.
     """
+    scene_type = 'simple_array_stack'
+
+    def __init__(self, frame_codec=DEFAULT_FRAME_CODEC):
+        """
+        Parameters
+        ----------
+        frame_codec : str
+            Codec used for the frames, one of FRAME_CODECS. The codec is
+            stored in the file.
+        """
+        if frame_codec not in FRAME_CODECS:
+            raise ValueError('Unknown frame codec {}'.format(frame_codec))
+        self.frame_codec = frame_codec
 
     def data_from_scene(self, scene):
         lut_array = scene.lookup_table.array
@@ -130,21 +394,76 @@ class SimpleArrayStackEncoder(DataEncoder):
                 frame = scene.image_manager.load_array(frame_index)
                 yield frame
 
-        stream = io.BytesIO()
-
-        frames = {str(key): self._encode_array(array, 'jpeg') for key, array in
-                  enumerate(frame_iterator())}
+        frames = {str(key): self._wrap(self._encode_frame(array))
+                  for key, array in enumerate(frame_iterator())}
 
         lut_array = np.asarray(lut_array, np.uint8)
         data = {'lookup_table': self._encode_array(lut_array, 'bmp'),
-                'frames': frames
+                'frames': frames,
+                'frame_codec': self.frame_codec,
                 }
 
-        stream.write(BSON.encode(data))
-        stream.seek(0)
-        return bson.Binary(stream.getvalue())
+        return bson.Binary(BSON.encode(data))
+
+    def write_to_container(self, scene, writer):
+        """
+        Write the lookup table and frames of the scene as separate entries.
+        Frames are encoded and written one at a time.
+
+        Parameters
+        ----------
+        scene : ImageStackScene
+            Scene to be written.
+        writer : gazer.container.ContainerWriter
+            Writer of the output container.
+        """
+        lut_array = np.asarray(scene.lookup_table.array, np.uint8)
+        writer.add_entry(LOOKUP_TABLE_ENTRY, self._encode_image(lut_array,
+                                                                'bmp'))
+        frame_keys = sorted(scene.image_manager.keys)
+        for key, frame_index in enumerate(frame_keys):
+            frame = scene.image_manager.load_array(frame_index)
+            writer.add_entry(frame_entry_name(key),
+                             self._encode_frame(frame))
+        writer.meta['frame_count'] = len(frame_keys)
+        writer.meta['frame_codec'] = self.frame_codec
+
+    def _encode_frame(self, array):
+        if self.frame_codec == 'raw':
+            return array_to_bytes(array)
+        if self.frame_codec == 'zlib':
+            return zlib.compress(array_to_bytes(array))
+        return self._encode_image(array, 'jpeg')
 
     def _encode_array(self, array, file_format):
+        return self._wrap(self._encode_image(array, file_format))
+
+    def _wrap(self, data):
+        return base64.b64encode(data)
+
+    def _encode_image(self, array, file_format):
         stream = io.BytesIO()
         misc.imsave(stream, array, file_format)
-        return base64.b64encode(stream.getvalue())
+        return stream.getvalue()
+
+
+class BinaryArrayStackDecoder(SimpleArrayStackDecoder):
+    """
+    Decoder for ImageStackScene objects whose images are stored as BSON
+    binary data instead of base64 strings.
+    """
+    scene_type = 'binary_array_stack'
+
+    def _unwrap(self, data):
+        return bytes(data)
+
+
+class BinaryArrayStackEncoder(SimpleArrayStackEncoder):
+    """
+    Encoder for ImageStackScene objects that stores images as BSON binary
+    data, avoiding the size and time overhead of base64.
+    """
+    scene_type = 'binary_array_stack'
+
+    def _wrap(self, data):
+        return bson.Binary(data)
@@ -0,0 +1,110 @@
+"""
+This module provides helpers to spread independent work items over
+multiple threads.
+"""
+
+from __future__ import unicode_literals, division, print_function
+
+import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+logger = logging.getLogger(__name__)
+
+
+def default_worker_count():
+    """
+    Return the number of available cores, or 1 if it can not be determined.
+    """
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def parallel_map(func, items, workers=None):
+    """
+    Apply func to every item using a pool of worker threads.
+
+    Intended for work that releases the GIL, like image decoding or
+    decompression. Falls back to a serial map if only one worker is
+    requested, there is at most one item, or no thread pool can be created.
+
+    Parameters
+    ----------
+    func : callable
+        Function to apply to every item.
+    items : iterable
+        Items to process.
+    workers : int
+        Number of worker threads. Defaults to the number of cores.
+
+    Returns
+    -------
+    list
+        Results in the order of the items.
+    """
+    items = list(items)
+    if workers is None:
+        workers = default_worker_count()
+    workers = min(workers, len(items))
+    if workers <= 1:
+        return [func(item) for item in items]
+
+    try:
+        pool = ThreadPool(workers)
+    except (OSError, RuntimeError):
+        logger.exception('Could not create thread pool, running serially.')
+        return [func(item) for item in items]
+
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def parallel_iter(func, items, workers=None):
+    """
+    Apply func to every item using a pool of worker threads and yield the
+    results in order.
+
+    Unlike parallel_map, items are processed in batches of one item per
+    worker, so at most one batch of results is held at a time.
+
+    Parameters
+    ----------
+    func : callable
+        Function to apply to every item.
+    items : iterable
+        Items to process.
+    workers : int
+        Number of worker threads. Defaults to the number of cores.
+
+    Yields
+    ------
+    Results in the order of the items.
+    """
+    items = list(items)
+    if workers is None:
+        workers = default_worker_count()
+    workers = min(workers, len(items))
+    pool = None
+    if workers > 1:
+        try:
+            pool = ThreadPool(workers)
+        except (OSError, RuntimeError):
+            logger.exception('Could not create thread pool, running '
+                             'serially.')
+    if pool is None:
+        for item in items:
+            yield func(item)
+        return
+
+    try:
+        for start in range(0, len(items), workers):
+            for result in pool.map(func, items[start:start + workers]):
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
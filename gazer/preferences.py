@@ -7,6 +7,9 @@ import appdirs
 logger = logging.getLogger(__name__)
 
 DATA_PATH = appdirs.user_data_dir('Gazer')
+CACHE_PATH = appdirs.user_cache_dir('Gazer')
+# Memory mapped frames of opened gc files, see gazer.file_loading.
+FRAME_CACHE_PATH = os.path.join(CACHE_PATH, 'frames')
 
 logger.info('DATA_PATH={}'.format(DATA_PATH))
 
@@ -25,7 +28,10 @@ def save_preferences(full_path, prefs):
 
 
 def write_default_preferences(full_path):
-    default = {'calibration_path': ''}
+    default = {'calibration_path': '',
+               'frame_cache': False,
+               'interpolator': None,
+               }
     save_preferences(full_path, default)
 
 
@@ -56,3 +62,21 @@ def set_calibration_path(path):
     prefs = load_preferences()
     prefs['calibration_path'] = path
     save_preferences(path_to_settings_file(), prefs)
+
+
+def get_frame_cache_enabled():
+    """
+    Return whether decoded frames of opened gc files are kept in the frame
+    cache. Disabled unless set in the preferences.
+    """
+    prefs = load_preferences()
+    return bool(prefs.get('frame_cache', False))
+
+
+def get_interpolator_name():
+    """
+    Return the name of the interpolator used for displayed scenes, see
+    gazer.modules.dof.interpolator.INTERPOLATORS, or None for the default.
+    """
+    prefs = load_preferences()
+    return prefs.get('interpolator')
@@ -1,29 +1,64 @@
 from __future__ import unicode_literals, division, print_function
 
+import numbers
+
 import numpy as np
 
-from PyQt4.QtCore import QPoint, QSize, Qt, QPointF
+from PyQt4.QtCore import QPoint, QSize, Qt, QPointF, QRectF
 from PyQt4.QtGui import QImage, QPixmap, QPainter, QColor
 from PyQt4.QtOpenGL import QGLWidget
 
 from gazer import eyetracking
+from gazer.lru_cache import LRUCache
+
+# Default byte budget of the scaled pixmaps cached by the fallback path
+# that draws without textures, enough for a few dozen full HD frames.
+DEFAULT_PIXMAP_CACHE_BUDGET = 256 * 1024 ** 2
+# Default byte budget of the frames kept as textures in video memory.
+DEFAULT_TEXTURE_CACHE_BUDGET = 256 * 1024 ** 2
 
 
 class GCImageWidget(QGLWidget):
     """
     Widget that draws gaze contingent scenes based on current gaze position.
     Wraps the UI agnostic Scene object.
+
+    If an OpenGL context is available, frames are uploaded as textures and
+    scaled on the GPU when drawn. The textures of the recently shown frames
+    are kept within a byte budget, so repainting a frame that was shown
+    before only draws its texture. This is the default.
+
+    Drawing pixmaps is only a fallback, used if no OpenGL context could be
+    created or if use_textures is False. Frames are then converted to
+    pixmaps and scaled to the widget size on the CPU. The scaled pixmaps
+    are cached until the widget is resized or the scene changes, so the
+    fallback also repaints a frame that was shown before without converting
+    it again. Only one of the two caches fills up, depending on the path in
+    use.
     """
 
     def __init__(self, gc_scene, *args, **kwargs):
+        self.use_textures = kwargs.pop('use_textures', True)
         super(GCImageWidget, self).__init__(*args, **kwargs)
 
         self.mouse_mode = False
         self.show_cursor = False
         self._show_depthmap = False
 
+        # Maps frame keys to the ids of their uploaded textures.
+        self._textures = LRUCache(DEFAULT_TEXTURE_CACHE_BUDGET,
+                                  on_evict=self._delete_texture)
+        self.pixmap_cache = LRUCache(DEFAULT_PIXMAP_CACHE_BUDGET)
+        # Lookup table array the depth map was last drawn from.
+        self._depthmap_source = None
+
         self._last_sample = None
         self._gaze = None
+        # State of the last paint, to skip repaints that would not change
+        # anything.
+        self._painted_state = None
+        # Set by a RenderScheduler driving this widget.
+        self.render_scheduler = None
 
         self.active_pixmap_size = QSize(0, 0)
 
@@ -38,11 +73,32 @@ class GCImageWidget(QGLWidget):
 
     @gc_scene.setter
     def gc_scene(self, scene):
+        self.release_textures()
+        self.pixmap_cache.clear()
+        self._painted_state = None
+        self._depthmap_source = None
         self._gc_scene = scene
         self.update_gaze(self._last_sample)
+        # A scheduler stops ticking while no scene is shown.
+        if scene is not None and self.render_scheduler is not None and \
+                not self.render_scheduler.running:
+            self.render_scheduler.start()
+
+    def release_textures(self):
+        """
+        Delete the textures uploaded for the frames of the current scene.
+        """
+        if not self._textures:
+            return
+        self.makeCurrent()
+        self._textures.clear()
+
+    def _delete_texture(self, key, texture_id):
+        self.deleteTexture(texture_id)
 
     def toggle_depthmap(self):
         self._show_depthmap = not self._show_depthmap
+        self.update()
 
     def local_to_image_norm_coordinates(self, local_pos):
         """
@@ -88,17 +144,91 @@ class GCImageWidget(QGLWidget):
                                                                local_pos.y()))
         self._gaze = local_pos
         self.gc_scene.update_gaze(tuple(np.clip(image_norm_pos, 0, 1)))
-        self.update()
+        # With a render scheduler, repaints happen on its ticks only.
+        if self.render_scheduler is None:
+            self.request_update()
+
+    def _display_state(self, frame_key):
+        cursor = None
+        if self.show_cursor and self._gaze is not None:
+            cursor = (self._gaze.x(), self._gaze.y())
+        # Frames that can not be identified are assumed to change with the
+        # gaze position only.
+        gaze = None
+        if frame_key is None:
+            gaze = getattr(self.gc_scene, 'gaze_pos', None)
+        return frame_key, cursor, gaze
+
+    def _frame_key(self, key):
+        """
+        Return the key identifying a scene frame in the texture and pixmap
+        caches, or None if the frame can not be identified.
+        """
+        if key is None:
+            return None
+        # Image managers look frames up by the integer part of numeric
+        # keys, so e.g. 2 and 2.0 show the same frame.
+        if isinstance(key, numbers.Real):
+            key = int(key)
+        return id(self.gc_scene), key
 
-    def get_current_image(self):
+    def _depthmap_key(self):
+        """
+        Return the key of the depth map view. The key changes with the
+        lookup table, and textures and pixmaps drawn from a replaced lookup
+        table are released.
+        """
+        lookup_table = getattr(self.gc_scene, 'lookup_table', None)
+        array = getattr(lookup_table, 'array', None)
+        if array is not self._depthmap_source:
+            if self._depthmap_source is not None:
+                self.release_textures()
+                self.pixmap_cache.clear()
+            # Keeping a reference also keeps the id of the array unique.
+            self._depthmap_source = array
+        return id(self.gc_scene), 'depthmap', id(array)
+
+    def peek_frame_key(self):
+        """
+        Return the key of the frame the next paint will show, without
+        changing the scene state, or None if it can not be predicted.
+        """
         if self.gc_scene is None:
             return None
+        if self._show_depthmap:
+            return self._depthmap_key()
+        return self._frame_key(self.gc_scene.peek_frame_key())
+
+    def request_update(self):
+        """
+        Schedule a repaint unless it would show the same frame and overlay
+        as the last one.
+        """
+        frame_key = self.peek_frame_key()
+        if self._display_state(frame_key) != self._painted_state:
+            self.update()
+
+    def get_current_frame(self):
+        """
+        Return the frame to display and a key identifying it.
+
+        Returns
+        -------
+        tuple
+            Key and image. The key is None if the frame can not be
+            identified and both are None if there is no scene.
+        """
+        if self.gc_scene is None:
+            return None, None
 
         if self._show_depthmap:
-            image = self.gc_scene.get_indices_image()
-        else:
-            image = self.gc_scene.get_image()
-        return image
+            image = self.gc_scene.get_indices_image(coloured=True)
+            return self._depthmap_key(), image
+        key, image = self.gc_scene.current_frame()
+        return self._frame_key(key), image
+
+    def get_current_image(self):
+        return self.get_current_frame()[1]
 
     def get_scaled_pixmap(self):
         image = self.get_current_image()
@@ -109,6 +239,63 @@ class GCImageWidget(QGLWidget):
         pixmap = array_to_pixmap(image)
         return pixmap.scaled(self.size(), Qt.KeepAspectRatio)
 
+    def get_texture(self, key, image):
+        """
+        Return the id of the texture holding the frame, uploading it on
+        first use.
+        """
+        texture_id = self._textures.get(key)
+        if texture_id is None:
+            texture_id = self.bindTexture(array_to_qimage(image))
+            # Textures are uploaded with four bytes per pixel.
+            texture_bytes = 4 * image.shape[0] * image.shape[1]
+            self._textures.put(key, texture_id, texture_bytes)
+        return texture_id
+
+    def draw_texture(self, painter, key, image):
+        """
+        Draw the frame as texture scaled to the widget, keeping its aspect
+        ratio. The painter needs to be active on this widget.
+        """
+        texture_id = self.get_texture(key, image)
+        size = QSize(image.shape[1], image.shape[0])
+        size.scale(self.size(), Qt.KeepAspectRatio)
+        self.active_pixmap_size = size
+        # With an active painter the texture is drawn through its paint
+        # engine, in widget coordinates.
+        self.drawTexture(QRectF(0.0, 0.0, size.width(), size.height()),
+                         texture_id)
+
+    def get_pixmap(self, key, image):
+        """
+        Return the frame as pixmap scaled to the widget, keeping its aspect
+        ratio. Pixmaps of identified frames are cached. Only used when
+        frames are not drawn as textures.
+        """
+        size = self.size()
+        cache_key = None
+        if key is not None:
+            cache_key = key + (size.width(), size.height())
+            pixmap = self.pixmap_cache.get(cache_key)
+            if pixmap is not None:
+                return pixmap
+
+        pixmap = array_to_pixmap(image).scaled(size, Qt.KeepAspectRatio)
+        if cache_key is not None:
+            pixmap_bytes = pixmap.width() * pixmap.height() * \
+                max(pixmap.depth() // 8, 1)
+            self.pixmap_cache.put(cache_key, pixmap, pixmap_bytes)
+        return pixmap
+
+    def draw_pixmap(self, painter, key, image):
+        pixmap = self.get_pixmap(key, image)
+        self.active_pixmap_size = pixmap.size()
+        painter.drawPixmap(QPointF(0.0, 0.0), pixmap)
+
+    def resizeEvent(self, event):
+        self.pixmap_cache.clear()
+        super(GCImageWidget, self).resizeEvent(event)
+
     @staticmethod
     def mouse_event_to_gaze_sample(event):
         return eyetracking.api.EyeData(-1,
@@ -125,12 +312,16 @@ class GCImageWidget(QGLWidget):
         painter = QPainter(self)
         painter.setRenderHint(painter.Antialiasing)
 
-        pixmap = self.get_scaled_pixmap()
-        if pixmap is not None:
-            self.active_pixmap_size = pixmap.size()
-            painter.drawPixmap(QPointF(0.0, 0.0), pixmap)
+        key, image = self.get_current_frame()
+        if image is not None:
+            if self.use_textures and key is not None and self.isValid():
+                self.draw_texture(painter, key, image)
+            else:
+                self.draw_pixmap(painter, key, image)
 
         if self.show_cursor:
+            # Label the cursor with the frame that was just drawn.
+            label = '' if key is None else str(key[1])
             size = 20
             painter.setPen(QColor(0, 0, 0))
             x_origin = self._gaze.x() - size / 2
@@ -142,15 +333,38 @@ class GCImageWidget(QGLWidget):
                              y_origin,
                              size, size,
                              Qt.AlignCenter,
-                             str(self.gc_scene.current_index))
+                             label)
         painter.end()
 
+        self._painted_state = self._display_state(key)
+        # Without a render scheduler, keep painting while the scene
+        # transitions between frames, even if no new gaze samples arrive.
+        if self.render_scheduler is None and key is not None:
+            next_key = self.peek_frame_key()
+            if next_key is not None and next_key != key:
+                self.update()
+
     def heightForWidth(self, p_int):
         width = self.self.gc_scene.get_image().size().width()
         height = self.self.gc_scene.get_image().size().height()
         return (p_int / width) * height
 
 
+def array_to_qimage(array):
+    """
+    Return a QImage holding a copy of an RGB image array.
+    """
+    array = np.require(array, dtype=np.int8, requirements=['C'])
+    q_image = QImage(array.data,
+                     array.shape[1],
+                     array.shape[0],
+                     3 * array.shape[1],
+                     QImage.Format_RGB888)
+    # Detach from the buffer of the array, which may be freed before the
+    # image is used.
+    return q_image.copy()
+
+
 def array_to_pixmap(array):
     array = np.require(array, dtype=np.int8, requirements=['C'])
     array.flags.writeable = False
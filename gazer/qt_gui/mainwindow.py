@@ -10,23 +10,41 @@ from PyQt4.QtCore import QDir, Qt, QEvent
 from PyQt4.QtGui import QAction, QFileDialog, QMainWindow, QMenu, \
     QSizePolicy, QErrorMessage
 from PyQt4.QtGui import QActionGroup
+from PyQt4.QtOpenGL import QGLFormat
 
 import gazer
 import gazer.modules.dof.directory_of_images_import as dir_import
 from gazer import gcio
+from gazer.modules.dof import lytro_import
+from gazer.modules.dof.interpolator import make_interpolator
 from gazer.qt_gui.async import BlockingTask
 from gazer.qt_gui.dialogs import PreferencesDialog
 from gazer.qt_gui.gcwidget import GCImageWidget
+from gazer.qt_gui.render_loop import RenderScheduler
 
 logger = logging.getLogger(__name__)
 
-try:
-    from gazer.modules.dof.lytro_import import read_ifp
-except ImportError:
-    logger.exception('Could not import Lytro Power Tools.')
+if lytro_import.lpt_available():
+    read_ifp = lytro_import.read_ifp
+else:
+    logger.warning('Could not import Lytro Power Tools.')
     read_ifp = None
 
 
+def create_interpolator():
+    """
+    Return a new interpolator of the type set in the preferences, or of the
+    default type if the preferences name none or an unknown one.
+    """
+    name = gazer.preferences.get_interpolator_name()
+    try:
+        return make_interpolator(name)
+    except ValueError:
+        logger.warning('Unknown interpolator {}, using the default.'.format(
+            name))
+        return make_interpolator()
+
+
 # noinspection PyCallByClass
 class GazerMainWindow(QMainWindow):
     """
@@ -42,10 +60,16 @@ class GazerMainWindow(QMainWindow):
         self.tracker = None
 
         # Main layout
-        self.render_area = GCImageWidget(None)
+        # Swap buffers in sync with the display refresh.
+        gl_format = QGLFormat()
+        gl_format.setSwapInterval(1)
+        self.render_area = GCImageWidget(None, gl_format)
         self.render_area.setSizePolicy(QSizePolicy.Ignored,
                                        QSizePolicy.Ignored)
         self.setCentralWidget(self.render_area)
+        self.render_scheduler = RenderScheduler(self.render_area,
+                                                parent=self)
+        self.render_scheduler.start()
 
         # Create actions
         self.open_action = QAction("&Open...",
@@ -197,6 +221,8 @@ class GazerMainWindow(QMainWindow):
         self.update()
 
     def update_scene(self, scene):
+        if hasattr(scene, 'interpolator'):
+            scene.interpolator = create_interpolator()
         self.render_area.gc_scene = scene
         self.render_area.update()
 
@@ -222,7 +248,9 @@ class GazerMainWindow(QMainWindow):
             Path to file that will be loaded.
         """
 
-        scene_load_func = partial(gcio.load_scene, str(path))
+        frame_cache = gazer.preferences.get_frame_cache_enabled()
+        loaders = gcio.create_default_file_format_loaders(frame_cache)
+        scene_load_func = partial(gcio.load_scene, str(path), loaders)
         loader = BlockingTask(scene_load_func,
                               'Loading file.',
                               parent=self)
@@ -236,10 +264,10 @@ class GazerMainWindow(QMainWindow):
                                                 filter="GC File (*.gc)",
                                                 )
         if file_name:
+            scene = self.render_area.gc_scene
+
             def task():
-                with open(file_name, 'wb') as out_file:
-                    scene = self.render_area.gc_scene
-                    gcio.write_file(out_file, scene)
+                gcio.save_scene(str(file_name), scene)
 
             loader = BlockingTask(task,
                                   'Saving file.',
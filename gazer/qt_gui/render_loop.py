@@ -0,0 +1,81 @@
+from __future__ import unicode_literals, division, print_function
+
+import logging
+
+from PyQt4.QtCore import QElapsedTimer, QObject, QTimer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FRAME_RATE = 60
+
+
+class RenderScheduler(QObject):
+    """
+    Drives a GCImageWidget at a fixed rate: on every timer tick the scene is
+    advanced by the real time passed since the previous tick and the widget
+    is repainted if the displayed frame changed. The timer stops while the
+    widget shows no scene and is started again when a scene is set.
+
+    While the scheduler runs, gaze samples only update the target frame and
+    reading the current frame does not advance the scene, so transitions
+    take the same time regardless of the paint or sample rate. For paints
+    aligned to the display refresh, create the widget with a QGLFormat with
+    a swap interval of 1.
+    """
+
+    def __init__(self, widget, frame_rate=DEFAULT_FRAME_RATE, parent=None):
+        """
+        Parameters
+        ----------
+        widget : GCImageWidget
+            Widget whose scene is advanced and repainted.
+        frame_rate : float
+            Number of ticks per second.
+        parent : QObject
+        """
+        super(RenderScheduler, self).__init__(parent)
+        self.widget = widget
+        self.timer = QTimer(self)
+        self.timer.setInterval(int(round(1000 / frame_rate)))
+        self.timer.timeout.connect(self.tick)
+        self._clock = QElapsedTimer()
+        self._scene = None
+
+    @property
+    def running(self):
+        return self.timer.isActive()
+
+    def start(self):
+        self.widget.render_scheduler = self
+        self._clock.start()
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+        self._attach_scene(None)
+        if self.widget.render_scheduler is self:
+            self.widget.render_scheduler = None
+
+    def _attach_scene(self, scene):
+        if scene is self._scene:
+            return
+        # Scenes not driven by the scheduler go back to advancing on read.
+        if hasattr(self._scene, 'step_on_read'):
+            self._scene.step_on_read = True
+        if hasattr(scene, 'step_on_read'):
+            scene.step_on_read = False
+        self._scene = scene
+
+    def tick(self):
+        """
+        Advance the scene of the widget and request a repaint. Stops the
+        timer if the widget shows no scene.
+        """
+        delta_time = self._clock.restart() / 1000
+        scene = self.widget.gc_scene
+        self._attach_scene(scene)
+        if scene is None:
+            self.timer.stop()
+        else:
+            scene.tick(delta_time)
+        self.widget.request_update()
@@ -35,6 +35,30 @@ class Scene(object):
         """
         pass
 
+    def current_frame(self):
+        """
+        Return the frame for the current state together with a key that
+        identifies it, so renderers can reuse work done for the same frame.
+
+        Returns
+        -------
+        tuple
+            Key and frame. The key is None if frames can not be told apart.
+        """
+        return None, self.get_image()
+
+    def peek_frame_key(self):
+        """
+        Return the key of the frame the next call of current_frame will
+        return, without changing the scene state.
+
+        Returns
+        -------
+        object
+            Frame key or None if it can not be predicted.
+        """
+        return None
+
     @abstractmethod
     def get_image(self):
         """
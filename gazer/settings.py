@@ -1,8 +1,12 @@
 from __future__ import unicode_literals, division, print_function
 from gazer.modules.dof.scenes import SimpleArrayStackDecoder, \
     ImageStackScene, \
-    SimpleArrayStackEncoder
+    BinaryArrayStackDecoder, \
+    BinaryArrayStackEncoder
 
-DECODERS = {ImageStackScene.scene_type: SimpleArrayStackDecoder()}
+DECODERS = {
+    SimpleArrayStackDecoder.scene_type: SimpleArrayStackDecoder(lazy=True),
+    BinaryArrayStackDecoder.scene_type: BinaryArrayStackDecoder(lazy=True),
+}
 
-ENCODERS = {ImageStackScene.scene_type: SimpleArrayStackEncoder()}
+ENCODERS = {ImageStackScene.scene_type: BinaryArrayStackEncoder()}
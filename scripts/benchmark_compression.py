@@ -0,0 +1,92 @@
+"""
+Compare the available compression codecs for gc files.
+
+Reports the compression ratio and the time needed to write and load the
+scenes bundled in tests/data with every available codec and file version.
+"""
+from __future__ import print_function, division, unicode_literals
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from gazer.compression import available_compressions  # NOQA
+from gazer.file_loading import read_gcfile  # NOQA
+from gazer.gcio import write_file  # NOQA
+from gazer.modules.dof.directory_of_images_import import dir_to_scene  # NOQA
+
+TEST_DATA_FOLDER = os.path.join(project_root, 'tests', 'data')
+
+
+def load_test_scenes():
+    return {
+        'example.gc': read_gcfile(os.path.join(TEST_DATA_FOLDER,
+                                               'example.gc')),
+        'example_stack': dir_to_scene(os.path.join(TEST_DATA_FOLDER,
+                                                   'example_stack')),
+    }
+
+
+def time_call(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def benchmark_scene(name, scene, out_dir, repeat):
+    rows = []
+    for version in ['0.1', '2.0']:
+        reference_size = None
+        for codec in ['none'] + [c for c in available_compressions()
+                                 if c != 'none']:
+            path = os.path.join(out_dir, '{}_{}.gc'.format(version, codec))
+
+            def write():
+                with open(path, 'wb') as out_file:
+                    write_file(out_file, scene, version, codec)
+
+            def load():
+                loaded = read_gcfile(path)
+                for __ in loaded.iter_images:
+                    pass
+
+            write_time = time_call(write, repeat)
+            load_time = time_call(load, repeat)
+            size = os.path.getsize(path)
+            if reference_size is None:
+                reference_size = size
+            rows.append((name, version, codec, size, reference_size / size,
+                         write_time, load_time))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of repetitions per measurement')
+    args = parser.parse_args()
+
+    header = ('scene', 'version', 'codec', 'bytes', 'ratio',
+              'write [s]', 'load [s]')
+    row_format = '{:<14} {:>7} {:>6} {:>10} {:>6} {:>10} {:>10}'
+    print(row_format.format(*header))
+
+    out_dir = tempfile.mkdtemp()
+    try:
+        for name, scene in sorted(load_test_scenes().items()):
+            for row in benchmark_scene(name, scene, out_dir, args.repeat):
+                scene_name, version, codec, size, ratio, write, load = row
+                print(row_format.format(scene_name, version, codec, size,
+                                        '{:.3f}'.format(ratio),
+                                        '{:.4f}'.format(write),
+                                        '{:.4f}'.format(load)))
+    finally:
+        shutil.rmtree(out_dir)
+
+
+if __name__ == '__main__':
+    main()
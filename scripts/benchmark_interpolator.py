@@ -0,0 +1,94 @@
+"""
+Measure the interpolators used for transitions between frames.
+
+Reports the time of a single make_step and advance call and how long a
+transition over a given distance takes at different tick rates. The step
+interpolators move per step, so their transition time depends on
+steps_per_second, while the time interpolators move by the time passed.
+"""
+from __future__ import print_function, division, unicode_literals
+
+import argparse
+import os
+import sys
+import timeit
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from gazer.modules.dof.interpolator import ExponentialInterpolator, \
+    LinearInterpolator, LinearTimeInterpolator, SplineInterpolator, \
+    SpringInterpolator  # NOQA
+
+INTERPOLATORS = [
+    ('linear', LinearInterpolator),
+    ('exponential', ExponentialInterpolator),
+    ('linear-time', LinearTimeInterpolator),
+    ('spring', SpringInterpolator),
+    ('spline', SplineInterpolator),
+]
+
+TICK_RATES = [30, 60, 144]
+
+
+def call_time(interpolator_class, method, distance, number):
+    """
+    Return the mean time of a call in seconds, with a target that moves
+    back and forth so the interpolator never comes to rest.
+    """
+    interpolator = interpolator_class(0, distance)
+    step = getattr(interpolator, method)
+    args = (1 / 60,) if method == 'advance' else ()
+
+    def run():
+        for num in range(number):
+            if num % 20 == 0:
+                interpolator.target = distance - interpolator.target
+            step(*args)
+
+    return min(timeit.repeat(run, number=1, repeat=3)) / number
+
+
+def transition_time(interpolator_class, distance, tick_rate):
+    """
+    Return the time in seconds until the displayed frame reaches the
+    target, or None if it does not within ten seconds.
+    """
+    interpolator = interpolator_class(0, distance)
+    delta_time = 1 / tick_rate
+    for tick in range(1, 10 * tick_rate + 1):
+        if interpolator.advance(delta_time) == distance:
+            return tick * delta_time
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--calls', type=int, default=100000,
+                        help='number of calls timed per interpolator')
+    parser.add_argument('-d', '--distance', type=int, default=20,
+                        help='number of frames of the transition')
+    args = parser.parse_args()
+
+    header = '{:<12} {:>10} {:>12}'.format('interpolator', 'step [us]',
+                                           'advance [us]')
+    header += ''.join(' {:>9}'.format('{} Hz [s]'.format(rate))
+                      for rate in TICK_RATES)
+    print(header)
+    for name, interpolator_class in INTERPOLATORS:
+        row = '{:<12} {:>10.3f} {:>12.3f}'.format(
+            name,
+            1e6 * call_time(interpolator_class, 'make_step', args.distance,
+                            args.calls),
+            1e6 * call_time(interpolator_class, 'advance', args.distance,
+                            args.calls))
+        for rate in TICK_RATES:
+            duration = transition_time(interpolator_class, args.distance,
+                                       rate)
+            row += ' {:>9}'.format('-' if duration is None
+                                   else '{:.3f}'.format(duration))
+        print(row)
+
+
+if __name__ == '__main__':
+    main()
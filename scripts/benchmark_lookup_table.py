@@ -0,0 +1,70 @@
+"""
+Measure the time needed to sample gaze positions from an ArrayLookupTable.
+
+Compares the precomputed index grid with sampling the lookup table array
+directly, as done before the grid was introduced.
+"""
+from __future__ import print_function, division, unicode_literals
+
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from gazer.modules.dof.lookup_table import ArrayLookupTable  # NOQA
+
+
+def sample_array(array, pos):
+    try:
+        x = array.shape[0]
+        y = array.shape[1]
+        if x == 1 or y == 1:
+            return None
+        return np.average(array[int(x * pos[1]), int(y * pos[0])])
+    except IndexError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--samples', type=int, default=100000,
+                        help='number of gaze positions sampled')
+    args = parser.parse_args()
+
+    random_state = np.random.RandomState(0)
+    positions = [tuple(pos) for pos in random_state.rand(args.samples, 2)]
+    depth = random_state.randint(0, 64, size=(1080, 1920))
+    arrays = {
+        'gray': depth,
+        'rgb': np.dstack([depth] * 3).astype(np.uint8),
+    }
+
+    row_format = '{:<6} {:>14} {:>14} {:>8}'
+    print(row_format.format('array', 'direct [us]', 'grid [us]', 'speedup'))
+    for name, array in sorted(arrays.items()):
+        lut = ArrayLookupTable(array)
+
+        def direct():
+            for pos in positions:
+                sample_array(array, pos)
+
+        def grid():
+            for pos in positions:
+                lut.sample_position(pos)
+
+        direct_time = min(timeit.repeat(direct, number=1, repeat=3))
+        grid_time = min(timeit.repeat(grid, number=1, repeat=3))
+        print(row_format.format(
+            name,
+            '{:.3f}'.format(1e6 * direct_time / args.samples),
+            '{:.3f}'.format(1e6 * grid_time / args.samples),
+            '{:.1f}x'.format(direct_time / grid_time)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+"""
+Convert a directory or glob of Lytro raw files to gc files without the GUI.
+
+Interrupted batches can be resumed by running the same command again.
+See gazer.modules.dof.lytro_batch for details.
+"""
+from __future__ import print_function, division, unicode_literals
+
+import os
+import sys
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from gazer.modules.dof.lytro_batch import main  # NOQA
+
+if __name__ == '__main__':
+    sys.exit(main())
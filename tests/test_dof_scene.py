@@ -4,15 +4,23 @@ Defines unit tests for :mod:`gcviewer.modules.dof.scenes` module.
 
 from __future__ import division, unicode_literals, print_function
 
-import numpy as np
-
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
 
 from gazer.modules.dof.dof_data import DOFData
-from gazer.modules.dof.image_manager import ArrayStackImageManager
-from gazer.modules.dof.interpolator import InstantInterpolator
+from gazer.modules.dof.image_manager import ArrayStackImageManager, \
+    MemmapImageManager, LazyImageManager
+from gazer.modules.dof.interpolator import InstantInterpolator, \
+    LinearInterpolator, LinearTimeInterpolator, SpringInterpolator
 from gazer.modules.dof.lookup_table import ArrayLookupTable
-from gazer.modules.dof.scenes import ImageStackScene
+from gazer.modules.dof.scenes import ImageStackScene, DEPTH_COLOUR_MAP
 
 
 class TestBasicDOFScene(unittest.TestCase):
@@ -31,6 +39,40 @@ class TestBasicDOFScene(unittest.TestCase):
         self.scene.update_gaze((1, 1))
 
 
+class TestIndicesImage(unittest.TestCase):
+    def setUp(self):
+        self.depth_array = np.array([[0, 3], [2, 1]])
+        frames = [np.ones([2, 2]) * i for i in range(4)]
+        self.scene = ImageStackScene(ArrayStackImageManager(frames),
+                                     ArrayLookupTable(self.depth_array))
+
+    def test_normalised(self):
+        image = self.scene.get_indices_image()
+        self.assertEqual(image.dtype, np.uint8)
+        np.testing.assert_array_equal(image, [[0, 255], [170, 85]])
+
+    def test_cached(self):
+        image = self.scene.get_indices_image()
+        self.assertIs(self.scene.get_indices_image(), image)
+        self.assertFalse(image.flags.writeable)
+
+    def test_invalidated(self):
+        image = self.scene.get_indices_image()
+        self.scene.lookup_table = ArrayLookupTable(self.depth_array.T)
+        np.testing.assert_array_equal(self.scene.get_indices_image(),
+                                      image.T)
+        self.scene.lookup_table.array = np.zeros([2, 2])
+        np.testing.assert_array_equal(self.scene.get_indices_image(), 0)
+
+    def test_coloured(self):
+        image = self.scene.get_indices_image(coloured=True)
+        self.assertEqual(image.shape, (2, 2, 3))
+        self.assertEqual(image.dtype, np.uint8)
+        np.testing.assert_array_equal(image[0, 0], DEPTH_COLOUR_MAP[0])
+        np.testing.assert_array_equal(image[0, 1], DEPTH_COLOUR_MAP[255])
+        self.assertIs(self.scene.get_indices_image(coloured=True), image)
+
+
 class TestImageStackScene(unittest.TestCase):
     def setUp(self):
         self.depth_array = np.array([
@@ -65,6 +107,67 @@ class TestImageStackScene(unittest.TestCase):
                                        self.scene.get_image(),
                                        err_msg="Assert four has failed")
 
+    def test_peek_frame_key(self):
+        self.assertIsNone(self.scene.peek_frame_key())
+        scene = ImageStackScene(self.scene.image_manager,
+                                self.scene.lookup_table,
+                                LinearInterpolator())
+        scene.update_gaze((0.9, 0.0))
+        for expected in [1, 2, 3, 3]:
+            self.assertEqual(scene.peek_frame_key(), expected)
+            self.assertEqual(scene.peek_frame_key(), expected)
+            self.assertEqual(scene.current_frame()[0], expected)
+
+    def test_tick(self):
+        scene = ImageStackScene(self.scene.image_manager,
+                                self.scene.lookup_table,
+                                LinearInterpolator())
+        scene.step_on_read = False
+        scene.update_gaze((0.9, 0.0))
+        self.assertEqual(scene.current_index, 0)
+        self.assertEqual(scene.current_index, 0)
+        self.assertEqual(scene.peek_frame_key(), 0)
+
+        scene.tick(2.5 / LinearInterpolator.steps_per_second)
+        self.assertEqual(scene.current_index, 2)
+        self.assertEqual(scene.peek_frame_key(), 2)
+        scene.tick(0.5 / LinearInterpolator.steps_per_second)
+        self.assertEqual(scene.current_frame()[0], 3)
+
+    def test_tick_time_interpolator(self):
+        scene = ImageStackScene(self.scene.image_manager,
+                                self.scene.lookup_table,
+                                LinearTimeInterpolator(speed=10))
+        scene.step_on_read = False
+        scene.update_gaze((0.9, 0.0))
+        scene.tick(0.16)
+        # The interpolator is at 1.6, the nearest frame is shown.
+        self.assertEqual(scene.current_index, 2)
+        self.assertEqual(scene.peek_frame_key(), 2)
+        key, image = scene.current_frame()
+        np.testing.assert_almost_equal(self.frame_mapping[2], image)
+
+    def test_current_frame(self):
+        self.scene.update_gaze((0.9, 0.0))
+        key, image = self.scene.current_frame()
+        self.assertEqual(key, 3)
+        np.testing.assert_almost_equal(self.frame_mapping[3], image)
+
+    def test_default_interpolator_per_scene(self):
+        dof_data = DOFData(self.depth_array, self.frame_mapping)
+        scene = ImageStackScene.from_dof_data(dof_data)
+        other_scene = ImageStackScene(self.scene.image_manager,
+                                      self.scene.lookup_table)
+        self.assertIsInstance(scene.interpolator, SpringInterpolator)
+        self.assertIsNot(scene.interpolator, other_scene.interpolator)
+
+        # Moving one scene does not move the other.
+        scene.step_on_read = False
+        scene.update_gaze((0.9, 0.0))
+        scene.tick(1)
+        self.assertEqual(scene.current_index, 3)
+        self.assertEqual(other_scene.interpolator.current_value, 0)
+
 
 class TestImageStackManager(unittest.TestCase):
     def setUp(self):
@@ -85,6 +188,146 @@ class TestImageStackManager(unittest.TestCase):
                                        self.frames[1])
 
 
+class TestMemmapImageManager(unittest.TestCase):
+    def setUp(self):
+        self.frames = [np.full([4, 5, 3], i, np.uint8) for i in range(4)]
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_load_image(self):
+        image_manager = MemmapImageManager.from_arrays(self.frames)
+        np.testing.assert_equal(image_manager.load_image(2), self.frames[2])
+        np.testing.assert_equal(image_manager.load_image(1.7),
+                                self.frames[1])
+        self.assertIsNone(image_manager.load_image(4))
+
+    def test_read_only_views(self):
+        image_manager = MemmapImageManager.from_arrays(self.frames)
+        frame_a = image_manager.load_array(1)
+        frame_b = image_manager.load_array(1)
+        self.assertFalse(frame_a.flags.writeable)
+        self.assertTrue(np.may_share_memory(frame_a, frame_b))
+
+    def test_cache_file(self):
+        cache_path = os.path.join(self.tmp_dir, 'frames.npy')
+        MemmapImageManager.from_arrays(self.frames, cache_path)
+        image_manager = MemmapImageManager.from_cache_file(cache_path)
+        self.assertEqual(list(image_manager.keys), [0, 1, 2, 3])
+        np.testing.assert_equal(image_manager.load_array(3), self.frames[3])
+        self.assertFalse(image_manager.load_array(3).flags.writeable)
+
+    def test_mismatched_shapes(self):
+        frames = self.frames + [np.zeros([2, 2, 3], np.uint8)]
+        self.assertRaises(ValueError, MemmapImageManager.from_arrays, frames)
+
+    def test_frames_streamed(self):
+        cache_path = os.path.join(self.tmp_dir, 'frames.npy')
+        image_manager = MemmapImageManager.from_frames(iter(self.frames), 4,
+                                                       cache_path)
+        np.testing.assert_equal(image_manager.load_array(2), self.frames[2])
+
+    def test_frame_count_mismatch(self):
+        cache_path = os.path.join(self.tmp_dir, 'frames.npy')
+        for count in [3, 5]:
+            self.assertRaises(ValueError, MemmapImageManager.from_frames,
+                              iter(self.frames), count, cache_path)
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+
+class TestLazyImageManager(unittest.TestCase):
+    def setUp(self):
+        self.decoded = []
+
+        def decode(value):
+            self.decoded.append(value)
+            return np.full([10, 10], value, np.uint8)
+
+        self.image_manager = LazyImageManager(range(5), decode,
+                                              cache_budget=250)
+
+    def test_decode_on_demand(self):
+        self.assertEqual(self.decoded, [])
+        np.testing.assert_equal(self.image_manager.load_image(2), 2)
+        np.testing.assert_equal(self.image_manager.load_image(2.4), 2)
+        np.testing.assert_equal(self.image_manager.load_image(-1), 4)
+        self.assertEqual(self.decoded, [2, 4])
+        self.assertIsNone(self.image_manager.load_image(5))
+
+    def test_lru_budget(self):
+        self.image_manager.preload([0, 1])
+        self.image_manager.load_image(0)
+        self.image_manager.preload([2])
+        self.assertEqual(self.image_manager.cache_size, 200)
+        self.assertTrue(self.image_manager.is_cached(0))
+        self.assertFalse(self.image_manager.is_cached(1))
+        self.assertTrue(self.image_manager.is_cached(2))
+
+    def test_iter_images_on_threads(self):
+        threads = set()
+
+        def decode(value):
+            threads.add(threading.current_thread().name)
+            time.sleep(0.01)
+            return np.full([10, 10], value, np.uint8)
+
+        image_manager = LazyImageManager(range(8), decode, workers=4)
+        self.assertEqual([frame[0, 0] for frame in image_manager.iter_images],
+                         list(range(8)))
+        self.assertGreater(len(threads), 1)
+
+    def test_pinned_frame_kept(self):
+        self.image_manager.load_image(0)
+        self.image_manager.pin(0)
+        self.image_manager.preload([1, 2, 3])
+        self.assertTrue(self.image_manager.is_cached(0))
+        self.assertTrue(self.image_manager.is_cached(3))
+        self.assertEqual(self.image_manager.cache_size, 200)
+
+
+class TestFramePrefetcher(unittest.TestCase):
+    def setUp(self):
+        self.pool = ThreadPool(2)
+        self.depth_array = np.array([
+            [0, 0, 2, 2, 9, 9],
+        ])
+        lut = ArrayLookupTable(self.depth_array.repeat(2, axis=0))
+        image_manager = LazyImageManager(range(10), np.array)
+        self.scene = ImageStackScene(image_manager, lut,
+                                     LinearInterpolator())
+        self.scene.enable_prefetch(self.pool)
+
+    def tearDown(self):
+        self.pool.terminate()
+
+    def test_prefetch_path_to_target(self):
+        self.scene.update_gaze((0.5, 0.5))
+        self.assertEqual(self.scene.current_index, 1)
+        self.scene.prefetcher.wait()
+        image_manager = self.scene.image_manager
+        for key in [1, 2, 3]:
+            self.assertTrue(image_manager.is_cached(key))
+        self.assertFalse(image_manager.is_cached(6))
+
+    def test_displayed_frame_kept(self):
+        image_manager = self.scene.image_manager
+        image_manager.cache_budget = 3 * image_manager.load_image(0).nbytes
+        self.scene.update_gaze((0.9, 0.5))
+        self.assertEqual(self.scene.current_index, 1)
+        self.assertEqual(self.scene.current_index, 2)
+        self.scene.prefetcher.wait()
+        self.assertTrue(image_manager.is_cached(2))
+
+    def test_predict_keys_from_motion(self):
+        prefetcher = self.scene.prefetcher
+        prefetcher.update_gaze((0.1, 0.5))
+        prefetcher.update_gaze((0.3, 0.5))
+        self.assertAlmostEqual(prefetcher.predict_gaze()[0], 0.9)
+        self.assertEqual(prefetcher.predict_keys(0, 0),
+                         [0, 1, 2, 3, 4, 5, 6, 7, 8, 9])
+
+
 class TestLookupTable(unittest.TestCase):
     def setUp(self):
         self.depth_array = np.array([
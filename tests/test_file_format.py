@@ -1,16 +1,32 @@
 from __future__ import division, unicode_literals, print_function
 
+import base64
+import io
 import os
 import shutil
 import tempfile
 import unittest
+import weakref
 
+import mock
 import numpy as np
+from bson import BSON
+from scipy import misc
 
-from gazer.gcio import write_file
-from gazer.file_loading import read_gcfile
+from gazer.compression import available_compressions, compress, \
+    decompress
+from gazer.container import ContainerReader, ContainerWriter, is_container
+from gazer.gcio import DataDecoder, DataEncoder, array_to_bytes, \
+    bytes_to_array, create_default_file_format_loaders, load_scene, \
+    write_file, save_scene, _replace_file
+from gazer.file_loading import read_gcfile, frame_cache_path, \
+    write_frame_cache
+from gazer.modules.dof.image_manager import MemmapImageManager
 from gazer.modules.dof.directory_of_images_import import dir_to_scene
-from gazer.modules.dof.scenes import SimpleArrayStackEncoder
+from gazer.modules.dof.scenes import SimpleArrayStackEncoder, \
+    SimpleArrayStackDecoder, BinaryArrayStackEncoder, \
+    BinaryArrayStackDecoder, frame_entry_name
+from gazer.parallel import parallel_iter, parallel_map
 
 TEST_DATA_FOLDER = os.path.join(os.path.dirname(__file__), 'data/')
 IMAGE_STACK_FOLDER = os.path.join(TEST_DATA_FOLDER, 'example_stack')
@@ -29,12 +45,62 @@ class TestFileFormatIO(unittest.TestCase):
         scene = read_gcfile(EXAMPLE_GC_FILE_PATH)
         self.assertIsNotNone(scene)
 
+    def assert_frames_equal(self, scene, other):
+        self.assertEqual(list(scene.image_manager.keys),
+                         list(other.image_manager.keys))
+        for key in scene.image_manager.keys:
+            np.testing.assert_array_equal(scene.image_manager.load_array(key),
+                                          other.image_manager.load_array(key))
+
+    def test_binary_round_trip(self):
+        encoder = BinaryArrayStackEncoder(frame_codec='raw')
+        data = encoder.data_from_scene(self.scene)
+        scene = BinaryArrayStackDecoder().scene_from_data(data)
+        np.testing.assert_array_equal(self.scene.lookup_table.array,
+                                      scene.lookup_table.array)
+        self.assert_frames_equal(self.scene, scene)
+
+    def test_binary_matches_base64(self):
+        # JPEG frames are lossy, but storing them as binary instead of
+        # base64 must not change them.
+        simple_data = SimpleArrayStackEncoder().data_from_scene(self.scene)
+        binary_data = BinaryArrayStackEncoder().data_from_scene(self.scene)
+        simple_scene = SimpleArrayStackDecoder().scene_from_data(simple_data)
+        binary_scene = BinaryArrayStackDecoder().scene_from_data(binary_data)
+        self.assert_frames_equal(simple_scene, binary_scene)
+
+    def test_binary_smaller(self):
+        simple_data = SimpleArrayStackEncoder().data_from_scene(self.scene)
+        binary_data = BinaryArrayStackEncoder().data_from_scene(self.scene)
+        self.assertLess(len(binary_data), 0.8 * len(simple_data))
+
+    def test_legacy_load(self):
+        with open(EXAMPLE_GC_FILE_PATH, 'rb') as in_file:
+            contents = in_file.read()
+        wrapper = BSON(contents).decode()
+        self.assertEqual(wrapper['type'], SimpleArrayStackDecoder.scene_type)
+
+        scene = read_gcfile(EXAMPLE_GC_FILE_PATH)
+        np.testing.assert_array_equal(scene.lookup_table.array,
+                                      self.scene.lookup_table.array)
+        # Frames are stored as base64 JPEG in entries named by their key.
+        frames = BSON(wrapper['data']).decode()['frames']
+        self.assertEqual(list(scene.image_manager.keys),
+                         list(range(len(frames))))
+        for key in scene.image_manager.keys:
+            expected = misc.imread(io.BytesIO(
+                base64.b64decode(frames[str(key)])))
+            np.testing.assert_array_equal(scene.image_manager.load_array(key),
+                                          expected)
+            self.assertEqual(expected.shape,
+                             self.scene.image_manager.load_array(key).shape)
+
 
 class TestFileFormatIntegrity(unittest.TestCase):
     def setUp(self):
         self.reference_scene = dir_to_scene(IMAGE_STACK_FOLDER)
         self.tmp_dir = tempfile.mkdtemp()
-        self.test_scene_path = EXAMPLE_GC_FILE_PATH
+        self.test_scene_path = os.path.join(self.tmp_dir, 'example.gc')
         with open(self.test_scene_path, 'wb') as tmp_file:
             write_file(tmp_file, self.reference_scene)
         self.test_scene = read_gcfile(self.test_scene_path)
@@ -50,3 +116,377 @@ class TestFileFormatIntegrity(unittest.TestCase):
         np.testing.assert_allclose(self.reference_scene.get_indices_image(),
                                    self.test_scene.get_indices_image()
                                    )
+
+
+class TestContainerFormat(unittest.TestCase):
+    def setUp(self):
+        self.reference_scene = dir_to_scene(IMAGE_STACK_FOLDER)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.test_scene_path = os.path.join(self.tmp_dir, 'example_v2.gc')
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        with open(self.test_scene_path, 'wb') as tmp_file:
+            write_file(tmp_file, self.reference_scene, version='2.0')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_frame_cache(self):
+        scene = read_gcfile(self.test_scene_path, frame_cache=True,
+                            cache_dir=self.cache_dir)
+        self.assertTrue(os.path.exists(
+            frame_cache_path(self.test_scene_path, self.cache_dir)))
+        # Nothing is written next to the gc file.
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)),
+                         ['cache', 'example_v2.gc'])
+        cached_scene = read_gcfile(self.test_scene_path, frame_cache=True,
+                                   cache_dir=self.cache_dir)
+        self.assertIsInstance(cached_scene.image_manager, MemmapImageManager)
+        self.assertIsNone(cached_scene.prefetcher)
+        for key in scene.image_manager.keys:
+            np.testing.assert_equal(scene.image_manager.load_array(key),
+                                    cached_scene.image_manager.load_array(key))
+
+    def test_frame_cache_disabled_by_default(self):
+        with mock.patch('gazer.preferences.FRAME_CACHE_PATH',
+                        self.cache_dir):
+            load_scene(self.test_scene_path)
+            scene = load_scene(self.test_scene_path)
+        self.assertFalse(os.path.exists(self.cache_dir))
+        self.assertNotIsInstance(scene.image_manager, MemmapImageManager)
+
+    def test_frame_cache_used_by_load_scene(self):
+        loaders = create_default_file_format_loaders(frame_cache=True)
+        with mock.patch('gazer.preferences.FRAME_CACHE_PATH',
+                        self.cache_dir):
+            load_scene(self.test_scene_path, loaders)
+            self.assertTrue(os.path.exists(
+                frame_cache_path(self.test_scene_path)))
+            scene = load_scene(self.test_scene_path, loaders)
+        self.assertIsInstance(scene.image_manager, MemmapImageManager)
+
+    def test_frame_cache_outdated(self):
+        read_gcfile(self.test_scene_path, frame_cache=True,
+                    cache_dir=self.cache_dir)
+        mtime = os.path.getmtime(self.test_scene_path)
+        # Rewrite the file within the same second, with fewer frames.
+        frames = list(self.reference_scene.iter_images)[:2]
+        self.reference_scene.image_manager = MemmapImageManager.from_arrays(
+            frames)
+        with open(self.test_scene_path, 'wb') as tmp_file:
+            write_file(tmp_file, self.reference_scene, version='2.0')
+        os.utime(self.test_scene_path, (mtime, mtime))
+
+        scene = read_gcfile(self.test_scene_path, frame_cache=True,
+                            cache_dir=self.cache_dir)
+        self.assertEqual(len(scene.image_manager.keys), 2)
+        cached_scene = read_gcfile(self.test_scene_path, frame_cache=True,
+                                   cache_dir=self.cache_dir)
+        self.assertIsInstance(cached_scene.image_manager, MemmapImageManager)
+        self.assertEqual(len(cached_scene.image_manager.keys), 2)
+
+    def test_is_container(self):
+        with open(self.test_scene_path, 'rb') as in_file:
+            self.assertTrue(is_container(in_file))
+            self.assertEqual(in_file.tell(), 0)
+        with open(EXAMPLE_GC_FILE_PATH, 'rb') as in_file:
+            self.assertFalse(is_container(in_file))
+
+    def test_round_trip(self):
+        test_scene = read_gcfile(self.test_scene_path)
+        np.testing.assert_allclose(self.reference_scene.lookup_table.array,
+                                   test_scene.lookup_table.array)
+        self.assertEqual(len(self.reference_scene.image_manager.keys),
+                         len(test_scene.image_manager.keys))
+
+    def test_random_access(self):
+        with open(self.test_scene_path, 'rb') as in_file:
+            reader = ContainerReader(in_file)
+            last_key = reader.meta['frame_count'] - 1
+            data = reader.read_entry(frame_entry_name(last_key))
+            self.assertTrue(data.startswith(b'\xff\xd8'))  # JPEG marker
+
+    def test_default_container_layout(self):
+        class BodyEncoder(DataEncoder):
+            data_from_scene = BinaryArrayStackEncoder().data_from_scene
+
+        class BodyDecoder(DataDecoder):
+            scene_from_data = BinaryArrayStackDecoder().scene_from_data
+
+        stream = io.BytesIO()
+        write_file(stream, self.reference_scene, version='2.0',
+                   encoder=BodyEncoder())
+        stream.seek(0)
+        reader = ContainerReader(stream)
+        self.assertEqual(reader.entry_names, ['data'])
+        scene = BodyDecoder().scene_from_container(reader)
+        np.testing.assert_allclose(self.reference_scene.lookup_table.array,
+                                   scene.lookup_table.array)
+
+    def test_entries(self):
+        stream = io.BytesIO()
+        with ContainerWriter(stream, 'test', {'answer': 42}) as writer:
+            writer.add_entry('a', b'foo')
+            writer.add_entry('b', b'')
+            writer.add_entry('c', b'bar' * 100)
+        stream.seek(0)
+        reader = ContainerReader(stream)
+        self.assertEqual(reader.scene_type, 'test')
+        self.assertEqual(reader.meta['answer'], 42)
+        self.assertEqual(reader.read_entry('c'), b'bar' * 100)
+        self.assertEqual(reader.read_entry('a'), b'foo')
+        self.assertEqual(reader.read_entry('b'), b'')
+        self.assertRaises(KeyError, reader.read_entry, 'd')
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.reference_scene = dir_to_scene(IMAGE_STACK_FOLDER)
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_codecs(self):
+        data = b'gazer' * 1000
+        for name in available_compressions():
+            self.assertEqual(decompress(compress(data, name), name), data)
+
+    def test_unknown_codec(self):
+        with io.BytesIO() as out_file:
+            self.assertRaises(ValueError, write_file, out_file,
+                              self.reference_scene, compression='foo')
+
+    def test_round_trip(self):
+        for version in ['0.1', '2.0']:
+            for name in available_compressions():
+                path = os.path.join(self.tmp_dir,
+                                    '{}_{}.gc'.format(version, name))
+                with open(path, 'wb') as out_file:
+                    write_file(out_file, self.reference_scene,
+                               version=version, compression=name)
+                scene = read_gcfile(path)
+                np.testing.assert_allclose(
+                    self.reference_scene.lookup_table.array,
+                    scene.lookup_table.array)
+
+    def test_unseekable_stream(self):
+        class UnseekableStream(io.BytesIO):
+            def tell(self):
+                raise IOError('Not seekable.')
+
+        seekable = io.BytesIO()
+        unseekable = UnseekableStream()
+        write_file(seekable, self.reference_scene, compression='zlib')
+        write_file(unseekable, self.reference_scene, compression='zlib')
+        self.assertEqual(seekable.getvalue(), unseekable.getvalue())
+        wrapper = BSON(seekable.getvalue()).decode()
+        self.assertEqual(wrapper['compression'], 'zlib')
+
+
+class TestFrameCodecs(unittest.TestCase):
+    def setUp(self):
+        self.reference_scene = dir_to_scene(IMAGE_STACK_FOLDER)
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_lossless_round_trip(self):
+        reference_manager = self.reference_scene.image_manager
+        for version in ['0.1', '2.0']:
+            for frame_codec in ['raw', 'zlib']:
+                path = os.path.join(self.tmp_dir,
+                                    '{}_{}.gc'.format(version, frame_codec))
+                encoder = BinaryArrayStackEncoder(frame_codec)
+                with open(path, 'wb') as out_file:
+                    write_file(out_file, self.reference_scene,
+                               version=version, encoder=encoder)
+                scene = read_gcfile(path)
+                for key in reference_manager.keys:
+                    np.testing.assert_array_equal(
+                        reference_manager.load_array(key),
+                        scene.image_manager.load_array(key))
+
+    def test_unknown_codec(self):
+        self.assertRaises(ValueError, BinaryArrayStackEncoder, 'gif')
+
+    def test_pickled_frame_rejected(self):
+        array = np.array([{'payload': 1}, None], dtype=object)
+        self.assertRaises(ValueError, bytes_to_array, array_to_bytes(array))
+
+
+class TestParallelDecoding(unittest.TestCase):
+    def setUp(self):
+        reference_scene = dir_to_scene(IMAGE_STACK_FOLDER)
+        self.data = BinaryArrayStackEncoder().data_from_scene(reference_scene)
+
+    def test_parallel_map(self):
+        items = range(100)
+        self.assertEqual(parallel_map(str, items, 4),
+                         [str(item) for item in items])
+        self.assertEqual(parallel_map(str, items, 1),
+                         [str(item) for item in items])
+        self.assertEqual(parallel_map(str, [], 4), [])
+
+    def test_parallel_iter(self):
+        items = range(10)
+        for workers in [1, 3, 4]:
+            self.assertEqual(list(parallel_iter(str, items, workers)),
+                             [str(item) for item in items])
+        self.assertEqual(list(parallel_iter(str, [], 4)), [])
+
+    def test_parallel_equals_serial(self):
+        serial_scene = BinaryArrayStackDecoder(workers=1).scene_from_data(
+            self.data)
+        parallel_scene = BinaryArrayStackDecoder(workers=4).scene_from_data(
+            self.data)
+        for key in serial_scene.image_manager.keys:
+            np.testing.assert_array_equal(
+                serial_scene.image_manager.load_array(key),
+                parallel_scene.image_manager.load_array(key))
+
+    def test_lazy_iteration_parallel(self):
+        serial_scene = BinaryArrayStackDecoder(workers=1).scene_from_data(
+            self.data)
+        lazy_scene = BinaryArrayStackDecoder(
+            lazy=True, workers=4).scene_from_data(self.data)
+        self.assertEqual(lazy_scene.image_manager.workers, 4)
+        for serial_frame, lazy_frame in zip(serial_scene.iter_images,
+                                            lazy_scene.iter_images):
+            np.testing.assert_array_equal(serial_frame, lazy_frame)
+
+    def test_frame_cache_within_budget(self):
+        scene = BinaryArrayStackDecoder(
+            lazy=True, workers=4).scene_from_data(self.data)
+        image_manager = scene.image_manager
+        image_manager.cache_budget = 2 * image_manager.load_array(0).nbytes
+        decode = image_manager._decode
+        decoded = []
+        alive_counts = []
+
+        def recording_decode(data):
+            alive_counts.append(sum(ref() is not None for ref in decoded))
+            array = decode(data)
+            decoded.append(weakref.ref(array))
+            return array
+
+        image_manager._decode = recording_decode
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            gc_path = os.path.join(tmp_dir, 'example.gc')
+            open(gc_path, 'wb').close()
+            write_frame_cache(gc_path, scene, cache_dir=tmp_dir)
+            self.assertIsInstance(scene.image_manager, MemmapImageManager)
+            self.assertEqual(len(decoded), len(image_manager.keys) - 1)
+            # The cached frames, the batch being decoded and the one being
+            # written, never all frames.
+            self.assertLessEqual(max(alive_counts), 2 + 2 * 4)
+            for key in image_manager.keys:
+                np.testing.assert_array_equal(
+                    scene.image_manager.load_array(key),
+                    image_manager.load_array(key))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class TestStreamingWriter(unittest.TestCase):
+    def setUp(self):
+        self.reference_scene = dir_to_scene(IMAGE_STACK_FOLDER)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.test_scene_path = os.path.join(self.tmp_dir, 'example.gc')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_frames_written_incrementally(self):
+        image_manager = self.reference_scene.image_manager
+        load_array = image_manager.load_array
+        written_sizes = []
+
+        def recording_load_array(key):
+            tmp_files = [name for name in os.listdir(self.tmp_dir)
+                         if name.endswith('.tmp')]
+            tmp_path = os.path.join(self.tmp_dir, tmp_files[0])
+            written_sizes.append(os.path.getsize(tmp_path))
+            return load_array(key)
+
+        image_manager.load_array = recording_load_array
+        save_scene(self.test_scene_path, self.reference_scene)
+        del image_manager.load_array
+
+        self.assertEqual(len(written_sizes), len(image_manager.keys))
+        self.assertLess(written_sizes[0], written_sizes[-1])
+        self.assertEqual(os.listdir(self.tmp_dir), ['example.gc'])
+        scene = read_gcfile(self.test_scene_path)
+        self.assertEqual(len(scene.image_manager.keys),
+                         len(image_manager.keys))
+
+    @unittest.skipIf(os.name != 'posix', 'Requires POSIX permissions.')
+    def test_file_mode(self):
+        umask = os.umask(0o027)
+        try:
+            # The umask is process wide, saving must not change it.
+            with mock.patch('os.umask', wraps=os.umask) as umask_mock:
+                save_scene(self.test_scene_path, self.reference_scene)
+        finally:
+            os.umask(umask)
+        self.assertFalse(umask_mock.called)
+        self.assertEqual(os.stat(self.test_scene_path).st_mode & 0o777,
+                         0o640)
+
+        os.chmod(self.test_scene_path, 0o604)
+        save_scene(self.test_scene_path, self.reference_scene)
+        self.assertEqual(os.stat(self.test_scene_path).st_mode & 0o777,
+                         0o604)
+
+    def test_failed_save_keeps_file(self):
+        save_scene(self.test_scene_path, self.reference_scene)
+        with open(self.test_scene_path, 'rb') as in_file:
+            original = in_file.read()
+
+        def failing_load_array(key):
+            raise RuntimeError('Frame unavailable.')
+
+        self.reference_scene.image_manager.load_array = failing_load_array
+        self.assertRaises(RuntimeError, save_scene, self.test_scene_path,
+                          self.reference_scene)
+        with open(self.test_scene_path, 'rb') as in_file:
+            self.assertEqual(in_file.read(), original)
+        self.assertEqual(os.listdir(self.tmp_dir), ['example.gc'])
+
+    def test_target_replaced_in_place(self):
+        save_scene(self.test_scene_path, self.reference_scene)
+        with mock.patch('os.remove', wraps=os.remove) as remove:
+            save_scene(self.test_scene_path, self.reference_scene)
+        self.assertNotIn(mock.call(self.test_scene_path),
+                         remove.call_args_list)
+        self.assertEqual(os.listdir(self.tmp_dir), ['example.gc'])
+
+    def test_replace_without_atomic_rename(self):
+        src_path = os.path.join(self.tmp_dir, 'new')
+        for path, content in [(src_path, b'new'),
+                              (self.test_scene_path, b'old')]:
+            with open(path, 'wb') as out_file:
+                out_file.write(content)
+        rename = os.rename
+
+        def failing_rename(src, dst):
+            if src == src_path:
+                raise OSError('Rename failed.')
+            rename(src, dst)
+
+        # Windows on Python 2 can neither replace nor rename onto a file.
+        with mock.patch('os.name', 'nt'), \
+                mock.patch('os.replace', None, create=True), \
+                mock.patch('os.rename', side_effect=failing_rename):
+            self.assertRaises(OSError, _replace_file, src_path,
+                              self.test_scene_path)
+        with open(self.test_scene_path, 'rb') as in_file:
+            self.assertEqual(in_file.read(), b'old')
+
+        with mock.patch('os.name', 'nt'), \
+                mock.patch('os.replace', None, create=True):
+            _replace_file(src_path, self.test_scene_path)
+        with open(self.test_scene_path, 'rb') as in_file:
+            self.assertEqual(in_file.read(), b'new')
+        self.assertEqual(os.listdir(self.tmp_dir), ['example.gc'])
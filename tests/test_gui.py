@@ -1,19 +1,37 @@
 from __future__ import division, unicode_literals, print_function
 
+import os
 import sys
+import time
 import unittest
 
 import PyQt4.QtCore as qt
 import mock
 import numpy as np
-from PyQt4.QtGui import QApplication
+from PyQt4.QtGui import QApplication, QResizeEvent
 
+from gazer.modules.dof.image_manager import ArrayStackImageManager
+from gazer.modules.dof.interpolator import InstantInterpolator, \
+    LinearInterpolator, SpringInterpolator
+from gazer.modules.dof.lookup_table import ArrayLookupTable
+from gazer.modules.dof.scenes import ImageStackScene
 from gazer.qt_gui.gcwidget import GCImageWidget
+from gazer.qt_gui.render_loop import RenderScheduler
 from gazer.qt_gui import mainwindow
 
+# Use a software OpenGL implementation where no GPU is available.
+os.environ.setdefault('LIBGL_ALWAYS_SOFTWARE', '1')
 app = QApplication(sys.argv)
 
 
+def make_stack_scene():
+    depth_array = np.array([[0, 1], [1, 0]])
+    frames = [np.full([40, 20, 3], i * 100, np.uint8) for i in range(2)]
+    return ImageStackScene(ArrayStackImageManager(frames),
+                           ArrayLookupTable(depth_array),
+                           InstantInterpolator())
+
+
 class TestCoordinateConversion(unittest.TestCase):
     def setUp(self):
         self.mock_scene = mock.MagicMock()
@@ -58,6 +76,368 @@ class TestCoordinateConversion(unittest.TestCase):
         np.testing.assert_allclose(convert((1500, 250)), (1.0, 0.25))
 
 
+class TestTextureRendering(unittest.TestCase):
+    def setUp(self):
+        self.scene = make_stack_scene()
+        self.widget = GCImageWidget(self.scene)
+        self.widget.resize(100, 100)
+        self.painter = mock.MagicMock()
+
+    def test_texture_uploaded_once(self):
+        with mock.patch.object(self.widget, 'bindTexture',
+                               side_effect=[1, 2]) as bind, \
+                mock.patch.object(self.widget, 'drawTexture') as draw:
+            for pos in [(0.2, 0.2), (0.4, 0.1), (0.8, 0.2), (0.2, 0.2)]:
+                self.scene.update_gaze(pos)
+                key, image = self.widget.get_current_frame()
+                self.widget.draw_texture(self.painter, key, image)
+        self.assertEqual(bind.call_count, 2)
+        self.assertEqual([call[0][1] for call in draw.call_args_list],
+                         [1, 1, 2, 1])
+        target = draw.call_args[0][0]
+        self.assertEqual((target.width(), target.height()), (50, 100))
+        self.assertEqual(self.widget.active_pixmap_size, qt.QSize(50, 100))
+
+    def test_textures_released_on_scene_change(self):
+        self.scene.update_gaze((0.2, 0.2))
+        key, image = self.widget.get_current_frame()
+        with mock.patch.object(self.widget, 'bindTexture', return_value=7):
+            self.widget.get_texture(key, image)
+        with mock.patch.object(self.widget, 'deleteTexture') as delete:
+            self.widget.gc_scene = make_stack_scene()
+        delete.assert_called_once_with(7)
+
+    def test_texture_budget(self):
+        self.widget._textures.budget = 4 * 40 * 20
+        with mock.patch.object(self.widget, 'bindTexture',
+                               side_effect=[1, 2]), \
+                mock.patch.object(self.widget, 'deleteTexture') as delete:
+            for pos in [(0.2, 0.2), (0.8, 0.2)]:
+                self.scene.update_gaze(pos)
+                self.widget.get_texture(*self.widget.get_current_frame())
+        delete.assert_called_once_with(1)
+        self.assertEqual(len(self.widget._textures), 1)
+
+    def test_numeric_keys_normalised(self):
+        self.scene.update_gaze((0.8, 0.2))
+        key = self.widget.get_current_frame()[0]
+        with mock.patch.object(self.scene, 'current_frame',
+                               return_value=(1.0, None)):
+            self.assertEqual(self.widget.get_current_frame()[0], key)
+        self.assertEqual(key, (id(self.scene), 1))
+
+    def test_depthmap_key(self):
+        self.widget.toggle_depthmap()
+        key, image = self.widget.get_current_frame()
+        self.assertEqual(key, (id(self.scene), 'depthmap',
+                               id(self.scene.lookup_table.array)))
+        self.assertEqual(image.shape, (2, 2, 3))
+
+    def test_lookup_table_change_releases_textures(self):
+        self.widget.toggle_depthmap()
+        key, image = self.widget.get_current_frame()
+        with mock.patch.object(self.widget, 'bindTexture', return_value=7):
+            self.widget.get_texture(key, image)
+        with mock.patch.object(self.widget, 'deleteTexture') as delete:
+            self.scene.lookup_table = ArrayLookupTable(np.array([[1, 1],
+                                                                 [0, 0]]))
+            new_key = self.widget.get_current_frame()[0]
+        delete.assert_called_once_with(7)
+        self.assertNotEqual(new_key, key)
+
+
+class TestGLPainting(unittest.TestCase):
+    """
+    Paints through a real OpenGL context, e.g. software GL on a virtual
+    display. Skipped where no context can be created.
+    """
+    def setUp(self):
+        self.scene = make_stack_scene()
+        self.widget = GCImageWidget(self.scene)
+        if not self.widget.isValid():
+            self.skipTest('No OpenGL context available.')
+        # Keep painted frames in the back buffer, where grabFrameBuffer
+        # reads them.
+        self.widget.setAutoBufferSwap(False)
+        self.widget.resize(100, 100)
+        self.widget.show()
+        app.processEvents()
+
+    def tearDown(self):
+        self.widget.close()
+
+    def paint_at(self, pos):
+        self.scene.update_gaze(pos)
+        self.widget.repaint()
+        app.processEvents()
+
+    def test_texture_painted(self):
+        with mock.patch.object(self.widget, 'bindTexture',
+                               wraps=self.widget.bindTexture) as bind, \
+                mock.patch.object(self.widget, 'drawTexture',
+                                  wraps=self.widget.drawTexture) as draw:
+            for pos in [(0.8, 0.2), (0.8, 0.2), (0.2, 0.2)]:
+                self.paint_at(pos)
+            self.assertEqual(bind.call_count, 2)
+            self.assertEqual(draw.call_count, 3)
+            self.paint_at((0.8, 0.2))
+        self.assertEqual(bind.call_count, 2)
+        # The frame fills the left half of the widget, keeping its aspect
+        # ratio.
+        image = self.widget.grabFrameBuffer()
+        self.assertEqual(qt.QSize(50, 100), self.widget.active_pixmap_size)
+        self.assertEqual(image.pixel(10, 50) & 0xffffff, 0x646464)
+
+    def test_evicted_texture_deleted(self):
+        self.widget._textures.budget = 4 * 40 * 20
+        with mock.patch.object(self.widget, 'deleteTexture',
+                               wraps=self.widget.deleteTexture) as delete:
+            self.paint_at((0.2, 0.2))
+            texture_id = self.widget._textures.get(self.widget._frame_key(0))
+            self.paint_at((0.8, 0.2))
+        delete.assert_called_once_with(texture_id)
+        self.assertEqual(len(self.widget._textures), 1)
+
+    def test_textures_released_on_scene_change(self):
+        self.paint_at((0.2, 0.2))
+        with mock.patch.object(self.widget, 'makeCurrent',
+                               wraps=self.widget.makeCurrent) as current, \
+                mock.patch.object(self.widget, 'deleteTexture',
+                                  wraps=self.widget.deleteTexture) as delete:
+            self.widget.gc_scene = make_stack_scene()
+        self.assertTrue(current.called)
+        self.assertEqual(delete.call_count, 1)
+        self.assertEqual(len(self.widget._textures), 0)
+
+
+class TestPixmapCache(unittest.TestCase):
+    def setUp(self):
+        self.scene = make_stack_scene()
+        self.widget = GCImageWidget(self.scene, use_textures=False)
+        self.widget.resize(100, 100)
+
+    def test_pixmap_reused(self):
+        self.scene.update_gaze((0.2, 0.2))
+        key, image = self.widget.get_current_frame()
+        pixmap = self.widget.get_pixmap(key, image)
+        self.assertEqual(pixmap.size(), qt.QSize(50, 100))
+        with mock.patch('gazer.qt_gui.gcwidget.array_to_pixmap') as convert:
+            self.assertIs(self.widget.get_pixmap(key, image), pixmap)
+            self.assertFalse(convert.called)
+
+    def test_cleared_on_resize_and_scene_change(self):
+        self.scene.update_gaze((0.2, 0.2))
+        self.widget.get_pixmap(*self.widget.get_current_frame())
+        self.assertEqual(len(self.widget.pixmap_cache), 1)
+        self.widget.resizeEvent(QResizeEvent(qt.QSize(60, 60),
+                                             qt.QSize(100, 100)))
+        self.assertEqual(len(self.widget.pixmap_cache), 0)
+
+        self.widget.get_pixmap(*self.widget.get_current_frame())
+        self.widget.gc_scene = make_stack_scene()
+        self.assertEqual(len(self.widget.pixmap_cache), 0)
+
+    def test_unidentified_frames_not_cached(self):
+        image = np.zeros([10, 10, 3], np.uint8)
+        self.widget.get_pixmap(None, image)
+        self.assertEqual(len(self.widget.pixmap_cache), 0)
+
+
+class TestDirtyTracking(unittest.TestCase):
+    def setUp(self):
+        self.scene = make_stack_scene()
+        self.widget = GCImageWidget(self.scene, use_textures=False)
+        self.widget.resize(100, 100)
+        self.widget.show()
+        app.processEvents()
+
+    def tearDown(self):
+        self.widget.close()
+
+    def test_skip_unchanged_frame(self):
+        self.scene.update_gaze((0.2, 0.2))
+        self.widget.repaint()
+        with mock.patch.object(self.widget, 'update') as update:
+            self.scene.update_gaze((0.3, 0.3))
+            self.widget.request_update()
+            self.assertFalse(update.called)
+
+            self.scene.update_gaze((0.8, 0.2))
+            self.widget.request_update()
+            self.assertTrue(update.called)
+
+    def test_cursor_movement_repaints(self):
+        self.widget.show_cursor = True
+        self.widget.update_gaze(None)
+        self.widget.repaint()
+        with mock.patch.object(self.widget, 'update') as update:
+            self.widget.request_update()
+            self.assertFalse(update.called)
+            self.widget._gaze = qt.QPoint(5, 5)
+            self.widget.request_update()
+            self.assertTrue(update.called)
+
+    def test_cursor_label_shows_painted_frame(self):
+        self.widget.show_cursor = True
+        self.scene.update_gaze((0.8, 0.2))
+        painter = mock.MagicMock()
+        with mock.patch('gazer.qt_gui.gcwidget.QPainter',
+                        return_value=painter), \
+                mock.patch.object(self.scene, 'peek_frame_key',
+                                  return_value=0):
+            self.widget.paintEvent(None)
+        self.assertEqual(painter.drawText.call_args[0][-1], '1')
+
+    def test_unpredictable_scene_repaints_on_gaze(self):
+        scene = mock.MagicMock()
+        scene.peek_frame_key.return_value = None
+        scene.current_frame.return_value = (None, np.zeros([40, 20, 3],
+                                                           np.uint8))
+        scene.gaze_pos = (0.2, 0.2)
+        self.widget.gc_scene = scene
+        self.widget.repaint()
+        with mock.patch.object(self.widget, 'update') as update:
+            self.widget.request_update()
+            self.assertFalse(update.called)
+            scene.gaze_pos = (0.8, 0.2)
+            self.widget.request_update()
+            self.assertTrue(update.called)
+
+    def test_empty_widget_does_not_repaint(self):
+        self.widget.gc_scene = None
+        self.widget.repaint()
+        with mock.patch.object(self.widget, 'update') as update:
+            self.widget.request_update()
+            self.widget.request_update()
+        self.assertFalse(update.called)
+
+
+class PaintCountingWidget(GCImageWidget):
+    def __init__(self, *args, **kwargs):
+        super(PaintCountingWidget, self).__init__(*args, **kwargs)
+        self.paint_count = 0
+
+    def paintEvent(self, event):
+        self.paint_count += 1
+        super(PaintCountingWidget, self).paintEvent(event)
+
+
+def process_events_for(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        app.processEvents()
+        time.sleep(0.005)
+
+
+class TestRepaintsSettle(unittest.TestCase):
+    """
+    Runs the event loop with a still gaze and counts the paints, which stop
+    once the transition to the frame at the gaze position is done.
+    """
+    def setUp(self):
+        depth_array = np.array([[0, 3], [3, 0]])
+        frames = [np.full([40, 20, 3], i * 40, np.uint8) for i in range(4)]
+        self.scene = ImageStackScene(ArrayStackImageManager(frames),
+                                     ArrayLookupTable(depth_array),
+                                     LinearInterpolator())
+        self.widget = PaintCountingWidget(self.scene, use_textures=False)
+        self.widget.resize(100, 100)
+        self.widget.show()
+        process_events_for(0.1)
+
+    def tearDown(self):
+        self.widget.close()
+
+    def assert_settles(self):
+        self.scene.update_gaze((0.8, 0.2))
+        self.widget.request_update()
+        process_events_for(0.3)
+        self.assertEqual(self.scene.interpolator.current_value, 3)
+        paint_count = self.widget.paint_count
+        process_events_for(0.3)
+        self.assertEqual(self.widget.paint_count, paint_count)
+        return paint_count
+
+    def test_transition_without_scheduler(self):
+        start_count = self.widget.paint_count
+        paint_count = self.assert_settles()
+        # One paint per step, without any further gaze samples.
+        self.assertGreaterEqual(paint_count - start_count, 3)
+        self.assertLessEqual(paint_count - start_count, 5)
+
+    def test_transition_with_scheduler(self):
+        scheduler = RenderScheduler(self.widget)
+        ticks = []
+        scheduler.timer.timeout.connect(lambda: ticks.append(None))
+        scheduler.start()
+        try:
+            start_count = self.widget.paint_count
+            paint_count = self.assert_settles()
+        finally:
+            scheduler.stop()
+        self.assertGreater(len(ticks), 10)
+        self.assertGreaterEqual(paint_count - start_count, 1)
+        self.assertLessEqual(paint_count - start_count, 5)
+
+
+class TestRenderScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scene = make_stack_scene()
+        self.widget = GCImageWidget(self.scene, use_textures=False)
+        self.scheduler = RenderScheduler(self.widget)
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def test_start_stop(self):
+        self.scheduler.start()
+        self.assertTrue(self.scheduler.running)
+        self.assertIs(self.widget.render_scheduler, self.scheduler)
+        self.scheduler.tick()
+        self.assertFalse(self.scene.step_on_read)
+
+        self.scheduler.stop()
+        self.assertFalse(self.scheduler.running)
+        self.assertIsNone(self.widget.render_scheduler)
+        self.assertTrue(self.scene.step_on_read)
+
+    def test_tick_advances_scene(self):
+        self.scheduler.start()
+        with mock.patch.object(self.scene, 'tick') as tick, \
+                mock.patch.object(self.widget, 'request_update') as update:
+            self.scheduler.tick()
+        self.assertEqual(tick.call_count, 1)
+        self.assertGreaterEqual(tick.call_args[0][0], 0)
+        self.assertTrue(update.called)
+
+    def test_gaze_samples_do_not_repaint(self):
+        self.scheduler.start()
+        with mock.patch.object(self.widget, 'update') as update:
+            self.widget.update_gaze(None)
+        self.assertFalse(update.called)
+
+    def test_scene_change(self):
+        self.scheduler.start()
+        self.scheduler.tick()
+        new_scene = make_stack_scene()
+        self.widget.gc_scene = new_scene
+        self.scheduler.tick()
+        self.assertTrue(self.scene.step_on_read)
+        self.assertFalse(new_scene.step_on_read)
+
+    def test_stops_without_scene(self):
+        self.scheduler.start()
+        self.widget.gc_scene = None
+        self.scheduler.tick()
+        self.assertFalse(self.scheduler.running)
+        self.assertIs(self.widget.render_scheduler, self.scheduler)
+
+        self.widget.gc_scene = self.scene
+        self.assertTrue(self.scheduler.running)
+        self.scheduler.tick()
+        self.assertFalse(self.scene.step_on_read)
+
+
 class TestMainWindowFunctionality(unittest.TestCase):
     def setUp(self):
         self.window = mainwindow.GazerMainWindow()
@@ -82,3 +462,23 @@ class TestMainWindowFunctionality(unittest.TestCase):
         mock_folder_name = './foobar.lfp'
         self.window.load_image_stack_folder(mock_folder_name)
         self.assert_(task_mock.called)
+
+    def test_interpolator_from_preferences(self):
+        for name, interpolator_class in [('linear', LinearInterpolator),
+                                         (None, SpringInterpolator),
+                                         ('unknown', SpringInterpolator)]:
+            scene = make_stack_scene()
+            with mock.patch('gazer.preferences.get_interpolator_name',
+                            return_value=name):
+                self.window.update_scene(scene)
+            self.assertIsInstance(scene.interpolator, interpolator_class)
+
+    def test_render_scheduler(self):
+        scheduler = self.window.render_scheduler
+        self.assertIs(self.window.render_area.render_scheduler, scheduler)
+        # Without a scene the scheduler stops after its first tick.
+        scheduler.tick()
+        self.assertFalse(scheduler.running)
+        self.window.update_scene(make_stack_scene())
+        self.assertTrue(scheduler.running)
+        scheduler.stop()
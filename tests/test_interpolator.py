@@ -0,0 +1,171 @@
+"""
+Defines unit tests for :mod:`gazer.modules.dof.interpolator` module.
+"""
+
+from __future__ import division, unicode_literals, print_function
+
+import unittest
+
+from gazer.modules.dof.interpolator import ExponentialInterpolator, \
+    INTERPOLATORS, InstantInterpolator, LinearInterpolator, \
+    LinearTimeInterpolator, MAX_ADVANCE_TIME, SplineInterpolator, \
+    SpringInterpolator, TimeInterpolator, make_interpolator
+
+
+class TestStepInterpolators(unittest.TestCase):
+    def test_instant(self):
+        interpolator = InstantInterpolator(0, 5)
+        self.assertEqual(interpolator.make_step(), 5)
+        self.assertEqual(interpolator.current_value, 5)
+
+    def test_linear(self):
+        interpolator = LinearInterpolator(0, 3)
+        self.assertEqual([interpolator.make_step() for __ in range(4)],
+                         [1, 2, 3, 3])
+
+    def test_advance(self):
+        interpolator = LinearInterpolator(0, 10)
+        step_time = 1 / interpolator.steps_per_second
+        self.assertEqual(interpolator.advance(0.5 * step_time), 0)
+        self.assertEqual(interpolator.advance(0.5 * step_time), 1)
+        self.assertEqual(interpolator.advance(3 * step_time), 4)
+
+    def test_advance_independent_of_tick_rate(self):
+        coarse = ExponentialInterpolator(0, 200)
+        fine = ExponentialInterpolator(0, 200)
+        for __ in range(5):
+            coarse.advance(0.02)
+        for __ in range(20):
+            fine.advance(0.005)
+        self.assertEqual(coarse.current_value, fine.current_value)
+
+    def test_advance_limits_catch_up(self):
+        interpolator = LinearInterpolator(0, 1000)
+        interpolator.advance(10)
+        self.assertEqual(interpolator.current_value,
+                         int(MAX_ADVANCE_TIME *
+                             interpolator.steps_per_second))
+
+
+class TestTimeInterpolators(unittest.TestCase):
+    def make_interpolators(self, start=0, target=0):
+        return [LinearTimeInterpolator(start, target, speed=40),
+                SpringInterpolator(start, target, angular_frequency=20),
+                SplineInterpolator(start, target, duration=0.25)]
+
+    def test_reaches_target(self):
+        for interpolator in self.make_interpolators(0, 10):
+            for __ in range(120):
+                interpolator.advance(1 / 60)
+            self.assertEqual(interpolator.current_value, 10)
+            self.assertEqual(interpolator.index, 10)
+
+    def test_independent_of_tick_rate(self):
+        for coarse, fine in zip(self.make_interpolators(0, 10),
+                                self.make_interpolators(0, 10)):
+            for __ in range(5):
+                coarse.advance(0.02)
+            for __ in range(20):
+                fine.advance(0.005)
+            self.assertGreater(coarse.current_value, 0)
+            self.assertLess(coarse.current_value, 10)
+            self.assertAlmostEqual(coarse.current_value, fine.current_value)
+
+    def test_make_step(self):
+        for stepped, advanced in zip(self.make_interpolators(0, 10),
+                                     self.make_interpolators(0, 10)):
+            index = stepped.make_step()
+            self.assertEqual(index, advanced.advance(
+                1 / advanced.steps_per_second))
+            self.assertIsInstance(index, int)
+
+    def test_index_rounds(self):
+        interpolator = LinearTimeInterpolator(0, 10, speed=10)
+        interpolator.advance(0.06)
+        self.assertEqual(interpolator.index, 1)
+        interpolator.advance(0.03)
+        self.assertEqual(interpolator.index, 1)
+
+    def test_linear_speed(self):
+        interpolator = LinearTimeInterpolator(10, 0, speed=20)
+        interpolator.advance(0.1)
+        self.assertAlmostEqual(interpolator.current_value, 8)
+
+    def test_advance_limits_catch_up(self):
+        interpolator = LinearTimeInterpolator(0, 1000, speed=100)
+        interpolator.advance(10)
+        self.assertAlmostEqual(interpolator.current_value,
+                               100 * MAX_ADVANCE_TIME)
+
+    def test_spring_does_not_overshoot(self):
+        interpolator = SpringInterpolator(0, 10, angular_frequency=30)
+        values = []
+        for __ in range(120):
+            interpolator.advance(1 / 60)
+            values.append(interpolator.current_value)
+        self.assertEqual(values, sorted(values))
+        self.assertLessEqual(max(values), 10)
+
+    def test_spring_keeps_velocity_on_retarget(self):
+        interpolator = SpringInterpolator(0, 10)
+        interpolator.advance(0.05)
+        value = interpolator.current_value
+        interpolator.target = 0
+        interpolator.advance(0.001)
+        # Still moving away from the new target right after retargeting.
+        self.assertGreater(interpolator.current_value, value)
+
+    def test_spring_retarget_mid_motion(self):
+        interpolator = SpringInterpolator(0, 10)
+        for __ in range(3):
+            interpolator.advance(1 / 60)
+        # Retarget just ahead of the value while it moves fast.
+        target = interpolator.current_value + 1
+        interpolator.target = target
+        values = []
+        for __ in range(120):
+            interpolator.advance(1 / 60)
+            values.append(interpolator.current_value)
+        self.assertGreater(max(values), target)
+        self.assertEqual(values[-1], target)
+        self.assertEqual(interpolator.velocity, 0)
+
+    def test_spline_duration(self):
+        interpolator = SplineInterpolator(0, 10, duration=0.2)
+        interpolator.advance(0.1)
+        self.assertAlmostEqual(interpolator.current_value, 5)
+        interpolator.advance(0.1)
+        self.assertEqual(interpolator.current_value, 10)
+        self.assertEqual(interpolator.current_speed, 0)
+
+    def test_spline_start_speed(self):
+        interpolator = SplineInterpolator(0, 10, duration=1, start_speed=-5)
+        interpolator.advance(1e-4)
+        self.assertLess(interpolator.current_value, 0)
+        self.assertAlmostEqual(interpolator.current_speed, -5, places=1)
+
+    def test_spline_retarget_is_smooth(self):
+        interpolator = SplineInterpolator(0, 10, duration=0.2)
+        interpolator.advance(0.05)
+        speed = interpolator.current_speed
+        interpolator.target = 20
+        interpolator.advance(1e-6)
+        self.assertAlmostEqual(interpolator.current_speed, speed, places=2)
+        interpolator.advance(0.2)
+        self.assertEqual(interpolator.current_value, 20)
+
+
+class TestMakeInterpolator(unittest.TestCase):
+    def test_default_is_time_based(self):
+        interpolator = make_interpolator()
+        self.assertIsInstance(interpolator, SpringInterpolator)
+        self.assertIsInstance(interpolator, TimeInterpolator)
+
+    def test_by_name(self):
+        for name, interpolator_class in INTERPOLATORS.items():
+            self.assertIsInstance(make_interpolator(name),
+                                  interpolator_class)
+        self.assertRaises(ValueError, make_interpolator, 'unknown')
+
+    def test_new_instances(self):
+        self.assertIsNot(make_interpolator(), make_interpolator())
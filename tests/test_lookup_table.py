@@ -0,0 +1,266 @@
+"""
+Defines unit tests for :mod:`gazer.modules.dof.lookup_table` module.
+"""
+
+from __future__ import division, unicode_literals, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from gazer.modules.dof.lookup_table import ArrayLookupTable, \
+    FovealLookupTable, LookupTable, LytroLookupTable, PyramidLookupTable, \
+    depth_cache_path, make_index_grid, mode_pool, resolution_for_tracker, \
+    FOVEA_AVERAGE, FOVEA_DOMINANT
+
+
+def assert_matches_sample_position(lut, positions):
+    values = lut.sample_positions(positions)
+    assert len(values) == len(positions)
+    for pos, value, masked in zip(positions, values.data, values.mask):
+        expected = lut.sample_position(pos)
+        if expected is None:
+            assert masked, pos
+        else:
+            assert not masked, pos
+            assert value == expected, (pos, value, expected)
+
+
+class ConstantLookupTable(LookupTable):
+    def sample_position(self, pos):
+        return 3 if pos[0] < 1 else None
+
+
+class TestArrayLookupTable(unittest.TestCase):
+    def setUp(self):
+        random_state = np.random.RandomState(0)
+        self.array = random_state.randint(0, 40, size=(30, 20))
+        self.rgb_array = np.dstack([self.array] * 3).astype(np.uint8)
+
+    def test_index_grid_dtype(self):
+        self.assertEqual(make_index_grid(self.array).dtype, np.uint8)
+        self.assertEqual(make_index_grid(self.array * 100).dtype, np.uint16)
+        self.assertEqual(make_index_grid(self.array - 20).dtype, np.int8)
+        grid = make_index_grid(self.array + 0.5)
+        self.assertEqual(grid.dtype, np.float64)
+        np.testing.assert_array_equal(grid, self.array + 0.5)
+
+    def test_index_grid_rgb(self):
+        rgb_array = self.rgb_array.copy()
+        rgb_array[0, 0] = [1, 2, 4]
+        grid = make_index_grid(rgb_array)
+        self.assertEqual(grid.shape, self.array.shape)
+        self.assertAlmostEqual(grid[0, 0], 7 / 3)
+        np.testing.assert_array_equal(grid[1:], self.array[1:])
+
+    def test_sample_position(self):
+        for array in [self.array, self.rgb_array]:
+            lut = ArrayLookupTable(array)
+            for pos in [(0, 0), (0.5, 0.25), (0.99, 0.99), (0.3, 0.7)]:
+                expected = np.average(array[int(30 * pos[1]),
+                                            int(20 * pos[0])])
+                self.assertEqual(lut.sample_position(pos), expected)
+
+    def test_sample_out_of_range(self):
+        lut = ArrayLookupTable(self.array)
+        self.assertIsNone(lut.sample_position((1, 0.5)))
+        self.assertIsNone(lut.sample_position((0.5, 1.5)))
+        self.assertIsNone(lut.sample_position((-0.5, 0.5)))
+        self.assertIsNone(ArrayLookupTable(np.zeros([1, 5]))
+                          .sample_position((0.5, 0.5)))
+
+    def test_sample_positions(self):
+        positions = np.random.RandomState(1).uniform(-0.2, 1.2, (500, 2))
+        for array in [self.array, self.rgb_array, self.array + 0.5,
+                      np.zeros([1, 5])]:
+            lut = ArrayLookupTable(array)
+            assert_matches_sample_position(lut, positions)
+        values = ArrayLookupTable(self.array).sample_positions(positions)
+        self.assertTrue(values.mask.any())
+        self.assertFalse(values.mask.all())
+        values = ArrayLookupTable(self.array).sample_positions([(np.nan, 0)])
+        self.assertTrue(values.mask[0])
+
+    def test_default_sample_positions(self):
+        values = ConstantLookupTable().sample_positions([(0, 0), (2, 0)])
+        np.testing.assert_array_equal(values.mask, [False, True])
+        self.assertEqual(values[0], 3)
+
+    def test_replace_array(self):
+        lut = ArrayLookupTable(self.array)
+        lut.array = np.full([4, 4], 7)
+        self.assertEqual(lut.sample_position((0.9, 0.9)), 7)
+
+
+class TestFovealLookupTable(unittest.TestCase):
+    def setUp(self):
+        random_state = np.random.RandomState(3)
+        self.array = random_state.randint(0, 4, size=(24, 30))
+
+    def brute_force(self, lut, pos):
+        rows, columns = self.array.shape
+        row, column = int(rows * pos[1]), int(columns * pos[0])
+        radius = lut.window_radius
+        window = self.array[max(row - radius, 0):row + radius + 1,
+                            max(column - radius, 0):column + radius + 1]
+        if lut.mode == FOVEA_AVERAGE:
+            return int(np.round(window.mean()))
+        counts = np.bincount(window.flat, minlength=4)
+        if counts[self.array[row, column]] == counts.max():
+            return self.array[row, column]
+        return counts.argmax()
+
+    def test_sample_position(self):
+        positions = np.random.RandomState(4).rand(200, 2)
+        for mode in [FOVEA_DOMINANT, FOVEA_AVERAGE]:
+            for radius in [0, 0.05, 0.2, 2]:
+                lut = FovealLookupTable(self.array, radius, mode)
+                for pos in positions:
+                    self.assertEqual(lut.sample_position(pos),
+                                     self.brute_force(lut, pos))
+
+    def test_sample_positions(self):
+        positions = np.random.RandomState(5).uniform(-0.2, 1.2, (300, 2))
+        for mode in [FOVEA_DOMINANT, FOVEA_AVERAGE]:
+            for array in [self.array, self.array + 0.5,
+                          np.dstack([self.array] * 3)]:
+                lut = FovealLookupTable(array, 0.1, mode)
+                assert_matches_sample_position(lut, positions)
+
+    def test_zero_radius_matches_array_lookup_table(self):
+        positions = np.random.RandomState(6).rand(100, 2)
+        lut = FovealLookupTable(self.array, 0)
+        reference = ArrayLookupTable(self.array)
+        for pos in positions:
+            self.assertEqual(lut.sample_position(pos),
+                             reference.sample_position(pos))
+
+    def test_stable_at_edge(self):
+        array = np.zeros([20, 20], np.uint8)
+        array[:, 10:] = 1
+        array[5, 9] = 1
+        lut = FovealLookupTable(array, 0.15)
+        # A single outlier is outvoted by its neighbourhood.
+        self.assertEqual(lut.sample_position((9.5 / 20, 5.5 / 20)), 0)
+        self.assertEqual(ArrayLookupTable(array).sample_position(
+            (9.5 / 20, 5.5 / 20)), 1)
+
+    def test_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            FovealLookupTable(self.array, mode='median')
+
+
+class TestPyramidLookupTable(unittest.TestCase):
+    def setUp(self):
+        random_state = np.random.RandomState(7)
+        self.array = random_state.randint(0, 5, size=(37, 50)).astype(np.uint8)
+
+    def test_mode_pool(self):
+        pooled = mode_pool(self.array, 4)
+        self.assertEqual(pooled.shape, (10, 13))
+        self.assertEqual(pooled.dtype, np.uint8)
+        for row in range(10):
+            for column in range(13):
+                block = self.array[row * 4:row * 4 + 4,
+                                   column * 4:column * 4 + 4]
+                counts = np.bincount(block.flat)
+                self.assertEqual(pooled[row, column], counts.argmax())
+
+    def test_resolution(self):
+        lut = PyramidLookupTable(self.array, max_resolution=(10, 10))
+        self.assertEqual(lut.factor, 8)
+        self.assertEqual(lut._grid.shape, (5, 7))
+        self.assertIs(lut.array, self.array)
+
+        lut = PyramidLookupTable(self.array, max_resolution=(100, 100))
+        self.assertEqual(lut.factor, 1)
+        reference = ArrayLookupTable(self.array)
+        for pos in np.random.RandomState(8).rand(100, 2):
+            self.assertEqual(lut.sample_position(pos),
+                             reference.sample_position(pos))
+
+    def test_sample_position(self):
+        lut = PyramidLookupTable(self.array, max_resolution=(25, 19))
+        self.assertEqual(lut.factor, 2)
+        pooled = mode_pool(self.array, 2)
+        for pos in np.random.RandomState(9).rand(100, 2):
+            row, column = int(37 * pos[1]), int(50 * pos[0])
+            self.assertEqual(lut.sample_position(pos),
+                             pooled[row // 2, column // 2])
+        self.assertIsNone(lut.sample_position((1.0, 0.5)))
+
+    def test_sample_positions(self):
+        lut = PyramidLookupTable(self.array, max_resolution=(12, 12))
+        positions = np.random.RandomState(10).uniform(-0.2, 1.2, (300, 2))
+        assert_matches_sample_position(lut, positions)
+
+    def test_resolution_for_tracker(self):
+        self.assertEqual(resolution_for_tracker((1920, 1080), 40, 0.5),
+                         (192, 108))
+        self.assertEqual(resolution_for_tracker((10, 10), 0.1), (10, 10))
+
+
+class TestLytroLookupTable(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.depth_txt = os.path.join(self.tmp_dir, 'depth.txt')
+        self.values = np.arange(12) * 0.25 - 1
+        with open(self.depth_txt, 'w') as depth_file:
+            for value in self.values:
+                depth_file.write('{}\n'.format(value))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parse(self):
+        lut = LytroLookupTable((3, 4), (30, 40), self.depth_txt,
+                               use_cache=False)
+        expected = self.values.reshape((3, 4)).T
+        np.testing.assert_array_equal(lut._depth_data, expected)
+        self.assertEqual(lut.sample_position((0, 0)), expected[0, 0])
+        self.assertEqual(lut.sample_position((15, 20)), expected[1, 1])
+        self.assertFalse(os.path.exists(depth_cache_path(self.depth_txt)))
+
+    def test_sample_positions(self):
+        # A square table, so the transposed indexing of sample_position
+        # stays in bounds.
+        square_txt = os.path.join(self.tmp_dir, 'depth_square.txt')
+        with open(square_txt, 'w') as depth_file:
+            depth_file.write('\n'.join(str(value) for value in range(16)))
+        lut = LytroLookupTable((4, 4), (40, 40), square_txt,
+                               use_cache=False)
+        positions = np.random.RandomState(2).uniform(-10, 50, (500, 2))
+        assert_matches_sample_position(lut, positions)
+
+    def test_wrong_size(self):
+        with self.assertRaises(ValueError):
+            LytroLookupTable((3, 5), (30, 40), self.depth_txt)
+
+    def test_cache(self):
+        lut = LytroLookupTable((3, 4), (30, 40), self.depth_txt)
+        cache_path = depth_cache_path(self.depth_txt)
+        self.assertTrue(os.path.exists(cache_path))
+
+        # Values in the text file are ignored while the cache is newer.
+        with open(self.depth_txt, 'w') as depth_file:
+            depth_file.write('\n'.join(['2'] * 12))
+        mtime = os.path.getmtime(cache_path)
+        os.utime(self.depth_txt, (mtime - 10, mtime - 10))
+
+        cached_lut = LytroLookupTable((3, 4), (30, 40), self.depth_txt)
+        np.testing.assert_array_equal(cached_lut._depth_data,
+                                      lut._depth_data)
+
+    def test_outdated_cache(self):
+        LytroLookupTable((3, 4), (30, 40), self.depth_txt)
+        cache_path = depth_cache_path(self.depth_txt)
+        mtime = os.path.getmtime(self.depth_txt)
+        os.utime(cache_path, (mtime - 10, mtime - 10))
+        with open(self.depth_txt, 'w') as depth_file:
+            depth_file.write('\n'.join(['2'] * 12))
+
+        lut = LytroLookupTable((3, 4), (30, 40), self.depth_txt)
+        np.testing.assert_array_equal(lut._depth_data, np.full((4, 3), 2.0))
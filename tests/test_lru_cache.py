@@ -0,0 +1,66 @@
+"""
+Defines unit tests for :mod:`gazer.lru_cache` module.
+"""
+
+from __future__ import division, unicode_literals, print_function
+
+import unittest
+
+from gazer.lru_cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    def setUp(self):
+        self.evicted = []
+        self.cache = LRUCache(budget=300,
+                              on_evict=lambda key, value:
+                              self.evicted.append(key))
+
+    def test_get(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.put('a', 'frame a', 100)
+        self.assertEqual(self.cache.get('a'), 'frame a')
+        self.assertIn('a', self.cache)
+        self.assertEqual(self.cache.size, 100)
+
+    def test_replace(self):
+        self.cache.put('a', 'frame a', 100)
+        self.cache.put('a', 'new frame a', 50)
+        self.assertEqual(self.cache.get('a'), 'new frame a')
+        self.assertEqual(self.cache.size, 50)
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.evicted, ['a'])
+
+    def test_evict_least_recently_used(self):
+        for key in ['a', 'b', 'c']:
+            self.cache.put(key, key, 100)
+        self.cache.get('a')
+        self.cache.put('d', 'd', 100)
+        self.assertNotIn('b', self.cache)
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual(self.cache.size, 300)
+        self.assertEqual(self.evicted, ['b'])
+
+    def test_keep_latest_over_budget(self):
+        self.cache.put('a', 'a', 100)
+        self.cache.put('big', 'big', 1000)
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.get('big'), 'big')
+
+    def test_keep_pinned(self):
+        for key in ['a', 'b', 'c']:
+            self.cache.put(key, key, 100)
+        self.cache.pin('a')
+        self.cache.put('d', 'd', 200)
+        self.assertEqual(self.evicted, ['b', 'c'])
+        self.assertIn('a', self.cache)
+        self.cache.pin(None)
+        self.cache.put('e', 'e', 100)
+        self.assertEqual(self.evicted, ['b', 'c', 'a'])
+
+    def test_clear(self):
+        self.cache.put('a', 'a', 100)
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.size, 0)
+        self.assertEqual(self.evicted, ['a'])
@@ -0,0 +1,130 @@
+"""
+Defines unit tests for :mod:`gazer.modules.dof.lytro_batch` module.
+"""
+
+from __future__ import division, unicode_literals, print_function
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+from gazer.gcio import load_scene
+from gazer.modules.dof.lytro_batch import BatchJournal, \
+    find_light_field_files, run_batch, JOURNAL_FILE_NAME
+from gazer.modules.dof.image_manager import ArrayStackImageManager
+from gazer.modules.dof.lookup_table import ArrayLookupTable
+from gazer.modules.dof.scenes import ImageStackScene
+
+
+class FakeImport(object):
+    def __init__(self, fail=(), error=RuntimeError):
+        self.fail = fail
+        self.error = error
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, path, config, workers=None):
+        with self.lock:
+            self.calls.append((os.path.basename(path), workers))
+        if os.path.basename(path) in self.fail:
+            raise self.error('Import failed.')
+        frames = [np.full([4, 4, 3], i * 50, np.uint8) for i in range(3)]
+        lookup_table = ArrayLookupTable(np.zeros([4, 4], np.int64))
+        return ImageStackScene(ArrayStackImageManager(frames), lookup_table)
+
+
+class TestLytroBatch(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.in_dir = os.path.join(self.tmp_dir, 'captures')
+        self.out_dir = os.path.join(self.tmp_dir, 'out')
+        os.mkdir(self.in_dir)
+        for name in ['a.lfp', 'b.LFX', 'c.lfp', 'notes.txt']:
+            with open(os.path.join(self.in_dir, name), 'wb') as out_file:
+                out_file.write(name.encode('utf-8'))
+        self.files = find_light_field_files([self.in_dir])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_find_files(self):
+        names = [os.path.basename(path) for path in self.files]
+        self.assertEqual(names, ['a.lfp', 'b.LFX', 'c.lfp'])
+        pattern = os.path.join(self.in_dir, '*.lfp')
+        self.assertEqual(find_light_field_files([pattern, self.in_dir]),
+                         [self.files[0], self.files[2], self.files[1]])
+
+    def test_convert(self):
+        import_func = FakeImport()
+        results = run_batch(self.files, self.out_dir, {}, jobs=2,
+                            cpu_budget=6, import_func=import_func)
+        self.assertEqual(set(results.values()), {'done'})
+        self.assertEqual(set(workers for __, workers in import_func.calls),
+                         {3})
+        for name in ['a', 'b', 'c']:
+            scene = load_scene(os.path.join(self.out_dir, name + '.gc'))
+            self.assertEqual(len(list(scene.image_manager.keys)), 3)
+
+    def test_resume(self):
+        import_func = FakeImport(fail=['b.LFX'])
+        results = run_batch(self.files, self.out_dir, {}, jobs=1,
+                            import_func=import_func)
+        self.assertEqual(results[self.files[1]], 'failed')
+        self.assertFalse(os.path.exists(os.path.join(self.out_dir, 'b.gc')))
+
+        import_func = FakeImport()
+        results = run_batch(self.files, self.out_dir, {}, jobs=1,
+                            cpu_budget=1, import_func=import_func)
+        self.assertEqual([results[path] for path in self.files],
+                         ['skipped', 'done', 'skipped'])
+        self.assertEqual(import_func.calls, [('b.LFX', 1)])
+
+    def test_unexpected_error_recorded(self):
+        import_func = FakeImport(fail=['a.lfp'], error=KeyError)
+        results = run_batch(self.files, self.out_dir, {}, jobs=1,
+                            import_func=import_func)
+        self.assertEqual([results[path] for path in self.files],
+                         ['failed', 'done', 'done'])
+        journal = BatchJournal(os.path.join(self.out_dir, JOURNAL_FILE_NAME))
+        self.assertFalse(journal.is_done(self.files[0],
+                                         os.path.join(self.out_dir, 'a.gc')))
+
+    def test_output_collisions_fail(self):
+        other_dir = os.path.join(self.tmp_dir, 'more')
+        os.mkdir(other_dir)
+        for name in ['a.lfp', 'd.lfp']:
+            with open(os.path.join(other_dir, name), 'wb') as out_file:
+                out_file.write(name.encode('utf-8'))
+        files = self.files + find_light_field_files([other_dir])
+        import_func = FakeImport()
+        results = run_batch(files, self.out_dir, {}, jobs=1,
+                            import_func=import_func)
+        self.assertEqual([results[path] for path in files],
+                         ['failed', 'done', 'done', 'failed', 'done'])
+        self.assertEqual(sorted(name for name, __ in import_func.calls),
+                         ['b.LFX', 'c.lfp', 'd.lfp'])
+        self.assertFalse(os.path.exists(os.path.join(self.out_dir, 'a.gc')))
+
+    def test_changed_input_is_converted_again(self):
+        run_batch(self.files, self.out_dir, {}, import_func=FakeImport())
+        with open(self.files[0], 'ab') as out_file:
+            out_file.write(b'changed')
+        os.remove(os.path.join(self.out_dir, 'c.gc'))
+
+        import_func = FakeImport()
+        run_batch(self.files, self.out_dir, {}, jobs=1,
+                  import_func=import_func)
+        self.assertEqual([name for name, __ in import_func.calls],
+                         ['a.lfp', 'c.lfp'])
+
+    def test_journal_persisted(self):
+        run_batch(self.files[:1], self.out_dir, {}, import_func=FakeImport())
+        journal = BatchJournal(os.path.join(self.out_dir, JOURNAL_FILE_NAME))
+        self.assertTrue(journal.is_done(self.files[0],
+                                        os.path.join(self.out_dir, 'a.gc')))
+        self.assertFalse(journal.is_done(self.files[1],
+                                         os.path.join(self.out_dir, 'b.gc')))
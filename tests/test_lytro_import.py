@@ -1,11 +1,55 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import mock
 import numpy as np
+from scipy import misc
+
+from gazer.modules.dof.lytro_import import value_map_to_index_map, \
+    remap, ifp_to_dof_data, plan_focal_planes, get_main_depth_planes, \
+    make_focus_image
+from gazer.modules.dof.render_cache import RenderCache
+
+
+class FakeTnt(object):
+    """
+    Stand-in for the Tnt command line wrapper that writes a small image
+    instead of rendering the light field and records its concurrency.
+    """
+    lock = threading.Lock()
+    running = 0
+    max_running = 0
+    fail_focus = None
+
+    def __init__(self, verbose=False):
+        self.args = {}
 
-try:
-    from gazer.modules.dof.lytro_import import value_map_to_index_map, remap
-except ImportError:
-    from nose.plugins.skip import SkipTest
+    def __getattr__(self, name):
+        def set_arg(value):
+            self.args[name] = value
+        return set_arg
 
-    raise SkipTest("Test module {} is skipped.".format(__name__))
+    def execute(self):
+        with FakeTnt.lock:
+            FakeTnt.running += 1
+            FakeTnt.max_running = max(FakeTnt.max_running, FakeTnt.running)
+        try:
+            time.sleep(0.05)
+            if self.args['focus'] == FakeTnt.fail_focus:
+                raise RuntimeError('Tnt failed.')
+            image = np.full([4, 4, 3], float(self.args['focus']), np.uint8)
+            misc.imsave(self.args['image_out'], image)
+        finally:
+            with FakeTnt.lock:
+                FakeTnt.running -= 1
+
+
+def fake_depth_data(lfp_in):
+    depth_map = np.array([[0, 51], [102, 255]], np.uint8)
+    return depth_map, {'LambdaMin': 0, 'LambdaMax': 255}
 
 
 def test_value_map_to_index_map():
@@ -48,8 +92,167 @@ def test_value_map_to_index_map_simple():
     np.testing.assert_array_equal(index_map, expected)
 
 
+def test_value_map_to_index_map_ties():
+    index_list = [24, 22, 0, 30, 26]
+    value_map = np.array(
+            [
+                [23, 25, 28],
+                [11, 22, 255],
+            ],
+            dtype=np.uint8
+    )
+    index_map = value_map_to_index_map(value_map, index_list)
+    expected = np.array(
+            [
+                [0, 0, 3],
+                [1, 1, 3],
+            ]
+    )
+    np.testing.assert_array_equal(index_map, expected)
+
+
+def test_value_map_to_index_map_matches_argmin():
+    index_list = [200, 3, 17, 17, 90, 64]
+    value_map = np.random.RandomState(0).randint(0, 256, size=(40, 30))
+    index_map = value_map_to_index_map(value_map, index_list)
+    index_array = np.array(index_list)
+    expected = [np.abs(index_array - value).argmin()
+                for value in value_map.flat]
+    expected = np.array(expected).reshape(value_map.shape)
+    np.testing.assert_array_equal(index_map, expected)
+
+
 def test_remap():
     from_range = 0, 1
     to_range = 10, 20
     mapped = remap(0.5, from_range, to_range)
     np.testing.assert_allclose(mapped, 15)
+
+
+@mock.patch('gazer.modules.dof.lytro_import.get_depth_data', fake_depth_data)
+@mock.patch('gazer.modules.dof.lytro_import.Tnt', FakeTnt)
+def test_concurrent_rendering():
+    FakeTnt.max_running = 0
+    FakeTnt.fail_focus = None
+    statuses = []
+    out_path = tempfile.mkdtemp()
+    try:
+        dof_data = ifp_to_dof_data('capture.lfp', 'calibration', out_path,
+                                   statuses.append, workers=4)
+    finally:
+        shutil.rmtree(out_path)
+    assert FakeTnt.max_running == 4
+    assert statuses == ['1/4', '2/4', '3/4', '4/4']
+    for depth, image in dof_data.frame_mapping.items():
+        assert image[0, 0, 0] == depth
+
+
+@mock.patch('gazer.modules.dof.lytro_import.get_depth_data', fake_depth_data)
+@mock.patch('gazer.modules.dof.lytro_import.Tnt', FakeTnt)
+def test_rendering_stops_on_failure():
+    FakeTnt.fail_focus = '51.0'
+    statuses = []
+    out_path = tempfile.mkdtemp()
+    try:
+        try:
+            ifp_to_dof_data('capture.lfp', 'calibration', out_path,
+                            statuses.append, workers=1)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError('Failure was not propagated.')
+        rendered = os.listdir(out_path)
+    finally:
+        FakeTnt.fail_focus = None
+        shutil.rmtree(out_path)
+    assert statuses == ['1/4']
+    assert rendered == ['capture_f_0.0.jpg']
+
+
+@mock.patch('gazer.modules.dof.lytro_import.Tnt', None)
+def test_rendering_without_lpt():
+    try:
+        make_focus_image('capture.lfp', 'capture.jpg', 0.0, 'calibration')
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError('Missing Lytro Power Tools not reported.')
+
+
+def test_plan_focal_planes_keeps_few_values():
+    depth_map = np.array([[3, 3, 90], [90, 200, 3]], np.uint8)
+    planes = plan_focal_planes(depth_map, max_planes=4)
+    np.testing.assert_array_equal(planes, [3, 90, 200])
+
+
+def test_plan_focal_planes_clusters():
+    random_state = np.random.RandomState(1)
+    clusters = [random_state.randint(centre - 5, centre + 6, size=1000)
+                for centre in [20, 120, 230]]
+    depth_map = np.concatenate(clusters).astype(np.uint8).reshape(60, 50)
+    planes = plan_focal_planes(depth_map, max_planes=3)
+    assert len(planes) == 3
+    assert planes.dtype == np.uint8
+    np.testing.assert_allclose(planes, [20, 120, 230], atol=1)
+
+
+def test_plan_focal_planes_caps_number():
+    depth_map = np.arange(256, dtype=np.uint8).reshape(16, 16)
+    for max_planes in [1, 5, 16, 255]:
+        planes = plan_focal_planes(depth_map, max_planes)
+        assert 0 < len(planes) <= max_planes
+        assert np.all(np.diff(planes.astype(int)) > 0)
+
+
+def test_get_main_depth_planes():
+    depth_map = np.array([[1, 1, 1, 2], [1, 1, 3, 3]])
+    assert get_main_depth_planes(depth_map, threshold=0.2) == [1, 3]
+
+
+@mock.patch('gazer.modules.dof.lytro_import.get_depth_data', fake_depth_data)
+@mock.patch('gazer.modules.dof.lytro_import.Tnt', FakeTnt)
+def test_rendering_limited_planes():
+    FakeTnt.fail_focus = None
+    out_path = tempfile.mkdtemp()
+    try:
+        dof_data = ifp_to_dof_data('capture.lfp', 'calibration', out_path,
+                                   max_planes=2)
+        rendered = os.listdir(out_path)
+    finally:
+        shutil.rmtree(out_path)
+    assert len(rendered) == 2
+    planes = sorted(dof_data.frame_mapping.keys())
+    assert len(planes) == 2
+    np.testing.assert_array_equal(np.unique(dof_data.depth_array), planes)
+
+
+@mock.patch('gazer.modules.dof.lytro_import.Tnt', FakeTnt)
+def test_rendering_uses_render_cache():
+    FakeTnt.fail_focus = None
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        lfp_in = os.path.join(tmp_dir, 'capture.lfp')
+        with open(lfp_in, 'wb') as out_file:
+            out_file.write(b'light field')
+        out_path = os.path.join(tmp_dir, 'out')
+        os.mkdir(out_path)
+        render_cache = RenderCache(os.path.join(tmp_dir, 'cache'))
+        with mock.patch('gazer.modules.dof.lytro_import.make_focus_image',
+                        wraps=make_focus_image) as render, \
+                mock.patch('gazer.modules.dof.lytro_import.get_depth_data',
+                           wraps=fake_depth_data) as render_depth:
+            first = ifp_to_dof_data(lfp_in, 'calibration', out_path,
+                                    render_cache=render_cache)
+            assert render.call_count == 4
+            assert render_depth.call_count == 1
+            second = ifp_to_dof_data(lfp_in, 'calibration', out_path,
+                                     render_cache=render_cache)
+            assert render.call_count == 4
+            assert render_depth.call_count == 1
+        assert os.listdir(out_path) == []
+        assert len(os.listdir(render_cache.cache_dir)) == 5
+    finally:
+        shutil.rmtree(tmp_dir)
+    np.testing.assert_array_equal(first.depth_array, second.depth_array)
+    for depth, image in first.frame_mapping.items():
+        np.testing.assert_array_equal(second.frame_mapping[depth], image)
@@ -0,0 +1,98 @@
+"""
+Defines unit tests for :mod:`gazer.modules.dof.render_cache` module.
+"""
+
+from __future__ import division, unicode_literals, print_function
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from gazer.modules.dof.render_cache import DEPTH_EXTENSION, RenderCache, \
+    file_hash
+
+
+class TestRenderCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = RenderCache(os.path.join(self.tmp_dir, 'cache'),
+                                 max_size=250)
+        self.renders = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def render(self, path):
+        self.renders.append(path)
+        with open(path, 'wb') as out_file:
+            out_file.write(b'x' * 100)
+
+    def test_key(self):
+        key = RenderCache.key('abc', 'calibration', 1.5, (10, 20))
+        self.assertEqual(key, RenderCache.key('abc', 'calibration', 1.5,
+                                              (10, 20)))
+        self.assertNotEqual(key, RenderCache.key('abd', 'calibration', 1.5,
+                                                 (10, 20)))
+        self.assertNotEqual(key, RenderCache.key('abc', 'other', 1.5,
+                                                 (10, 20)))
+        self.assertNotEqual(key, RenderCache.key('abc', 'calibration', 1.25,
+                                                 (10, 20)))
+        self.assertNotEqual(key, RenderCache.key('abc', 'calibration', 1.5))
+
+    def test_file_hash(self):
+        path = os.path.join(self.tmp_dir, 'capture.lfp')
+        with open(path, 'wb') as out_file:
+            out_file.write(b'light field')
+        self.assertEqual(file_hash(path),
+                         hashlib.sha1(b'light field').hexdigest())
+
+    def test_render_once(self):
+        key = RenderCache.key('abc', 'calibration', 1.5)
+        self.assertIsNone(self.cache.lookup(key))
+        path = self.cache.get_or_render(key, self.render)
+        self.assertEqual(path, self.cache.path_for(key))
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(self.cache.get_or_render(key, self.render), path)
+        self.assertEqual(len(self.renders), 1)
+        self.assertNotEqual(self.renders[0], path)
+
+    def test_depth_entry(self):
+        key = RenderCache.depth_key('abc')
+        self.assertNotEqual(key, RenderCache.depth_key('abd'))
+        path = self.cache.get_or_render(key, self.render, DEPTH_EXTENSION)
+        self.assertTrue(path.endswith(DEPTH_EXTENSION))
+        self.assertIsNone(self.cache.lookup(key))
+        self.assertEqual(self.cache.lookup(key, DEPTH_EXTENSION), path)
+        self.assertEqual(self.cache.size, 100)
+
+    def test_failed_render_not_cached(self):
+        def render(path):
+            with open(path, 'wb') as out_file:
+                out_file.write(b'broken')
+            raise RuntimeError('Render failed.')
+
+        with self.assertRaises(RuntimeError):
+            self.cache.get_or_render('key', render)
+        self.assertIsNone(self.cache.lookup('key'))
+        self.assertEqual(os.listdir(self.cache.cache_dir), [])
+
+    def test_evict_least_recently_used(self):
+        for num, key in enumerate(['a', 'b', 'c']):
+            path = self.cache.get_or_render(key, self.render)
+            os.utime(path, (num, num))
+        # Looking up an image marks it as recently used.
+        self.cache.lookup('a')
+        self.assertEqual(self.cache.size, 300)
+
+        self.cache.evict()
+        self.assertEqual(self.cache.size, 200)
+        self.assertIsNone(self.cache.lookup('b'))
+        self.assertIsNotNone(self.cache.lookup('a'))
+        self.assertIsNotNone(self.cache.lookup('c'))
+
+    def test_clear(self):
+        self.cache.get_or_render('a', self.render)
+        self.cache.clear()
+        self.assertEqual(self.cache.size, 0)